@@ -0,0 +1,29 @@
+# auth_utils.py - аутентификация клиентов на стороне API
+import hashlib
+from typing import Any, Dict, Optional
+
+from db_utils import get_client_by_username, create_client
+
+def hash_password(password: str) -> str:
+    """Хеширует пароль"""
+    return hashlib.sha256(password.encode()).hexdigest()
+
+def verify_password(password: str, hashed_password: str) -> bool:
+    """Проверяет пароль"""
+    return hash_password(password) == hashed_password
+
+def authenticate_client(username: str, password: str) -> Optional[Dict[str, Any]]:
+    """Возвращает клиента, если имя пользователя и пароль верны"""
+    client = get_client_by_username(username)
+    if client and verify_password(password, client['password_hash']):
+        return {'id': client['id'], 'username': client['username'], 'email': client['email']}
+    return None
+
+def register_client(username: str, email: str, password: str) -> Optional[Dict[str, Any]]:
+    """Регистрирует клиента; возвращает None, если имя или email уже заняты. Ошибки БД пробрасываются"""
+    if get_client_by_username(username):
+        return None
+    client_id = create_client(username, email, hash_password(password))
+    if client_id is None:
+        return None
+    return {'id': client_id, 'username': username, 'email': email}
@@ -0,0 +1,230 @@
+# bm25_index.py - лексический индекс BM25 по чанкам документов, отдельный для каждого клиента
+import re
+import math
+import heapq
+import logging
+import threading
+import itertools
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+# Самые частые служебные слова: в BM25 они почти не весят, но раздувают списки вхождений
+RUSSIAN_STOPWORDS = frozenset("""
+и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее мне было вот от меня еще
+нет о из ему теперь когда даже ну вдруг ли если уже или ни быть был него до вас нибудь опять уж вам ведь там потом
+себя ничего ей может они тут где есть надо ней для мы тебя их чем была сам чтоб без будто чего раз тоже себе под
+будет ж тогда кто этот того потому этого какой совсем ним здесь этом один почти мой тем чтобы нее были куда зачем
+всех никогда можно при наконец два об другой хоть после над больше тот через эти нас про всего них какая много разве
+три эту моя впрочем хорошо свою этой перед иногда лучше чуть том нельзя такой им более всегда конечно всю между это
+""".split())
+
+try:
+    import snowballstemmer
+    _stemmer = snowballstemmer.stemmer("russian")
+except ImportError:
+    _stemmer = None
+    logging.warning("snowballstemmer is not installed, BM25 works without stemming")
+
+_stem_cache: Dict[str, str] = {}
+# Версии сквозные для всех индексов: перестроенный индекс не повторит версию старого и не поднимет его кэш
+_versions = itertools.count(1)
+
+
+def _stem(word: str) -> str:
+    stem = _stem_cache.get(word)
+    if stem is None:
+        stem = _stemmer.stemWord(word) if _stemmer is not None else word
+        if len(_stem_cache) < 200_000:
+            _stem_cache[word] = stem
+    return stem
+
+
+def tokenize(text: str) -> List[str]:
+    """Нижний регистр, ё -> е, без стоп-слов, со стеммингом Snowball для русского"""
+    words = _TOKEN_RE.findall(text.lower().replace("ё", "е"))
+    return [_stem(word) for word in words if word not in RUSSIAN_STOPWORDS and len(word) > 1]
+
+
+class BM25Index:
+    """Инвертированный индекс: term -> {chunk_id: tf}. Обновляется по документу целиком"""
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._lengths: Dict[str, int] = {}
+        self._chunks: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+        self._files: Dict[Any, Set[str]] = {}
+        self._total_length = 0
+        # Растет при каждом изменении: по ней инвалидируются кэши поиска
+        self.version = next(_versions)
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    @property
+    def file_ids(self) -> List[Any]:
+        with self._lock:
+            return list(self._files)
+
+    def add(self, chunk_ids: Iterable[str], texts: Iterable[str], metadatas: Iterable[Dict[str, Any]]) -> None:
+        with self._lock:
+            self.version = next(_versions)
+            for chunk_id, text, metadata in zip(chunk_ids, texts, metadatas):
+                if chunk_id in self._lengths:
+                    self._remove_chunk(chunk_id)
+                counts = Counter(tokenize(text))
+                for term, tf in counts.items():
+                    self._postings.setdefault(term, {})[chunk_id] = tf
+                length = sum(counts.values())
+                self._lengths[chunk_id] = length
+                self._total_length += length
+                self._chunks[chunk_id] = (text, metadata)
+                self._files.setdefault(metadata.get("file_id"), set()).add(chunk_id)
+
+    def _remove_chunk(self, chunk_id: str) -> None:
+        text, metadata = self._chunks.pop(chunk_id)
+        for term in set(tokenize(text)):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(chunk_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= self._lengths.pop(chunk_id)
+        file_chunks = self._files.get(metadata.get("file_id"))
+        if file_chunks is not None:
+            file_chunks.discard(chunk_id)
+            if not file_chunks:
+                del self._files[metadata.get("file_id")]
+
+    def remove_file(self, file_id: Any) -> int:
+        with self._lock:
+            chunk_ids = list(self._files.get(file_id, ()))
+            if chunk_ids:
+                self.version = next(_versions)
+            for chunk_id in chunk_ids:
+                self._remove_chunk(chunk_id)
+            return len(chunk_ids)
+
+    def search(self, query: str, k: int = 20, file_ids: Optional[Set[Any]] = None) -> List[Tuple[str, float]]:
+        """
+        Топ-k чанков по BM25: [(chunk_id, score)].
+        file_ids ограничивает поиск документами; idf при этом считается по всему индексу клиента
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            n = len(self._lengths)
+            if not n or not terms:
+                return []
+            avg_length = self._total_length / n
+            allowed = None
+            if file_ids is not None:
+                allowed = set().union(*(self._files.get(file_id, ()) for file_id in file_ids))
+                if not allowed:
+                    return []
+            scores: Dict[str, float] = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                # Для пары документов быстрее пройти их чанки, чем весь список вхождений
+                if allowed is not None and len(allowed) < len(postings):
+                    matches = ((chunk_id, postings[chunk_id]) for chunk_id in allowed if chunk_id in postings)
+                else:
+                    matches = postings.items()
+                for chunk_id, tf in matches:
+                    if allowed is not None and chunk_id not in allowed:
+                        continue
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[chunk_id] / avg_length)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+            return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def get(self, chunk_id: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            return self._chunks.get(chunk_id)
+
+
+class BM25Registry:
+    """
+    Индексы по клиентам. Индекс клиента строится из Chroma при первом запросе,
+    дальше поддерживается инкрементально при загрузке и удалении документов
+    """
+
+    def __init__(self):
+        self._indexes: Dict[Any, BM25Index] = {}
+        # Клиент -> изменения, пришедшие во время построения его индекса; применяются перед публикацией
+        self._building: Dict[Any, List[Tuple[str, tuple]]] = {}
+        self._build_locks: Dict[Any, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get(self, client_id: Any) -> BM25Index:
+        with self._lock:
+            index = self._indexes.get(client_id)
+            if index is not None:
+                return index
+            build_lock = self._build_locks.setdefault(client_id, threading.Lock())
+        # Построение под замком клиента: параллельный запрос того же клиента ждет готовый индекс,
+        # запросы остальных клиентов не блокируются
+        with build_lock:
+            with self._lock:
+                index = self._indexes.get(client_id)
+                if index is not None:
+                    return index
+                self._building[client_id] = []
+            index = BM25Index()
+            try:
+                self._build(client_id, index)
+            except Exception:
+                # Неудачное построение не кэшируется: следующий запрос попробует снова
+                with self._lock:
+                    self._building.pop(client_id, None)
+                raise
+            with self._lock:
+                changes = self._building.pop(client_id, None)
+                for method, args in changes or ():
+                    getattr(index, method)(*args)
+                # Индекс, сброшенный через invalidate во время построения, отдается этому запросу, но не кэшируется
+                if changes is not None:
+                    self._indexes[client_id] = index
+            return index
+
+    def _build(self, client_id: Any, index: BM25Index) -> None:
+        from chroma_utils import get_vectorstore
+
+        data = get_vectorstore(client_id).get(where={"client_id": client_id}, include=["documents", "metadatas"])
+        index.add(data["ids"], data["documents"], data["metadatas"])
+        logging.info(f"BM25 index for client {client_id}: {len(index)} chunks from {len(index.file_ids)} documents")
+
+    def add_chunks(self, client_id: Any, chunk_ids: List[str], texts: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        """Дописывает чанки нового документа, если индекс клиента уже построен или строится"""
+        with self._lock:
+            index = self._indexes.get(client_id)
+            if index is None and client_id in self._building:
+                self._building[client_id].append(("add", (chunk_ids, texts, metadatas)))
+        if index is not None:
+            index.add(chunk_ids, texts, metadatas)
+
+    def remove_file(self, file_id: Any) -> None:
+        with self._lock:
+            indexes = list(self._indexes.values())
+            for changes in self._building.values():
+                changes.append(("remove_file", (file_id,)))
+        for index in indexes:
+            index.remove_file(file_id)
+
+    def invalidate(self, client_id: Any = None) -> None:
+        """Сбрасывает индекс клиента (или все); следующий запрос перестроит его из Chroma"""
+        with self._lock:
+            if client_id is None:
+                self._indexes.clear()
+                self._building.clear()
+            else:
+                self._indexes.pop(client_id, None)
+                self._building.pop(client_id, None)
+
+
+bm25_registry = BM25Registry()
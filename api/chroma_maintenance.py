@@ -0,0 +1,362 @@
+# chroma_maintenance.py - обслуживание Chroma: статистика сегментов, компактизация, параметры HNSW, снапшоты
+# Запуск: python chroma_maintenance.py <команда>
+import os
+import re
+import json
+import time
+import shutil
+import pickle
+import sqlite3
+import argparse
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+from chroma_utils import (
+    CHROMA_DEDICATED_CLIENTS, CHROMA_DROP_DELAY, CHROMA_PERSIST_DIR, CHROMA_REGISTRY_FILE, active_collection,
+    collection_name, get_vectorstore, release_store, require_exclusive_store, write_lock
+)
+from chroma_migrations import collection_job, rebuild_collection
+from retrieval import RETRIEVAL_DENSE_K
+
+CHROMA_SNAPSHOT_DIR = os.getenv("CHROMA_SNAPSHOT_DIR", "./chroma_snapshots")
+CHROMA_SNAPSHOT_KEEP = int(os.getenv("CHROMA_SNAPSHOT_KEEP", "5"))
+# Доля удаленных элементов в HNSW-индексе, после которой коллекция пересобирается
+CHROMA_COMPACT_RATIO = float(os.getenv("CHROMA_COMPACT_RATIO", "0.2"))
+# Период фоновой компактизации, секунды. По умолчанию 0 - выключена: полная пересборка коллекции
+# запускается только оператором (CLI или /maintenance/chroma/compact)
+CHROMA_MAINTENANCE_INTERVAL = float(os.getenv("CHROMA_MAINTENANCE_INTERVAL", "0"))
+
+HNSW_KEYS = {"M": "hnsw:M", "ef_construction": "hnsw:construction_ef", "ef_search": "hnsw:search_ef"}
+_UUID_RE = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+
+def _sqlite_path() -> str:
+    return os.path.join(CHROMA_PERSIST_DIR, "chroma.sqlite3")
+
+
+def _client_ids() -> List[Optional[int]]:
+    return [None] + sorted(CHROMA_DEDICATED_CLIENTS)
+
+
+def recommended_hnsw(count: int) -> Dict[str, int]:
+    """
+    Параметры HNSW под размер коллекции. ef_search не меньше ширины первого этапа поиска:
+    по умолчанию в Chroma он 10, а векторный поиск просит RETRIEVAL_DENSE_K кандидатов
+    """
+    ef_search = max(64, 2 * RETRIEVAL_DENSE_K)
+    if count < 50_000:
+        return {"M": 16, "ef_construction": 128, "ef_search": ef_search}
+    if count < 500_000:
+        return {"M": 32, "ef_construction": 200, "ef_search": max(ef_search, 100)}
+    return {"M": 48, "ef_construction": 400, "ef_search": max(ef_search, 150)}
+
+
+def hnsw_metadata(m: Optional[int] = None, ef_construction: Optional[int] = None,
+                  ef_search: Optional[int] = None) -> Dict[str, int]:
+    values = {"M": m, "ef_construction": ef_construction, "ef_search": ef_search}
+    return {HNSW_KEYS[key]: value for key, value in values.items() if value is not None}
+
+
+def _segments() -> Dict[str, Dict[str, str]]:
+    """Физическое имя коллекции -> {scope: id сегмента} из служебной базы Chroma (только чтение)"""
+    connection = sqlite3.connect(f"file:{_sqlite_path()}?mode=ro", uri=True)
+    try:
+        rows = connection.execute(
+            "SELECT c.name, s.scope, s.id FROM segments s JOIN collections c ON c.id = s.collection"
+        ).fetchall()
+    finally:
+        connection.close()
+    segments: Dict[str, Dict[str, str]] = {}
+    for name, scope, segment_id in rows:
+        segments.setdefault(name, {})[scope] = segment_id
+    return segments
+
+
+def _dir_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def _hnsw_elements(segment_dir: str) -> Optional[Dict[str, int]]:
+    """Сколько элементов добавлено в HNSW и сколько из них живые; остальное - дыры от удалений"""
+    try:
+        with open(os.path.join(segment_dir, "index_metadata.pickle"), "rb") as f:
+            data = pickle.load(f)
+        total = data.total_elements_added
+        live = len(data.id_to_label)
+        return {"total": total, "live": live, "deleted": max(total - live, 0)}
+    except Exception:
+        return None
+
+
+def collection_stats(client_id: Optional[int] = None, segments: Optional[Dict[str, Dict[str, str]]] = None) -> Dict[str, Any]:
+    name = collection_name(client_id)
+    active = active_collection(name)
+    collection = get_vectorstore(client_id)._collection
+    count = collection.count()
+    metadata = collection.metadata or {}
+    stats: Dict[str, Any] = {
+        "collection": name,
+        "physical_name": active["collection"],
+        "embedding": active["embedding"],
+        "count": count,
+        "hnsw": {key: metadata.get(chroma_key) for key, chroma_key in HNSW_KEYS.items()},
+        "recommended_hnsw": recommended_hnsw(count),
+    }
+    try:
+        segment_id = (segments if segments is not None else _segments()).get(active["collection"], {}).get("VECTOR")
+    except sqlite3.Error as e:
+        logging.warning(f"Chroma segments are not readable: {e}")
+        segment_id = None
+    if segment_id:
+        segment_dir = os.path.join(CHROMA_PERSIST_DIR, segment_id)
+        files = {name: os.path.getsize(os.path.join(segment_dir, name)) for name in os.listdir(segment_dir)} \
+            if os.path.isdir(segment_dir) else {}
+        elements = _hnsw_elements(segment_dir)
+        stats["segment"] = {"id": segment_id, "files": files, "bytes": sum(files.values()), "elements": elements}
+        if elements and elements["total"]:
+            stats["deleted_ratio"] = round(elements["deleted"] / elements["total"], 3)
+    return stats
+
+
+def _orphan_segments(segments: Dict[str, Dict[str, str]]) -> List[str]:
+    """Каталоги сегментов, которых нет в базе Chroma: остаются на диске после удаления коллекций"""
+    referenced = {segment_id for scopes in segments.values() for segment_id in scopes.values()}
+    return [
+        entry for entry in os.listdir(CHROMA_PERSIST_DIR)
+        if _UUID_RE.match(entry) and entry not in referenced and os.path.isdir(os.path.join(CHROMA_PERSIST_DIR, entry))
+    ]
+
+
+def store_stats() -> Dict[str, Any]:
+    """Статистика хранилища: коллекции, сегменты HNSW, доля удаленных, размеры на диске"""
+    try:
+        segments = _segments()
+    except sqlite3.Error as e:
+        logging.warning(f"Chroma segments are not readable: {e}")
+        segments = {}
+    orphans = _orphan_segments(segments) if segments else []
+    return {
+        "persist_dir": CHROMA_PERSIST_DIR,
+        "disk_bytes": _dir_size(CHROMA_PERSIST_DIR),
+        "sqlite_bytes": os.path.getsize(_sqlite_path()) if os.path.exists(_sqlite_path()) else 0,
+        "collections": [collection_stats(client_id, segments) for client_id in _client_ids()],
+        "orphaned_segments": {entry: _dir_size(os.path.join(CHROMA_PERSIST_DIR, entry)) for entry in orphans},
+        "compact_ratio": CHROMA_COMPACT_RATIO,
+    }
+
+
+def vacuum_sqlite() -> bool:
+    """Возвращает ОС место, освобожденное удалениями в chroma.sqlite3; при занятой базе пропускается"""
+    try:
+        connection = sqlite3.connect(_sqlite_path(), timeout=30)
+        try:
+            connection.execute("VACUUM")
+        finally:
+            connection.close()
+        return True
+    except sqlite3.Error as e:
+        logging.warning(f"Chroma sqlite VACUUM skipped: {e}")
+        return False
+
+
+def remove_orphan_segments() -> List[str]:
+    """
+    Удаляет каталоги сегментов, на которые не ссылается chroma.sqlite3. Коллекция, ожидающая drop_collection,
+    еще есть в базе, поэтому ее сегменты не трогаются, пока читатели могут их использовать
+    """
+    with write_lock:
+        segments = _segments()
+        # Пустой список сегментов скорее значит другую схему базы, чем пустое хранилище: ничего не удаляем
+        orphans = _orphan_segments(segments) if segments else []
+        for entry in orphans:
+            shutil.rmtree(os.path.join(CHROMA_PERSIST_DIR, entry), ignore_errors=True)
+    if orphans:
+        logging.info(f"Removed orphaned Chroma segments: {orphans}")
+    return orphans
+
+
+def compact(client_id: Optional[int] = None, force: bool = False,
+            progress: Optional[Dict[str, Any]] = None, drop_delay: float = CHROMA_DROP_DELAY) -> Dict[str, Any]:
+    """
+    Компактизация: HNSW не переиспользует места удаленных элементов, поэтому при доле удаленных
+    не меньше CHROMA_COMPACT_RATIO (или force) коллекция пересобирается с готовыми векторами и прежними параметрами.
+    Затем удаляются осиротевшие сегменты и сжимается chroma.sqlite3.
+    Сегменты старой коллекции удаляются только после drop_delay (см. rebuild_collection), до этого они не сироты
+    """
+    stats = progress if progress is not None else {}
+    before = collection_stats(client_id)
+    ratio = before.get("deleted_ratio")
+    result: Dict[str, Any] = {"collection": before["collection"], "deleted_ratio": ratio, "rebuilt": False}
+    if force or (ratio is not None and ratio >= CHROMA_COMPACT_RATIO):
+        rebuild_collection(client_id, progress=stats, drop_delay=drop_delay)
+        result["rebuilt"] = True
+    result["removed_segments"] = remove_orphan_segments()
+    result["vacuumed"] = vacuum_sqlite()
+    stats.update(result)
+    logging.info(f"Chroma compaction: {result}")
+    print(f"✅ Компактизация {before['collection']}: {result}")
+    return result
+
+
+def rebuild_hnsw(client_id: Optional[int] = None, m: Optional[int] = None, ef_construction: Optional[int] = None,
+                 ef_search: Optional[int] = None, progress: Optional[Dict[str, Any]] = None,
+                 drop_delay: float = CHROMA_DROP_DELAY) -> Dict[str, Any]:
+    """Пересобирает HNSW-индекс с новыми M/ef_construction/ef_search; не заданные берутся из recommended_hnsw"""
+    recommended = recommended_hnsw(get_vectorstore(client_id)._collection.count())
+    params = {
+        "m": m if m is not None else recommended["M"],
+        "ef_construction": ef_construction if ef_construction is not None else recommended["ef_construction"],
+        "ef_search": ef_search if ef_search is not None else recommended["ef_search"],
+    }
+    result = rebuild_collection(client_id, collection_metadata=hnsw_metadata(**params), progress=progress,
+                                drop_delay=drop_delay)
+    remove_orphan_segments()
+    return result
+
+
+def _prune_snapshots() -> None:
+    for name in list_snapshots()[CHROMA_SNAPSHOT_KEEP:]:
+        shutil.rmtree(os.path.join(CHROMA_SNAPSHOT_DIR, name), ignore_errors=True)
+
+
+def list_snapshots() -> List[str]:
+    """Снапшоты от новых к старым"""
+    if not os.path.isdir(CHROMA_SNAPSHOT_DIR):
+        return []
+    return sorted((name for name in os.listdir(CHROMA_SNAPSHOT_DIR)
+                   if os.path.exists(os.path.join(CHROMA_SNAPSHOT_DIR, name, "manifest.json"))), reverse=True)
+
+
+def snapshot() -> Dict[str, Any]:
+    """
+    Согласованная копия хранилища для бэкапа. Под write_lock индексация и удаления ждут;
+    chroma.sqlite3 копируется через sqlite backup API (без полузаписанных страниц), сегменты HNSW - как файлы.
+    HNSW может отставать от базы: Chroma догоняет его из очереди в sqlite при открытии
+    """
+    name = time.strftime("%Y%m%d-%H%M%S")
+    while os.path.exists(os.path.join(CHROMA_SNAPSHOT_DIR, name)):
+        name += "-1"
+    target = os.path.join(CHROMA_SNAPSHOT_DIR, name)
+    os.makedirs(target)
+    started = time.perf_counter()
+    with write_lock:
+        source = sqlite3.connect(_sqlite_path())
+        destination = sqlite3.connect(os.path.join(target, "chroma.sqlite3"))
+        try:
+            source.backup(destination)
+        finally:
+            destination.close()
+            source.close()
+        segments = _segments()
+        for scopes in segments.values():
+            for segment_id in scopes.values():
+                segment_dir = os.path.join(CHROMA_PERSIST_DIR, segment_id)
+                if os.path.isdir(segment_dir):
+                    shutil.copytree(segment_dir, os.path.join(target, segment_id))
+        if os.path.exists(CHROMA_REGISTRY_FILE):
+            shutil.copy2(CHROMA_REGISTRY_FILE, os.path.join(target, os.path.basename(CHROMA_REGISTRY_FILE)))
+        counts = {collection_name(client_id): get_vectorstore(client_id)._collection.count() for client_id in _client_ids()}
+    manifest = {"name": name, "created_at": time.time(), "collections": counts,
+                "bytes": _dir_size(target), "seconds": round(time.perf_counter() - started, 2)}
+    with open(os.path.join(target, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    _prune_snapshots()
+    logging.info(f"Chroma snapshot created: {manifest}")
+    print(f"✅ Снапшот Chroma: {target}")
+    return manifest
+
+
+def restore_snapshot(name: str) -> str:
+    """Восстанавливает хранилище из снапшота; только при остановленном API. Текущий каталог сохраняется рядом"""
+    source = os.path.join(CHROMA_SNAPSHOT_DIR, name)
+    if not os.path.exists(os.path.join(source, "manifest.json")):
+        raise ValueError(f"Snapshot {name} not found in {CHROMA_SNAPSHOT_DIR}")
+    backup = f"{CHROMA_PERSIST_DIR.rstrip(os.sep)}.before-{time.strftime('%Y%m%d-%H%M%S')}"
+    # Файл владения лежит в каталоге хранилища: на Windows открытый файл не дает переименовать каталог
+    release_store()
+    if os.path.exists(CHROMA_PERSIST_DIR):
+        os.rename(CHROMA_PERSIST_DIR, backup)
+    shutil.copytree(source, CHROMA_PERSIST_DIR, ignore=shutil.ignore_patterns("manifest.json"))
+    registry_name = os.path.basename(CHROMA_REGISTRY_FILE)
+    if os.path.exists(os.path.join(CHROMA_PERSIST_DIR, registry_name)) and \
+            os.path.abspath(os.path.dirname(CHROMA_REGISTRY_FILE)) != os.path.abspath(CHROMA_PERSIST_DIR):
+        shutil.copy2(os.path.join(CHROMA_PERSIST_DIR, registry_name), CHROMA_REGISTRY_FILE)
+    print(f"✅ Хранилище восстановлено из {source}, прежнее перенесено в {backup}")
+    return backup
+
+
+class ChromaMaintainer:
+    """
+    Фоновая проверка: коллекция с долей удаленных не меньше CHROMA_COMPACT_RATIO компактизируется.
+    Включается явно через CHROMA_MAINTENANCE_INTERVAL > 0
+    """
+
+    def __init__(self, interval: float = CHROMA_MAINTENANCE_INTERVAL):
+        self.interval = interval
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def check(self) -> None:
+        if collection_job.running:
+            return
+        for client_id in _client_ids():
+            ratio = collection_stats(client_id).get("deleted_ratio")
+            if ratio is not None and ratio >= CHROMA_COMPACT_RATIO:
+                collection_job.start("compact", compact, client_id=client_id)
+                return
+
+    def _loop(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                logging.error(f"Chroma maintenance check failed: {e}")
+
+    def start(self) -> None:
+        if self.interval <= 0:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="chroma-maintainer", daemon=True)
+                self._thread.start()
+
+
+chroma_maintainer = ChromaMaintainer()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Обслуживание хранилища Chroma")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="статистика коллекций и сегментов HNSW")
+    compact_parser = subparsers.add_parser("compact", help="пересобрать коллекцию без удаленных элементов")
+    compact_parser.add_argument("--client-id", type=int, default=None)
+    compact_parser.add_argument("--force", action="store_true", help="не смотреть на CHROMA_COMPACT_RATIO")
+    rebuild_parser = subparsers.add_parser("rebuild-hnsw", help="пересобрать HNSW с новыми параметрами")
+    rebuild_parser.add_argument("--client-id", type=int, default=None)
+    rebuild_parser.add_argument("--m", type=int, default=None)
+    rebuild_parser.add_argument("--ef-construction", type=int, default=None)
+    rebuild_parser.add_argument("--ef-search", type=int, default=None)
+    subparsers.add_parser("snapshot", help="снапшот хранилища для бэкапа")
+    subparsers.add_parser("list-snapshots", help="список снапшотов")
+    restore_parser = subparsers.add_parser("restore", help="восстановить из снапшота (API должен быть остановлен)")
+    restore_parser.add_argument("name")
+    args = parser.parse_args()
+
+    if args.command in ("compact", "rebuild-hnsw", "restore"):
+        # Переключают коллекции и удаляют сегменты: из отдельного процесса - только при остановленном API
+        require_exclusive_store(args.command)
+
+    if args.command == "stats":
+        print(json.dumps(store_stats(), ensure_ascii=False, indent=2))
+    elif args.command == "compact":
+        compact(args.client_id, args.force, drop_delay=0)
+    elif args.command == "rebuild-hnsw":
+        rebuild_hnsw(args.client_id, args.m, args.ef_construction, args.ef_search, drop_delay=0)
+    elif args.command == "snapshot":
+        snapshot()
+    elif args.command == "list-snapshots":
+        print("\n".join(list_snapshots()))
+    elif args.command == "restore":
+        restore_snapshot(args.name)
@@ -0,0 +1,277 @@
+# chroma_migrations.py - миграции данных в Chroma; запуск: python chroma_migrations.py <команда>
+import os
+import json
+import time
+import hashlib
+import argparse
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from chroma_utils import (
+    CHROMA_DEDICATED_CLIENTS, CHROMA_DROP_DELAY, active_collection, collection_name, drop_collection, get_vectorstore,
+    open_collection, require_exclusive_store, swap_collection, write_lock
+)
+from db_utils import get_document_client_map
+from bm25_index import bm25_registry
+from embedding_backends import EMBEDDING_MODELS, get_embeddings
+
+MIGRATION_BATCH_SIZE = 500
+# Пачка переэмбеддинга: модель кодирует ее батчами EMBEDDING_BATCH_SIZE, Chroma пишет одним upsert
+REEMBED_BATCH_SIZE = int(os.getenv("REEMBED_BATCH_SIZE", "256"))
+
+
+def backfill_client_ids(batch_size: int = MIGRATION_BATCH_SIZE) -> Dict[str, int]:
+    """
+    Проставляет client_id в метаданные чанков общей коллекции по document_store
+    и переносит чанки выделенных клиентов в их коллекции (вместе с готовыми эмбеддингами).
+    Повторный запуск безопасен: обработанные чанки не меняются.
+    """
+    owners = get_document_client_map()
+    collection = get_vectorstore()._collection
+    stats = {"scanned": 0, "updated": 0, "moved": 0, "orphaned": 0}
+
+    offset = 0
+    while True:
+        batch = collection.get(include=["metadatas"], limit=batch_size, offset=offset)
+        ids = batch["ids"]
+        if not ids:
+            break
+        stats["scanned"] += len(ids)
+
+        update_ids, update_metadatas, move_ids = [], [], []
+        for chunk_id, metadata in zip(ids, batch["metadatas"]):
+            metadata = dict(metadata or {})
+            client_id = owners.get(metadata.get("file_id"))
+            if client_id is None:
+                stats["orphaned"] += 1
+                continue
+            if metadata.get("client_id") != client_id:
+                metadata["client_id"] = client_id
+                update_ids.append(chunk_id)
+                update_metadatas.append(metadata)
+            if client_id in CHROMA_DEDICATED_CLIENTS:
+                move_ids.append(chunk_id)
+
+        if update_ids:
+            collection.update(ids=update_ids, metadatas=update_metadatas)
+            stats["updated"] += len(update_ids)
+
+        if move_ids:
+            moving = collection.get(ids=move_ids, include=["embeddings", "documents", "metadatas"])
+            by_client: Dict[int, Dict[str, list]] = {}
+            for chunk_id, embedding, document, metadata in zip(
+                moving["ids"], moving["embeddings"], moving["documents"], moving["metadatas"]
+            ):
+                target = by_client.setdefault(metadata["client_id"], {"ids": [], "embeddings": [], "documents": [], "metadatas": []})
+                target["ids"].append(chunk_id)
+                target["embeddings"].append(embedding)
+                target["documents"].append(document)
+                target["metadatas"].append(metadata)
+            shared_embedding = active_collection(collection_name())["embedding"]
+            for client_id, data in by_client.items():
+                # Готовые векторы переносятся, только если обе коллекции на одной модели эмбеддингов
+                if active_collection(collection_name(client_id))["embedding"] != shared_embedding:
+                    data["embeddings"] = get_vectorstore(client_id).embeddings.embed_documents(data["documents"])
+                get_vectorstore(client_id)._collection.upsert(**data)
+            # Удаляем из общей только после записи в выделенную коллекцию
+            collection.delete(ids=move_ids)
+            stats["moved"] += len(move_ids)
+            # Удаленные чанки сдвигают страницы общей коллекции
+            offset -= len(move_ids)
+
+        offset += len(ids)
+        print(f"🔁 Обработано {stats['scanned']} чанков: обновлено {stats['updated']}, перенесено {stats['moved']}")
+
+    bm25_registry.invalidate()
+    logging.info(f"client_id backfill finished: {stats}")
+    print(f"✅ Миграция client_id завершена: {stats}")
+    return stats
+
+
+def _fingerprint(document: Optional[str], metadata: Optional[Dict[str, Any]]) -> str:
+    """Хэш текста и метаданных чанка: по нему догоняющий проход находит чанки, измененные во время копирования"""
+    payload = json.dumps([document, metadata or {}], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _fingerprints(collection, batch_size: int) -> Dict[str, str]:
+    fingerprints: Dict[str, str] = {}
+    offset = 0
+    while True:
+        batch = collection.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+        if not batch["ids"]:
+            return fingerprints
+        for chunk_id, document, metadata in zip(batch["ids"], batch["documents"], batch["metadatas"]):
+            fingerprints[chunk_id] = _fingerprint(document, metadata)
+        offset += len(batch["ids"])
+
+
+def _copy_chunks(source, target, embeddings, ids: List[str]) -> int:
+    """Переносит чанки по id в target: с новыми эмбеддингами или, если embeddings=None, с готовыми векторами"""
+    data = source.get(ids=ids, include=["documents", "metadatas"] + ([] if embeddings is not None else ["embeddings"]))
+    if not data["ids"]:
+        return 0
+    target.upsert(
+        ids=data["ids"],
+        embeddings=embeddings.embed_documents(data["documents"]) if embeddings is not None else data["embeddings"],
+        documents=data["documents"],
+        metadatas=data["metadatas"]
+    )
+    return len(data["ids"])
+
+
+def rebuild_collection(client_id: Optional[int] = None, embedding: Optional[str] = None,
+                       collection_metadata: Optional[Dict[str, Any]] = None, batch_size: int = REEMBED_BATCH_SIZE,
+                       progress: Optional[Dict[str, Any]] = None, drop_delay: float = CHROMA_DROP_DELAY) -> Dict[str, Any]:
+    """
+    Перестраивает коллекцию (общую или выделенного клиента) в новую физическую коллекцию.
+    embedding - пересчитать эмбеддинги этой моделью; без него векторы копируются как есть
+    (так пересобирается HNSW-индекс: без дыр от удалений и с новыми параметрами из collection_metadata).
+    Новая коллекция заполняется рядом со старой, поиск и загрузка все это время работают со старой.
+    В конце под write_lock догоняются изменения, сделанные во время копирования, и реестр переключается атомарно.
+    write_lock исключает только записи своего процесса: из CLI перестроение идет при остановленном API
+    (см. require_exclusive_store), из API - фоновой задачей collection_job.
+    Старая коллекция удаляется через drop_delay секунд, когда завершатся начатые с ней запросы
+    """
+    if embedding is not None and embedding not in EMBEDDING_MODELS:
+        raise ValueError(f"Unknown embedding backend {embedding!r}. Available: {', '.join(EMBEDDING_MODELS)}")
+    name = collection_name(client_id)
+    previous = active_collection(name)
+    target_embedding = embedding or previous["embedding"]
+    source = get_vectorstore(client_id)._collection
+    # Параметры HNSW задаются только при создании коллекции; прежние сохраняются, если их не меняют
+    metadata = dict(source.metadata or {})
+    metadata.update(collection_metadata or {})
+    physical_name = f"{name}__{target_embedding}__{int(time.time())}"
+    target_store = open_collection(physical_name, target_embedding, metadata or None)
+    target = target_store._collection
+    embeddings = get_embeddings(embedding) if embedding is not None else None
+    stats = progress if progress is not None else {}
+    stats.update({"collection": name, "source": previous["collection"], "target": physical_name,
+                  "embedding": target_embedding, "reembed": embeddings is not None, "metadata": metadata,
+                  "total": source.count(), "copied": 0, "caught_up": 0, "removed": 0})
+    # Что уже записано в target: сравнивается с источником под write_lock без повторного чтения target
+    copied: Dict[str, str] = {}
+
+    include = ["documents", "metadatas"] + ([] if embeddings is not None else ["embeddings"])
+    offset = 0
+    while True:
+        batch = source.get(include=include, limit=batch_size, offset=offset)
+        if not batch["ids"]:
+            break
+        target.upsert(
+            ids=batch["ids"],
+            embeddings=embeddings.embed_documents(batch["documents"]) if embeddings is not None else batch["embeddings"],
+            documents=batch["documents"],
+            metadatas=batch["metadatas"]
+        )
+        for chunk_id, document, chunk_metadata in zip(batch["ids"], batch["documents"], batch["metadatas"]):
+            copied[chunk_id] = _fingerprint(document, chunk_metadata)
+        offset += len(batch["ids"])
+        stats["copied"] += len(batch["ids"])
+        print(f"🔁 Перестроение {name}: {stats['copied']}/{stats['total']}")
+
+    with write_lock:
+        # Догоняются не только новые id: replace-doc и обновления метаданных меняют чанки с прежними id
+        current = _fingerprints(source, batch_size)
+        changed = sorted(chunk_id for chunk_id, fingerprint in current.items() if copied.get(chunk_id) != fingerprint)
+        for start in range(0, len(changed), batch_size):
+            stats["caught_up"] += _copy_chunks(source, target, embeddings, changed[start:start + batch_size])
+        removed = [chunk_id for chunk_id in copied if chunk_id not in current]
+        if removed:
+            target.delete(ids=removed)
+            stats["removed"] = len(removed)
+        swap_collection(name, physical_name, target_embedding, target_store)
+
+    # Порядок векторной выдачи мог измениться: версия BM25-индекса растет при перестроении, кэш поиска сбрасывается
+    bm25_registry.invalidate()
+    if previous["collection"] != physical_name:
+        drop_collection(target_store._client, previous["collection"], drop_delay)
+    logging.info(f"Collection rebuild finished: {stats}")
+    print(f"✅ Коллекция {name} перестроена в {physical_name}: {stats}")
+    return stats
+
+
+def reembed_collection(embedding: str, client_id: Optional[int] = None, batch_size: int = REEMBED_BATCH_SIZE,
+                       progress: Optional[Dict[str, Any]] = None, drop_delay: float = CHROMA_DROP_DELAY) -> Dict[str, Any]:
+    """Переводит коллекцию на другую модель эмбеддингов (см. rebuild_collection)"""
+    return rebuild_collection(client_id, embedding, batch_size=batch_size, progress=progress, drop_delay=drop_delay)
+
+
+class CollectionJob:
+    """
+    Фоновое перестроение коллекции из API (переэмбеддинг, пересборка HNSW).
+    Обе операции переключают коллекцию, поэтому одновременно идет не больше одной
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.status: Dict[str, Any] = {"state": "idle"}
+
+    def start(self, action: str, target: Callable[..., Dict[str, Any]], **kwargs) -> Dict[str, Any]:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                raise RuntimeError(f"Collection job {self.status.get('action')} is already running")
+            self.status = {"state": "running", "action": action, "started_at": time.time()}
+            self._thread = threading.Thread(target=self._run, args=(target, kwargs), daemon=True)
+            self._thread.start()
+            return dict(self.status)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self, target: Callable[..., Dict[str, Any]], kwargs: Dict[str, Any]) -> None:
+        try:
+            target(progress=self.status, **kwargs)
+            self.status["state"] = "done"
+        except Exception as e:
+            logging.error(f"Collection job {self.status.get('action')} failed: {e}")
+            self.status.update({"state": "failed", "error": str(e)})
+        self.status["finished_at"] = time.time()
+
+
+collection_job = CollectionJob()
+
+
+def quantize_embeddings(model_name: str, output_dir: str, config: str = "avx512_vnni") -> str:
+    """
+    Сохраняет модель в output_dir вместе с int8-квантованной ONNX-версией (onnx/model_qint8_<config>.onnx).
+    Нужны sentence-transformers[onnx]; затем EMBEDDING_ONNX_MODEL=output_dir
+    """
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+    model = SentenceTransformer(model_name, backend="onnx", device="cpu")
+    model.save_pretrained(output_dir)
+    export_dynamic_quantized_onnx_model(model, config, output_dir)
+    print(f"✅ Квантованная модель сохранена в {output_dir}/onnx/model_qint8_{config}.onnx")
+    return output_dir
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Миграции данных Chroma")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    backfill = subparsers.add_parser("backfill-client-ids", help="проставить client_id и разнести чанки по коллекциям")
+    backfill.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE)
+    reembed = subparsers.add_parser("reembed", help="перестроить коллекцию под другую модель эмбеддингов")
+    reembed.add_argument("--embedding", required=True, choices=sorted(EMBEDDING_MODELS))
+    reembed.add_argument("--client-id", type=int, default=None, help="выделенный клиент; без него - общая коллекция")
+    reembed.add_argument("--batch-size", type=int, default=REEMBED_BATCH_SIZE)
+    quantize = subparsers.add_parser("quantize-embeddings", help="экспортировать int8 ONNX-версию модели эмбеддингов")
+    quantize.add_argument("--model", default="intfloat/multilingual-e5-small")
+    quantize.add_argument("--output-dir", required=True)
+    quantize.add_argument("--config", default="avx512_vnni", choices=["arm64", "avx2", "avx512", "avx512_vnni"])
+    args = parser.parse_args()
+
+    if args.command in ("backfill-client-ids", "reembed"):
+        # Пишут в коллекции из отдельного процесса: только при остановленном API
+        require_exclusive_store(args.command)
+    if args.command == "backfill-client-ids":
+        backfill_client_ids(args.batch_size)
+    elif args.command == "reembed":
+        # API не запущен, ждать завершения чужих запросов к старой коллекции не нужно
+        reembed_collection(args.embedding, args.client_id, args.batch_size, drop_delay=0)
+    elif args.command == "quantize-embeddings":
+        quantize_embeddings(args.model, args.output_dir, args.config)
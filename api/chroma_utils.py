@@ -1,25 +1,263 @@
-from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, UnstructuredHTMLLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.embeddings.sentence_transformer import SentenceTransformerEmbeddings
-from langchain_chroma import Chroma
-from typing import List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 from langchain_core.documents import Document
 import numpy as np
 import logging
+import hashlib
+import json
+import time
+import os
+import threading
 
-from docling.document_converter import DocumentConverter
+from bm25_index import bm25_registry
+from embedding_backends import EMBEDDING_BACKEND, get_embeddings
+from ingestion import ingest_documents
+from document_chunker import chunk_docling_documents
 
 # Настройка логирования
 logging.basicConfig(filename='app.log', level=logging.DEBUG)
 
+# Телеметрия Chroma (posthog) отключена; переменная читается при импорте chromadb
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+
+CHROMA_PERSIST_DIR = os.getenv("CHROMA_PERSIST_DIR", "./chroma_db")
+# Общая коллекция; имя по умолчанию совпадает с тем, что langchain_chroma создавал раньше
+CHROMA_COLLECTION = os.getenv("CHROMA_COLLECTION", "langchain")
+# Крупные клиенты со своей коллекцией (id через запятую): поиск не зависит от объема чужих документов
+CHROMA_DEDICATED_CLIENTS = {
+    int(client_id) for client_id in os.getenv("CHROMA_DEDICATED_CLIENTS", "").split(",") if client_id.strip()
+}
+# Chroma ограничивает размер одного запроса, большие списки id режутся на пачки
+CHROMA_DELETE_BATCH = int(os.getenv("CHROMA_DELETE_BATCH", "5000"))
+# Какая физическая коллекция и какая модель эмбеддингов стоят за логическим именем; меняется миграцией reembed
+CHROMA_REGISTRY_FILE = os.getenv("CHROMA_REGISTRY_FILE", os.path.join(CHROMA_PERSIST_DIR, "collections.json"))
+# Как часто проверять, не переключил ли коллекцию другой процесс (другой воркер API), секунды
+CHROMA_REGISTRY_CHECK_INTERVAL = float(os.getenv("CHROMA_REGISTRY_CHECK_INTERVAL", "1"))
+# Старая коллекция удаляется после переключения с задержкой: запросы, начатые с нее, успевают завершиться
+CHROMA_DROP_DELAY = float(os.getenv("CHROMA_DROP_DELAY", "60"))
+# Файл владения хранилищем: API держит его разделяемо, утилиты, переключающие коллекции, - исключительно
+CHROMA_OWNER_LOCK_FILE = os.path.join(CHROMA_PERSIST_DIR, ".owner.lock")
+
 text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len)
 
-embedding_function = SentenceTransformerEmbeddings(model_name="all-MiniLM-L6-v2")
+_vectorstore_lock = threading.Lock()
+# Запись в коллекции (индексация, удаление); миграция берет его на время догоняющего прохода и переключения
+write_lock = threading.RLock()
+_vectorstores: Dict[str, Any] = {}
+_registry: Optional[Dict[str, Dict[str, str]]] = None
+_registry_mtime: Optional[int] = None
+_registry_checked = 0.0
+_owner_lock_file = None
+
+
+def collection_name(client_id: Optional[int] = None) -> str:
+    return f"client_{client_id}" if client_id in CHROMA_DEDICATED_CLIENTS else CHROMA_COLLECTION
+
+
+def _registry_file_mtime() -> Optional[int]:
+    try:
+        return os.stat(CHROMA_REGISTRY_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _load_registry(force: bool = False) -> Dict[str, Dict[str, str]]:
+    """
+    Реестр коллекций; вызывается под _vectorstore_lock. Если collections.json изменил другой процесс,
+    реестр перечитывается, а открытые коллекции переключенных имен закрываются
+    """
+    global _registry, _registry_mtime, _registry_checked
+    now = time.monotonic()
+    if not force and _registry is not None and now - _registry_checked < CHROMA_REGISTRY_CHECK_INTERVAL:
+        return _registry
+    _registry_checked = now
+    mtime = _registry_file_mtime()
+    if _registry is None or mtime != _registry_mtime:
+        try:
+            with open(CHROMA_REGISTRY_FILE, encoding="utf-8") as f:
+                registry = json.load(f)
+        except FileNotFoundError:
+            registry = {}
+        if _registry is not None:
+            for name in set(_registry) | set(registry):
+                if _registry.get(name) != registry.get(name):
+                    _vectorstores.pop(name, None)
+                    logging.info(f"Collection {name} was switched by another process: {registry.get(name)}")
+        _registry, _registry_mtime = registry, mtime
+    return _registry
+
+
+def _try_lock(handle, exclusive: bool) -> bool:
+    try:
+        import fcntl
+    except ImportError:
+        # Windows: только исключительная блокировка, поэтому API там работает одним процессом
+        import msvcrt
+        try:
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+    try:
+        fcntl.flock(handle, (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def claim_store(exclusive: bool = False) -> bool:
+    """
+    Берет хранилище во владение до конца процесса. API - разделяемо (воркеров может быть несколько),
+    CLI-команды, которые переключают коллекции, - исключительно: write_lock действует только внутри процесса,
+    поэтому их догоняющий проход и переключение не должны идти при работающем API. False - владение занято
+    """
+    global _owner_lock_file
+    if _owner_lock_file is not None:
+        return True
+    os.makedirs(CHROMA_PERSIST_DIR, exist_ok=True)
+    handle = open(CHROMA_OWNER_LOCK_FILE, "a+")
+    if not _try_lock(handle, exclusive):
+        handle.close()
+        return False
+    _owner_lock_file = handle
+    return True
+
+
+def release_store() -> None:
+    global _owner_lock_file
+    if _owner_lock_file is not None:
+        _owner_lock_file.close()
+        _owner_lock_file = None
+
+
+def require_exclusive_store(command: str) -> None:
+    """Для CLI: завершает процесс, если хранилищем владеет запущенный API"""
+    if not claim_store(exclusive=True):
+        raise SystemExit(
+            f"{command}: the API is running on {CHROMA_PERSIST_DIR}. "
+            f"Start the operation through the API (/collections/..., /maintenance/chroma/...) or stop the API first"
+        )
+
+
+def active_collection(name: str) -> Dict[str, str]:
+    """{"collection": физическое имя, "embedding": модель}; без записи в реестре - коллекция с тем же именем"""
+    with _vectorstore_lock:
+        return dict(_load_registry().get(name) or {"collection": name, "embedding": EMBEDDING_BACKEND})
+
+
+def open_collection(physical_name: str, embedding: str, collection_metadata: Optional[Dict[str, Any]] = None):
+    """
+    Chroma-коллекция по физическому имени с заданной моделью эмбеддингов.
+    collection_metadata (hnsw:space, hnsw:M, ...) действует только при создании коллекции
+    """
+    import chromadb
+    from langchain_chroma import Chroma
+    os.makedirs(CHROMA_PERSIST_DIR, exist_ok=True)
+    return Chroma(
+        collection_name=physical_name,
+        persist_directory=CHROMA_PERSIST_DIR,
+        embedding_function=get_embeddings(embedding),
+        collection_metadata=collection_metadata,
+        client_settings=chromadb.config.Settings(
+            anonymized_telemetry=False,
+            is_persistent=True,
+            persist_directory=CHROMA_PERSIST_DIR
+        )
+    )
+
+
+def get_vectorstore(client_id: Optional[int] = None):
+    """Открывает persistent Chroma при первом обращении: коллекцию клиента или общую"""
+    name = collection_name(client_id)
+    with _vectorstore_lock:
+        registry = _load_registry()
+        vectorstore = _vectorstores.get(name)
+        if vectorstore is None:
+            active = registry.get(name) or {"collection": name, "embedding": EMBEDDING_BACKEND}
+            vectorstore = _vectorstores[name] = open_collection(active["collection"], active["embedding"])
+    return vectorstore
+
+
+def swap_collection(name: str, physical_name: str, embedding: str, vectorstore: Any = None) -> None:
+    """
+    Атомарно переключает логическое имя на другую физическую коллекцию:
+    реестр пишется во временный файл и заменяется через os.replace, открытые запросы дорабатывают со старой
+    """
+    with _vectorstore_lock:
+        # Свежее чтение: запись другого процесса за последнюю секунду не должна потеряться
+        registry = dict(_load_registry(force=True))
+        registry[name] = {"collection": physical_name, "embedding": embedding}
+        tmp_path = f"{CHROMA_REGISTRY_FILE}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(registry, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, CHROMA_REGISTRY_FILE)
+        global _registry, _registry_mtime
+        _registry, _registry_mtime = registry, _registry_file_mtime()
+        _vectorstores[name] = vectorstore if vectorstore is not None else open_collection(physical_name, embedding)
+    logging.info(f"Collection {name} switched to {physical_name} ({embedding})")
+
+
+def drop_collection(client: Any, physical_name: str, delay: float = CHROMA_DROP_DELAY) -> None:
+    """
+    Удаляет физическую коллекцию, от которой реестр уже переключен. Через delay секунд: запросы, взявшие
+    старую коллекцию до переключения, и другие процессы API, еще не перечитавшие реестр, успевают закончить
+    """
+    def drop():
+        try:
+            client.delete_collection(physical_name)
+            logging.info(f"Old collection {physical_name} deleted")
+        except Exception as e:
+            logging.warning(f"Old collection {physical_name} was not deleted: {e}")
+
+    if delay <= 0:
+        drop()
+        return
+    logging.info(f"Old collection {physical_name} will be deleted in {delay:.0f}s")
+    timer = threading.Timer(delay, drop)
+    timer.daemon = True
+    timer.start()
+
+
+def all_vectorstores() -> List[Any]:
+    """Общая коллекция и коллекции выделенных клиентов"""
+    return [get_vectorstore()] + [get_vectorstore(client_id) for client_id in sorted(CHROMA_DEDICATED_CLIENTS)]
 
-import os
-if not os.path.exists("./chroma_db"):
-    os.makedirs("./chroma_db")
-vectorstore = Chroma(persist_directory="./chroma_db", embedding_function=embedding_function)
+
+def _in_document_order(docs: Dict[str, Any]) -> Dict[str, Any]:
+    """Chroma не гарантирует порядок get: чанки сортируются по chunk_index, если он есть в метаданных"""
+    metadatas = docs.get("metadatas")
+    if not metadatas or any((metadata or {}).get("chunk_index") is None for metadata in metadatas):
+        return docs
+    order = sorted(range(len(docs["ids"])), key=lambda i: metadatas[i]["chunk_index"])
+    return {key: [value[i] for i in order] if isinstance(value, list) and len(value) == len(order) else value
+            for key, value in docs.items()}
+
+
+def get_file_chunks(file_id: int, client_id: Optional[int] = None,
+                    include: Tuple[str, ...] = ("documents", "metadatas")) -> Dict[str, Any]:
+    """Чанки документа; без client_id коллекция ищется перебором (их немного, фильтр по file_id индексирован)"""
+    vectorstores = [get_vectorstore(client_id)] if client_id is not None else all_vectorstores()
+    for vectorstore in vectorstores:
+        docs = vectorstore.get(where={"file_id": file_id}, include=list(include))
+        if docs and docs.get('ids'):
+            return _in_document_order(docs)
+    return {"ids": [], "documents": [], "metadatas": []}
+
+
+def warm_up_collection() -> int:
+    """Открывает коллекцию Chroma и возвращает число чанков в ней"""
+    return get_vectorstore()._collection.count()
+
+
+def warm_up_embeddings() -> None:
+    """Загружает модель эмбеддингов общей коллекции и прогоняет через нее один запрос"""
+    get_vectorstore().embeddings.embed_query("warm-up")
+
+
+def warm_up() -> None:
+    """Явный прогрев: открывает коллекцию и загружает модель эмбеддингов"""
+    warm_up_collection()
+    warm_up_embeddings()
 
 
 #devert007################
@@ -29,36 +267,24 @@ def load_and_split_document(file_path: str) -> List[Document]:
     Поддерживает: PDF, DOCX, HTML, PPTX, XLSX и другие форматы
     """
     try:
+        # Docling тянет torch и модели разметки, поэтому импортируется только при загрузке файла
+        from docling.document_converter import DocumentConverter
+
         # Инициализация конвертера Docling
         converter = DocumentConverter()
         
         # Конвертация документа
         result = converter.convert(file_path)
-        
-        if not result.documents:
+        docling_documents = getattr(result, "documents", None) or [result.document]
+
+        # Чанки по разделам и таблицам документа, с путем заголовков и страницами в метаданных
+        splits = chunk_docling_documents(docling_documents, file_path)
+        if not splits:
             logging.error(f"No content extracted from {file_path}")
             return []
-        
-        # Извлечение текста из всех документов
-        all_texts = []
-        for doc in result.documents:
-            # Экспорт в Markdown для сохранения структуры
-            markdown_content = doc.export_to_markdown()
-            all_texts.append(markdown_content)
-        
-        # Объединение всего текста
-        full_text = "\n\n".join(all_texts)
-        
-        # Создание Langchain Document
-        documents = [Document(page_content=full_text, metadata={"source": file_path})]
-        
-        logging.debug(f"Loaded document from {file_path} using Docling")
-        print(f"Loaded document from {file_path} using Docling")
-        
-        # Разбиение на чанки
-        splits = text_splitter.split_documents(documents)
-        logging.debug(f"Split document into {len(splits)} chunks")
-        print(f"Split document into {len(splits)} chunks")
+
+        logging.debug(f"Split document {file_path} into {len(splits)} structural chunks using Docling")
+        print(f"Split document {file_path} into {len(splits)} structural chunks using Docling")
         
         return splits
         
@@ -72,6 +298,8 @@ def load_and_split_document(file_path: str) -> List[Document]:
 def load_with_fallback(file_path: str) -> List[Document]:
     """Fallback метод для загрузки документов старыми способами"""
     try:
+        from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, UnstructuredHTMLLoader
+
         file_extension = os.path.splitext(file_path)[1].lower()
         
         if file_extension == '.pdf':
@@ -86,6 +314,8 @@ def load_with_fallback(file_path: str) -> List[Document]:
         documents = loader.load()
         logging.debug(f"Loaded {len(documents)} document(s) from {file_path} using fallback")
         splits = text_splitter.split_documents(documents)
+        for chunk_index, split in enumerate(splits):
+            split.metadata["chunk_index"] = chunk_index
         return splits
         
     except Exception as e:
@@ -93,7 +323,35 @@ def load_with_fallback(file_path: str) -> List[Document]:
         return []
 
 
-def index_document_to_chroma(file_path: str, file_id: int) -> bool:
+def _chunk_keys(texts: List[str], hashes: Optional[List[Optional[str]]] = None) -> List[Tuple[str, int]]:
+    """(sha256 текста, номер повтора): одинаковые абзацы в документе различаются номером"""
+    seen: Dict[str, int] = {}
+    keys = []
+    for i, text in enumerate(texts):
+        content_hash = (hashes[i] if hashes else None) or hashlib.sha256(text.encode("utf-8")).hexdigest()
+        occurrence = seen.get(content_hash, 0)
+        seen[content_hash] = occurrence + 1
+        keys.append((content_hash, occurrence))
+    return keys
+
+
+def _chunk_id(file_id: int, key: Tuple[str, int]) -> str:
+    return f"{file_id}-{key[0][:32]}-{key[1]}"
+
+
+def _prepare_chunks(splits: List[Document], file_id: int, client_id: Optional[int]) -> List[Tuple[str, int]]:
+    """Проставляет file_id, client_id и content_hash в метаданные; возвращает ключи чанков"""
+    keys = _chunk_keys([split.page_content for split in splits])
+    for split, key in zip(splits, keys):
+        split.metadata['file_id'] = file_id
+        # client_id в метаданных позволяет фильтровать поиск по клиенту до ранжирования
+        if client_id is not None:
+            split.metadata['client_id'] = client_id
+        split.metadata['content_hash'] = key[0]
+    return keys
+
+
+def index_document_to_chroma(file_path: str, file_id: int, client_id: int = None) -> bool:
     try:
         splits = load_and_split_document(file_path)
         if not splits:
@@ -101,10 +359,18 @@ def index_document_to_chroma(file_path: str, file_id: int) -> bool:
             print(f"No splits generated for file_id {file_id}")
             return False
 
-        for split in splits:
-            split.metadata['file_id'] = file_id
-
-        vectorstore.add_documents(splits)
+        # id чанка детерминирован (документ + хэш текста): по ним replace-doc находит неизмененные чанки
+        keys = _prepare_chunks(splits, file_id, client_id)
+        # write_lock - только на запись каждой пачки: эмбеддинги не задерживают удаления и переключение коллекций
+        chunk_ids = ingest_documents(
+            get_vectorstore(client_id), splits, ids=[_chunk_id(file_id, key) for key in keys],
+            lock=write_lock, current_vectorstore=lambda: get_vectorstore(client_id)
+        )
+        # BM25-индекс клиента обновляется сразу, без перестроения
+        bm25_registry.add_chunks(
+            client_id, chunk_ids, [split.page_content for split in splits], [split.metadata for split in splits]
+        )
+        _remember_chunk_ids(file_id, chunk_ids)
         logging.info(f"Successfully indexed document with file_id {file_id}")
         print(f"Successfully indexed document with file_id {file_id}")
         return True
@@ -113,20 +379,124 @@ def index_document_to_chroma(file_path: str, file_id: int) -> bool:
         print(f"Error indexing document with file_id {file_id}: {e}")
         return False
 
-def delete_doc_from_chroma(file_id: int):
+def replace_document_in_chroma(file_path: str, file_id: int, client_id: int = None) -> Optional[Dict[str, Any]]:
+    """
+    Переиндексирует новую версию документа по разнице с сохраненной:
+    эмбеддинги считаются только для новых чанков, удаляются только исчезнувшие,
+    у неизмененных обновляются метаданные (позиция, заголовки, страницы).
+    Возвращает статистику или None при ошибке
+    """
+    started = time.perf_counter()
     try:
-        docs = vectorstore.get(where={"file_id": file_id})
-        logging.debug(f"Found {len(docs['ids'])} document chunks for file_id {file_id}")
-        print(f"Found {len(docs['ids'])} document chunks for file_id {file_id}")
+        splits = load_and_split_document(file_path)
+        if not splits:
+            logging.error(f"No splits generated for file_id {file_id}")
+            print(f"No splits generated for file_id {file_id}")
+            return None
+        new_keys = _prepare_chunks(splits, file_id, client_id)
 
-        vectorstore._collection.delete(where={"file_id": file_id})
-        logging.info(f"Deleted all documents with file_id {file_id}")
-        print(f"Deleted all documents with file_id {file_id}")
-        return True
+        vectorstore = get_vectorstore(client_id)
+        stored = _in_document_order(vectorstore.get(where={"file_id": file_id}, include=["documents", "metadatas"]))
+        # Для чанков, загруженных до появления content_hash, хэш считается по тексту
+        stored_keys = _chunk_keys(
+            stored["documents"], [(metadata or {}).get("content_hash") for metadata in stored["metadatas"]]
+        )
+        stored_by_key = {key: (chunk_id, metadata) for key, chunk_id, metadata
+                         in zip(stored_keys, stored["ids"], stored["metadatas"])}
+
+        added, added_ids, kept_ids, kept_metadatas, final_ids = [], [], [], [], []
+        for split, key in zip(splits, new_keys):
+            if key in stored_by_key:
+                chunk_id, metadata = stored_by_key[key]
+                if metadata != split.metadata:
+                    kept_ids.append(chunk_id)
+                    kept_metadatas.append(split.metadata)
+            else:
+                chunk_id = _chunk_id(file_id, key)
+                added.append(split)
+                added_ids.append(chunk_id)
+            final_ids.append(chunk_id)
+
+        # Сначала запись новых, удаление в конце: при ошибке документ остается целым.
+        # Эмбеддинги новых чанков считаются без write_lock, он берется на запись каждой пачки
+        if added:
+            ingest_documents(vectorstore, added, ids=added_ids, lock=write_lock,
+                             current_vectorstore=lambda: get_vectorstore(client_id))
+        with write_lock:
+            # Коллекцию могли переключить, пока считались эмбеддинги: метаданные и удаление - в текущей.
+            # Лишние чанки ищутся заново, а не по прочитанному в начале списку
+            collection = get_vectorstore(client_id)._collection
+            if kept_ids:
+                collection.update(ids=kept_ids, metadatas=kept_metadatas)
+            final_id_set = set(final_ids)
+            removed_ids = [chunk_id for chunk_id in collection.get(where={"file_id": file_id}, include=[])["ids"]
+                           if chunk_id not in final_id_set]
+            if removed_ids:
+                collection.delete(ids=removed_ids)
+
+        _remember_chunk_ids(file_id, final_ids)
+        bm25_registry.remove_file(file_id)
+        bm25_registry.add_chunks(
+            client_id, final_ids, [split.page_content for split in splits], [split.metadata for split in splits]
+        )
+        stats = {
+            "chunks": len(splits), "added": len(added_ids), "removed": len(removed_ids),
+            "unchanged": len(splits) - len(added_ids), "seconds": round(time.perf_counter() - started, 2)
+        }
+        logging.info(f"Replaced document with file_id {file_id}: {stats}")
+        print(f"Replaced document with file_id {file_id}: {stats}")
+        return stats
     except Exception as e:
-        logging.error(f"Error deleting document with file_id {file_id} from Chroma: {str(e)}")
-        print(f"Error deleting document with file_id {file_id} from Chroma: {str(e)}")
-        return False
+        logging.error(f"Error replacing document with file_id {file_id}: {e}")
+        print(f"Error replacing document with file_id {file_id}: {e}")
+        return None
+
+def _remember_chunk_ids(file_id: int, chunk_ids: List[str]) -> None:
+    """
+    Список id в document_store ускоряет удаление; при ошибке он может устареть,
+    поэтому delete_chunks дополнительно удаляет по фильтру file_id
+    """
+    try:
+        from db_utils import set_document_chunk_ids
+        set_document_chunk_ids(file_id, chunk_ids)
+    except Exception as e:
+        logging.warning(f"Chunk ids of file_id {file_id} were not saved: {e}")
+
+
+def delete_chunks(entries: List[Dict[str, Any]]) -> int:
+    """
+    Удаляет чанки документов: entries - [{"file_id", "client_id", "chunk_ids"}].
+    В коллекции клиента - delete по сохраненным id и delete по фильтру file_id (чанки, добавленные после
+    сохранения списка id); документы без списка id ищутся по фильтру во всех коллекциях
+    """
+    deleted = 0
+    # Коллекции определяются под замком записи: переключение коллекции (reembed, compact) не вклинится
+    # между выбором коллекции и удалением, и чанки не останутся в новой физической коллекции
+    with write_lock:
+        by_collection: Dict[str, Tuple[Any, List[str], List[int]]] = {}
+        without_ids: List[int] = []
+        for entry in entries:
+            if entry.get("chunk_ids"):
+                name = collection_name(entry.get("client_id"))
+                if name not in by_collection:
+                    by_collection[name] = (get_vectorstore(entry.get("client_id")), [], [])
+                by_collection[name][1].extend(entry["chunk_ids"])
+                by_collection[name][2].append(entry["file_id"])
+            else:
+                without_ids.append(entry["file_id"])
+
+        for vectorstore, chunk_ids, file_ids in by_collection.values():
+            for start in range(0, len(chunk_ids), CHROMA_DELETE_BATCH):
+                vectorstore._collection.delete(ids=chunk_ids[start:start + CHROMA_DELETE_BATCH])
+            vectorstore._collection.delete(where={"file_id": {"$in": file_ids}})
+            deleted += len(chunk_ids)
+        if without_ids:
+            # Старые документы могли остаться в общей коллекции и до переноса клиента в выделенную
+            for vectorstore in all_vectorstores():
+                vectorstore._collection.delete(where={"file_id": {"$in": without_ids}})
+    for entry in entries:
+        bm25_registry.remove_file(entry["file_id"])
+    return deleted
 
 def check_document_uniqueness(file_path: str, similarity_threshold: float = 0.8) -> Tuple[bool, float, str]:
     """
@@ -150,14 +520,17 @@ def check_document_uniqueness(file_path: str, similarity_threshold: float = 0.8)
             print("No valid text content in document chunks")
             return False, 0.0, "No valid text content in document chunks"
 
-        new_embeddings = embedding_function.embed_documents(new_texts)
+        vectorstore = get_vectorstore()
+        embeddings = vectorstore.embeddings
+        new_embeddings = embeddings.embed_documents(new_texts)
         logging.debug(f"Generated {len(new_embeddings)} embeddings with shape {np.array(new_embeddings).shape}")
         print(f"Generated {len(new_embeddings)} embeddings with shape {np.array(new_embeddings).shape}")
 
-        # Проверяем размерность каждого эмбеддинга
+        # Размерность задает модель коллекции: у e5 и MiniLM она совпадает, у других моделей может отличаться
+        dimension = (embeddings.dimension,)
         for i, emb in enumerate(new_embeddings):
             emb_array = np.array(emb, dtype=np.float32)
-            if emb_array.shape != (384,):
+            if emb_array.shape != dimension:
                 logging.error(f"Invalid embedding shape for chunk {i}: {emb_array.shape}")
                 print(f"Invalid embedding shape for chunk {i}: {emb_array.shape}")
                 return False, 0.0, f"Invalid embedding shape for chunk {i}"
@@ -176,7 +549,7 @@ def check_document_uniqueness(file_path: str, similarity_threshold: float = 0.8)
         valid_metadatas = []
         for i, emb in enumerate(existing_docs['embeddings']):
             emb_array = np.array(emb, dtype=np.float32)
-            if emb_array.shape != (384,):
+            if emb_array.shape != dimension:
                 logging.error(f"Invalid existing embedding shape at index {i}: {emb_array.shape}")
                 print(f"Invalid existing embedding shape at index {i}: {emb_array.shape}")
                 continue
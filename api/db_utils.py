@@ -1,7 +1,10 @@
 import psycopg2
+import psycopg2.errors
+from psycopg2 import pool as pg_pool
 from datetime import datetime
 from typing import Tuple, List, Dict, Any, Optional
 import os
+import threading
 from dotenv import load_dotenv
 
 # Загружаем переменные окружения
@@ -13,139 +16,267 @@ DB_PORT = os.getenv("DB_PORT", "5432")
 DB_NAME = os.getenv("DB_NAME", "rag_app")
 DB_USER = os.getenv("DB_USER", "devert007")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "kislyCat.03")
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "20"))
+
+_connection_pool = None
+_pool_lock = threading.Lock()
+
+
+class PooledConnection:
+    """
+    Соединение из пула: close() возвращает его в пул вместо закрытия.
+    with get_db_connection() as conn: возвращает соединение и при исключении, иначе пул теряет слот
+    """
+
+    def __init__(self, conn, pool=None):
+        self._conn = conn
+        self._pool = pool
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self):
+        if self._conn is None:
+            return
+        if self._pool is None:
+            self._conn.close()
+        elif self._conn.closed:
+            self._pool.putconn(self._conn, close=True)
+        else:
+            # Незавершенная транзакция (например, после SELECT) не должна попасть к следующему владельцу
+            self._conn.rollback()
+            self._pool.putconn(self._conn)
+        self._conn = None
+
+
+def _connect():
+    return psycopg2.connect(
+        host=DB_HOST,
+        port=DB_PORT,
+        dbname=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD
+    )
+
+def init_connection_pool():
+    """Создает пул соединений при первом обращении"""
+    global _connection_pool
+    if _connection_pool is None:
+        with _pool_lock:
+            if _connection_pool is None:
+                _connection_pool = pg_pool.ThreadedConnectionPool(
+                    DB_POOL_MIN, DB_POOL_MAX,
+                    host=DB_HOST,
+                    port=DB_PORT,
+                    dbname=DB_NAME,
+                    user=DB_USER,
+                    password=DB_PASSWORD
+                )
+    return _connection_pool
 
 def get_db_connection():
-    """Создает и возвращает подключение к PostgreSQL"""
+    """Возвращает подключение к PostgreSQL из пула"""
     try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        return conn
+        connection_pool = init_connection_pool()
+        try:
+            return PooledConnection(connection_pool.getconn(), connection_pool)
+        except pg_pool.PoolError:
+            # Пул исчерпан: не блокируем запрос, открываем отдельное соединение
+            return PooledConnection(_connect())
     except Exception as e:
         print(f"❌ Ошибка подключения к БД: {e}")
-    raise
+        raise
+
+def check_database() -> None:
+    """Проверяет, что БД отвечает; бросает исключение, если нет"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT 1')
+        cursor.fetchone()
+        cursor.close()
 
 
 def create_application_logs():
     """Создает таблицу для логов приложения"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS application_logs (
-            id SERIAL PRIMARY KEY,
-            session_id TEXT NOT NULL,
-            user_query TEXT NOT NULL,
-            gpt_response TEXT NOT NULL,
-            model TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    # Создаем индекс для улучшения производительности запросов по session_id
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_application_logs_session_id 
-        ON application_logs(session_id)
-    ''')
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_application_logs_created_at 
-        ON application_logs(created_at)
-    ''')
-    conn.commit()
-    cursor.close()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS application_logs (
+                id SERIAL PRIMARY KEY,
+                session_id TEXT NOT NULL,
+                user_query TEXT NOT NULL,
+                gpt_response TEXT NOT NULL,
+                model TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # Создаем индекс для улучшения производительности запросов по session_id
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_application_logs_session_id 
+            ON application_logs(session_id)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_application_logs_created_at 
+            ON application_logs(created_at)
+        ''')
+        conn.commit()
+        cursor.close()
 
 def create_document_store():
     """Создает таблицу для хранения документов"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS document_store (
-            id SERIAL PRIMARY KEY,
-            client_id INTEGER NOT NULL,
-            filename TEXT NOT NULL,
-            upload_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (client_id) REFERENCES clients(id) ON DELETE CASCADE,
-            UNIQUE(client_id, filename)  -- ИЗМЕНЕНИЕ: уникальность по паре (client_id, filename)
-        )
-    ''')
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_document_store_filename 
-        ON document_store(filename)
-    ''')
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_document_store_client_id 
-        ON document_store(client_id)
-    ''')
-    conn.commit()
-    cursor.close()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS document_store (
+                id SERIAL PRIMARY KEY,
+                client_id INTEGER NOT NULL,
+                filename TEXT NOT NULL,
+                upload_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (client_id) REFERENCES clients(id) ON DELETE CASCADE,
+                UNIQUE(client_id, filename)  -- ИЗМЕНЕНИЕ: уникальность по паре (client_id, filename)
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_document_store_filename 
+            ON document_store(filename)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_document_store_client_id 
+            ON document_store(client_id)
+        ''')
+        # id чанков в Chroma: удаление идет одним вызовом по списку, без поиска по метаданным
+        cursor.execute('ALTER TABLE document_store ADD COLUMN IF NOT EXISTS chunk_ids TEXT[]')
+        conn.commit()
+        cursor.close()
+
+def create_document_tombstones():
+    """
+    Outbox удалений: запись документа переносится сюда в той же транзакции, в которой удаляется из document_store.
+    Чанки в Chroma удаляются после; пока это не удалось, запись остается и ее повторяет фоновый sweeper
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS document_tombstones (
+                file_id INTEGER PRIMARY KEY,
+                client_id INTEGER,
+                chunk_ids TEXT[],
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                attempts INTEGER DEFAULT 0,
+                last_error TEXT
+            )
+        ''')
+        conn.commit()
+        cursor.close()
 
 def create_test_pdf_store():
     """Создает таблицу для тестовых PDF"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS test_pdf_store (
-            id SERIAL PRIMARY KEY,
-            filename TEXT NOT NULL,
-            client_id INTEGER NOT NULL,
-            document_id INTEGER,
-            session_id TEXT NOT NULL,
-            pdf_content BYTEA NOT NULL,
-            upload_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (client_id) REFERENCES clients(id) ON DELETE CASCADE,
-            FOREIGN KEY (document_id) REFERENCES document_store(id) ON DELETE SET NULL
-        )
-    ''')
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_test_pdf_store_session_id 
-        ON test_pdf_store(session_id)
-    ''')
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_test_pdf_store_document_id 
-        ON test_pdf_store(document_id)
-    ''')
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_test_pdf_store_client_id 
-        ON test_pdf_store(client_id)
-    ''')
-    conn.commit()
-    cursor.close()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS test_pdf_store (
+                id SERIAL PRIMARY KEY,
+                filename TEXT NOT NULL,
+                client_id INTEGER NOT NULL,
+                document_id INTEGER,
+                session_id TEXT NOT NULL,
+                pdf_content BYTEA NOT NULL,
+                upload_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (client_id) REFERENCES clients(id) ON DELETE CASCADE,
+                FOREIGN KEY (document_id) REFERENCES document_store(id) ON DELETE SET NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_test_pdf_store_session_id 
+            ON test_pdf_store(session_id)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_test_pdf_store_document_id 
+            ON test_pdf_store(document_id)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_test_pdf_store_client_id 
+            ON test_pdf_store(client_id)
+        ''')
+        conn.commit()
+        cursor.close()
+
+def create_task_bank():
+    """Создает таблицу банка задач (сложность и тип хранятся в словаре DifficultyLevel/QuestionType)"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS task_bank (
+                id SERIAL PRIMARY KEY,
+                subject TEXT NOT NULL,
+                topic TEXT NOT NULL,
+                difficulty TEXT NOT NULL,
+                question_type TEXT NOT NULL,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                source_difficulty TEXT,
+                source_type TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # Повторный импорт того же XML не создает дублей
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_task_bank_unique_question
+            ON task_bank(subject, topic, md5(question))
+        ''')
+        # Заранее вычисленная случайная перестановка: выборка читает окно по индексу, а не все подходящие id.
+        # ADD COLUMN с random() по умолчанию переписывает таблицу, и у старых строк значения тоже разные
+        cursor.execute('ALTER TABLE task_bank ADD COLUMN IF NOT EXISTS perm DOUBLE PRECISION NOT NULL DEFAULT random()')
+        cursor.execute('DROP INDEX IF EXISTS idx_task_bank_filter')
+        cursor.execute('DROP INDEX IF EXISTS idx_task_bank_subject_difficulty')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_task_bank_filter_perm
+            ON task_bank(subject, topic, difficulty, question_type, perm)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_task_bank_subject_difficulty_perm
+            ON task_bank(subject, difficulty, question_type, perm)
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_task_bank_perm ON task_bank(perm)')
+        conn.commit()
+        cursor.close()
 
 def insert_application_logs(session_id: str, user_query: str, gpt_response: str, model: str) -> int:
     """Вставляет запись в логи приложения и возвращает ID вставленной записи"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        'INSERT INTO application_logs (session_id, user_query, gpt_response, model) VALUES (%s, %s, %s, %s) RETURNING id',
-        (session_id, user_query, gpt_response, model)
-    )
-    log_id = cursor.fetchone()[0]
-    conn.commit()
-    cursor.close()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            'INSERT INTO application_logs (session_id, user_query, gpt_response, model) VALUES (%s, %s, %s, %s) RETURNING id',
+            (session_id, user_query, gpt_response, model)
+        )
+        log_id = cursor.fetchone()[0]
+        conn.commit()
+        cursor.close()
     return log_id
 
 def get_chat_history(session_id: str) -> List[Dict[str, str]]:
     """Получает историю чата для указанной сессии"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        'SELECT user_query, gpt_response FROM application_logs WHERE session_id = %s ORDER BY created_at',
-        (session_id,)
-    )
-    messages = []
-    for row in cursor.fetchall():
-        messages.extend([
-            {"role": "human", "content": row[0]},
-            {"role": "ai", "content": row[1]}
-        ])
-    cursor.close()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            'SELECT user_query, gpt_response FROM application_logs WHERE session_id = %s ORDER BY created_at',
+            (session_id,)
+        )
+        messages = []
+        for row in cursor.fetchall():
+            messages.extend([
+                {"role": "human", "content": row[0]},
+                {"role": "ai", "content": row[1]}
+            ])
+        cursor.close()
     return messages
 
 def insert_document_record(filename: str, client_id: int = None) -> int:
@@ -155,27 +286,26 @@ def insert_document_record(filename: str, client_id: int = None) -> int:
         if client_id is None:
             raise Exception("Не найден клиент по умолчанию")
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        print(f"📝 Вставка документа: {filename}, client_id: {client_id}")
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            print(f"📝 Вставка документа: {filename}, client_id: {client_id}")
         
-        cursor.execute(
-            'INSERT INTO document_store (filename, client_id) VALUES (%s, %s) RETURNING id',
-            (filename, client_id)
-        )
-        file_id = cursor.fetchone()[0]
-        conn.commit()
+            cursor.execute(
+                'INSERT INTO document_store (filename, client_id) VALUES (%s, %s) RETURNING id',
+                (filename, client_id)
+            )
+            file_id = cursor.fetchone()[0]
+            conn.commit()
         
-        print(f"✅ Document record inserted with ID: {file_id}")
-        return file_id
-    except Exception as e:
-        print(f"❌ Error inserting document record: {e}")
-        conn.rollback()
-        raise
-    finally:
-        cursor.close()
-        conn.close()
+            print(f"✅ Document record inserted with ID: {file_id}")
+            return file_id
+        except Exception as e:
+            print(f"❌ Error inserting document record: {e}")
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
 
 def insert_test_pdf_record(filename: str, document_id: int, session_id: str, pdf_content: bytes, client_id: int = None) -> int:
     """Вставляет запись тестового PDF и возвращает ID файла"""
@@ -184,45 +314,42 @@ def insert_test_pdf_record(filename: str, document_id: int, session_id: str, pdf
         if client_id is None:
             raise Exception("Не найден клиент по умолчанию")
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        print(f"📝 Вставка тестового PDF: filename={filename}, document_id={document_id}, client_id={client_id}")
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            print(f"📝 Вставка тестового PDF: filename={filename}, document_id={document_id}, client_id={client_id}")
         
-        cursor.execute(
-            'INSERT INTO test_pdf_store (filename, document_id, session_id, pdf_content, client_id) VALUES (%s, %s, %s, %s, %s) RETURNING id',
-            (filename, document_id, session_id, pdf_content, client_id)
-        )
-        file_id = cursor.fetchone()[0]
-        conn.commit()
+            cursor.execute(
+                'INSERT INTO test_pdf_store (filename, document_id, session_id, pdf_content, client_id) VALUES (%s, %s, %s, %s, %s) RETURNING id',
+                (filename, document_id, session_id, pdf_content, client_id)
+            )
+            file_id = cursor.fetchone()[0]
+            conn.commit()
         
-        print(f"✅ Test PDF record inserted with ID: {file_id}")
-        return file_id
-    except Exception as e:
-        print(f"❌ Error inserting test PDF record: {e}")
-        conn.rollback()
-        raise
-    finally:
-        cursor.close()
-        conn.close()
+            print(f"✅ Test PDF record inserted with ID: {file_id}")
+            return file_id
+        except Exception as e:
+            print(f"❌ Error inserting test PDF record: {e}")
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
 def delete_document_record(file_id: int) -> bool:
     """Удаляет запись документа по ID"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM document_store WHERE id = %s', (file_id,))
-    conn.commit()
-    cursor.close()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM document_store WHERE id = %s', (file_id,))
+        conn.commit()
+        cursor.close()
     return True
 
 def delete_test_pdf_record(file_id: int) -> bool:
     """Удаляет запись тестового PDF по ID"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM test_pdf_store WHERE id = %s', (file_id,))
-    conn.commit()
-    cursor.close()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM test_pdf_store WHERE id = %s', (file_id,))
+        conn.commit()
+        cursor.close()
     return True
 
 def get_all_documents(client_id: int = None) -> List[Dict[str, Any]]:
@@ -230,22 +357,21 @@ def get_all_documents(client_id: int = None) -> List[Dict[str, Any]]:
     if client_id is None:
         client_id = get_default_client_id()
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        'SELECT id, filename, upload_timestamp, client_id FROM document_store WHERE client_id = %s ORDER BY upload_timestamp DESC',
-        (client_id,)
-    )
-    documents = []
-    for row in cursor.fetchall():
-        documents.append({
-            'id': row[0],
-            'filename': row[1],
-            'upload_timestamp': row[2],
-            'client_id': row[3]  # ИЗМЕНЕНИЕ: Добавляем client_id
-        })
-    cursor.close()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            'SELECT id, filename, upload_timestamp, client_id FROM document_store WHERE client_id = %s ORDER BY upload_timestamp DESC',
+            (client_id,)
+        )
+        documents = []
+        for row in cursor.fetchall():
+            documents.append({
+                'id': row[0],
+                'filename': row[1],
+                'upload_timestamp': row[2],
+                'client_id': row[3]  # ИЗМЕНЕНИЕ: Добавляем client_id
+            })
+        cursor.close()
     print(f"📚 Получено документов для client_id {client_id}: {len(documents)}")
     return documents    
 
@@ -254,40 +380,38 @@ def get_all_test_pdfs(client_id: int = None) -> List[Dict[str, Any]]:
     if client_id is None:
         client_id = get_default_client_id()
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT tps.id, tps.filename, tps.document_id, tps.session_id, 
-               tps.upload_timestamp, tps.client_id, ds.filename as document_name
-        FROM test_pdf_store tps
-        LEFT JOIN document_store ds ON tps.document_id = ds.id
-        WHERE tps.client_id = %s 
-        ORDER BY tps.upload_timestamp DESC
-    ''', (client_id,))
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT tps.id, tps.filename, tps.document_id, tps.session_id, 
+                   tps.upload_timestamp, tps.client_id, ds.filename as document_name
+            FROM test_pdf_store tps
+            LEFT JOIN document_store ds ON tps.document_id = ds.id
+            WHERE tps.client_id = %s 
+            ORDER BY tps.upload_timestamp DESC
+        ''', (client_id,))
     
-    test_pdfs = []
-    for row in cursor.fetchall():
-        test_pdfs.append({
-            'id': row[0],
-            'filename': row[1],
-            'document_id': row[2],
-            'session_id': row[3],
-            'upload_timestamp': row[4],
-            'client_id': row[5],  # Добавляем client_id
-            'document_name': row[6]  
-        })
-    cursor.close()
-    conn.close()
+        test_pdfs = []
+        for row in cursor.fetchall():
+            test_pdfs.append({
+                'id': row[0],
+                'filename': row[1],
+                'document_id': row[2],
+                'session_id': row[3],
+                'upload_timestamp': row[4],
+                'client_id': row[5],  # Добавляем client_id
+                'document_name': row[6]  
+            })
+        cursor.close()
     return test_pdfs
 
 def get_test_pdf_content(file_id: int) -> Optional[bytes]:
     """Получает содержимое тестового PDF по ID"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT pdf_content FROM test_pdf_store WHERE id = %s', (file_id,))
-    result = cursor.fetchone()
-    cursor.close()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT pdf_content FROM test_pdf_store WHERE id = %s', (file_id,))
+        result = cursor.fetchone()
+        cursor.close()
     return result[0] if result else None
 
 # В функции check_filename_uniqueness() в db_utils.py
@@ -300,15 +424,14 @@ def check_filename_uniqueness(filename: str, client_id: int = None) -> Tuple[boo
         if client_id is None:
             client_id = get_default_client_id()
             
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            'SELECT filename FROM document_store WHERE filename = %s AND client_id = %s', 
-            (filename, client_id)
-        )
-        result = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'SELECT filename FROM document_store WHERE filename = %s AND client_id = %s', 
+                (filename, client_id)
+            )
+            result = cursor.fetchone()
+            cursor.close()
         if result:
             return False, result[0]
         return True, ""
@@ -321,7 +444,9 @@ def initialize_database():
     create_clients_table()
     create_application_logs()
     create_document_store()
+    create_document_tombstones()
     create_test_pdf_store()
+    create_task_bank()
     
     # Создаем клиента по умолчанию
     client_id = create_default_client()
@@ -334,122 +459,124 @@ def initialize_database():
 
 
 def create_client(username: str, email: str, password_hash: str) -> Optional[int]:
-    """Создает нового клиента/пользователя"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            'INSERT INTO clients (username, email, password_hash) VALUES (%s, %s, %s) RETURNING id',
-            (username, email, password_hash)
-        )
-        client_id = cursor.fetchone()[0]
-        conn.commit()
-        return client_id
-    except Exception as e:
-        print(f"❌ Error creating client: {e}")
-        conn.rollback()
-        return None
-    finally:
-        cursor.close()
-        conn.close()
+    """
+    Создает нового клиента/пользователя. None - имя или email уже заняты (нарушение уникальности);
+    остальные ошибки БД пробрасываются, чтобы сбой не выглядел как занятое имя
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                'INSERT INTO clients (username, email, password_hash) VALUES (%s, %s, %s) RETURNING id',
+                (username, email, password_hash)
+            )
+            client_id = cursor.fetchone()[0]
+            conn.commit()
+            return client_id
+        except psycopg2.errors.UniqueViolation as e:
+            print(f"❌ Client already exists: {e}")
+            conn.rollback()
+            return None
+        except Exception as e:
+            print(f"❌ Error creating client: {e}")
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
 
 
 
 def create_clients_table():
     """Создает таблицу клиентов с поддержкой аутентификации"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        # Сначала проверяем существующие колонки
-        cursor.execute("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_name = 'clients' AND column_name = 'password_hash'
-        """)
-        has_password_hash = cursor.fetchone() is not None
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            # Сначала проверяем существующие колонки
+            cursor.execute("""
+                SELECT column_name 
+                FROM information_schema.columns 
+                WHERE table_name = 'clients' AND column_name = 'password_hash'
+            """)
+            has_password_hash = cursor.fetchone() is not None
         
-        if not has_password_hash:
-            # Добавляем недостающие колонки
-            cursor.execute('ALTER TABLE clients ADD COLUMN password_hash TEXT NOT NULL DEFAULT %s', ('',))
-            cursor.execute('ALTER TABLE clients ADD COLUMN is_active BOOLEAN DEFAULT TRUE')
-            print("✅ Добавлены колонки password_hash и is_active в таблицу clients")
+            if not has_password_hash:
+                # Добавляем недостающие колонки
+                cursor.execute('ALTER TABLE clients ADD COLUMN password_hash TEXT NOT NULL DEFAULT %s', ('',))
+                cursor.execute('ALTER TABLE clients ADD COLUMN is_active BOOLEAN DEFAULT TRUE')
+                print("✅ Добавлены колонки password_hash и is_active в таблицу clients")
         
-        # Создаем индексы если их нет
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_clients_username 
-            ON clients(username)
-        ''')
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_clients_email 
-            ON clients(email)
-        ''')
-        conn.commit()
-        print("✅ Таблица clients готова для аутентификации")
+            # Создаем индексы если их нет
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_clients_username 
+                ON clients(username)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_clients_email 
+                ON clients(email)
+            ''')
+            conn.commit()
+            print("✅ Таблица clients готова для аутентификации")
         
-    except Exception as e:
-        print(f"❌ Ошибка при настройке таблицы clients: {e}")
-        conn.rollback()
-    finally:
-        cursor.close()
-        conn.close()
+        except Exception as e:
+            print(f"❌ Ошибка при настройке таблицы clients: {e}")
+            conn.rollback()
+        finally:
+            cursor.close()
 
 def create_default_client():
     """Создает клиента по умолчанию (без пароля)"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            'INSERT INTO clients (username, email, password_hash) VALUES (%s, %s, %s) ON CONFLICT (username) DO NOTHING RETURNING id',
-            ('default_user', 'default@example.com', '')
-        )
-        result = cursor.fetchone()
-        conn.commit()
-        if result:
-            print(f"✅ Создан клиент по умолчанию с ID: {result[0]}")
-            return result[0]
-        else:
-            # Получаем ID существующего клиента
-            cursor.execute('SELECT id FROM clients WHERE username = %s', ('default_user',))
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                'INSERT INTO clients (username, email, password_hash) VALUES (%s, %s, %s) ON CONFLICT (username) DO NOTHING RETURNING id',
+                ('default_user', 'default@example.com', '')
+            )
             result = cursor.fetchone()
-            return result[0] if result else None
-    except Exception as e:
-        print(f"❌ Ошибка создания клиента: {e}")
-        conn.rollback()
-        return None
-    finally:
-        cursor.close()
-        conn.close()
+            conn.commit()
+            if result:
+                print(f"✅ Создан клиент по умолчанию с ID: {result[0]}")
+                return result[0]
+            else:
+                # Получаем ID существующего клиента
+                cursor.execute('SELECT id FROM clients WHERE username = %s', ('default_user',))
+                result = cursor.fetchone()
+                return result[0] if result else None
+        except Exception as e:
+            print(f"❌ Ошибка создания клиента: {e}")
+            conn.rollback()
+            return None
+        finally:
+            cursor.close()
 
 def get_default_client_id():
     """Получает ID клиента по умолчанию"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute('SELECT id FROM clients WHERE username = %s', ('default_user',))
-        result = cursor.fetchone()
-        if result:
-            return result[0]
-        else:
-            # Если клиент не найден, создаем его
-            return create_default_client()
-    except Exception as e:
-        print(f"❌ Ошибка получения client_id: {e}")
-        return None
-    finally:
-        cursor.close()
-        conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute('SELECT id FROM clients WHERE username = %s', ('default_user',))
+            result = cursor.fetchone()
+            if result:
+                return result[0]
+            else:
+                # Если клиент не найден, создаем его
+                return create_default_client()
+        except Exception as e:
+            print(f"❌ Ошибка получения client_id: {e}")
+            return None
+        finally:
+            cursor.close()
 
 def get_client_by_username(username: str) -> Optional[Dict[str, Any]]:
     """Получает клиента по имени пользователя"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        'SELECT id, username, email, password_hash FROM clients WHERE username = %s AND is_active = TRUE', 
-        (username,)
-    )
-    result = cursor.fetchone()
-    cursor.close()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            'SELECT id, username, email, password_hash FROM clients WHERE username = %s AND is_active = TRUE', 
+            (username,)
+        )
+        result = cursor.fetchone()
+        cursor.close()
     
     if result:
         return {
@@ -462,15 +589,14 @@ def get_client_by_username(username: str) -> Optional[Dict[str, Any]]:
 
 def get_client_by_id(client_id: int) -> Optional[Dict[str, Any]]:
     """Получает клиента по ID"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        'SELECT id, username, email FROM clients WHERE id = %s AND is_active = TRUE', 
-        (client_id,)
-    )
-    result = cursor.fetchone()
-    cursor.close()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            'SELECT id, username, email FROM clients WHERE id = %s AND is_active = TRUE', 
+            (client_id,)
+        )
+        result = cursor.fetchone()
+        cursor.close()
     
     if result:
         return {
@@ -480,7 +606,108 @@ def get_client_by_id(client_id: int) -> Optional[Dict[str, Any]]:
         }
     return None
 
+def get_document_record(file_id: int) -> Optional[Dict[str, Any]]:
+    """Запись документа: id, client_id, filename; None, если документа нет"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT id, client_id, filename FROM document_store WHERE id = %s', (file_id,))
+        result = cursor.fetchone()
+        cursor.close()
+    if result:
+        return {'id': result[0], 'client_id': result[1], 'filename': result[2]}
+    return None
+
+def touch_document_record(file_id: int) -> None:
+    """Обновляет время загрузки после замены содержимого документа"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('UPDATE document_store SET upload_timestamp = CURRENT_TIMESTAMP WHERE id = %s', (file_id,))
+        conn.commit()
+        cursor.close()
+
+def set_document_chunk_ids(file_id: int, chunk_ids: List[str]) -> None:
+    """Запоминает id чанков документа в Chroma (после индексации или замены)"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('UPDATE document_store SET chunk_ids = %s WHERE id = %s', (list(chunk_ids), file_id))
+        conn.commit()
+        cursor.close()
+
+def tombstone_documents(file_ids: Optional[List[int]] = None, client_id: int = None) -> List[Dict[str, Any]]:
+    """
+    Одним запросом удаляет документы из document_store и пишет их в document_tombstones.
+    file_ids=None - все документы клиента; с client_id удаляются только документы этого клиента
+    """
+    conditions, params = [], []
+    if file_ids is not None:
+        conditions.append('id = ANY(%s)')
+        params.append(list(file_ids))
+    if client_id is not None:
+        conditions.append('client_id = %s')
+        params.append(client_id)
+    if not conditions:
+        raise ValueError("file_ids or client_id is required")
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f'''
+                WITH removed AS (
+                    DELETE FROM document_store WHERE {' AND '.join(conditions)}
+                    RETURNING id, client_id, chunk_ids
+                )
+                INSERT INTO document_tombstones (file_id, client_id, chunk_ids)
+                SELECT id, client_id, chunk_ids FROM removed
+                ON CONFLICT (file_id) DO NOTHING
+                RETURNING file_id, client_id, chunk_ids
+            ''', params)
+            tombstones = [{'file_id': row[0], 'client_id': row[1], 'chunk_ids': row[2]} for row in cursor.fetchall()]
+            conn.commit()
+            return tombstones
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+def get_pending_tombstones(limit: int = 100) -> List[Dict[str, Any]]:
+    """Удаления, которые еще не дошли до Chroma; сначала самые старые"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            'SELECT file_id, client_id, chunk_ids FROM document_tombstones ORDER BY created_at LIMIT %s', (limit,)
+        )
+        tombstones = [{'file_id': row[0], 'client_id': row[1], 'chunk_ids': row[2]} for row in cursor.fetchall()]
+        cursor.close()
+    return tombstones
+
+def clear_tombstones(file_ids: List[int]) -> None:
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM document_tombstones WHERE file_id = ANY(%s)', (list(file_ids),))
+        conn.commit()
+        cursor.close()
+
+def record_tombstone_failure(file_ids: List[int], error: str) -> None:
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            'UPDATE document_tombstones SET attempts = attempts + 1, last_error = %s WHERE file_id = ANY(%s)',
+            (error, list(file_ids))
+        )
+        conn.commit()
+        cursor.close()
+
+def get_document_client_map() -> Dict[int, int]:
+    """file_id -> client_id для всех документов (для миграций Chroma)"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT id, client_id FROM document_store')
+        mapping = {row[0]: row[1] for row in cursor.fetchall()}
+        cursor.close()
+    return mapping
+
 
-# Инициализация базы данных при импорте модуля
-if __name__ != "__main__":
+# Таблицы создаются при старте API (main.on_startup) или запуском модуля как скрипта
+if __name__ == "__main__":
     initialize_database()
\ No newline at end of file
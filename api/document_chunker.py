@@ -0,0 +1,183 @@
+# document_chunker.py - разбиение по структуре документа Docling: разделы, таблицы, страницы
+import os
+import re
+from typing import Any, Dict, Iterable, List, Optional
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1000"))
+# Раздел короче этого не становится отдельным чанком, а продолжается следующим
+CHUNK_MIN_SIZE = int(os.getenv("CHUNK_MIN_SIZE", "300"))
+# Перекрытие только при разрезе внутри раздела: хвостовое предложение, если оно не длиннее этого
+CHUNK_MAX_OVERLAP = int(os.getenv("CHUNK_MAX_OVERLAP", "200"))
+
+# Колонтитулы повторяются на каждой странице и только засоряют поиск
+SKIPPED_LABELS = {"page_header", "page_footer"}
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?…])\s+")
+
+# Абзац длиннее чанка режется без перекрытия: его добавляет add_text по тем же правилам, что и между абзацами
+_long_text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=0, length_function=len)
+
+
+def _label(item: Any) -> str:
+    label = getattr(item, "label", "")
+    return str(getattr(label, "value", label))
+
+
+def _page(item: Any) -> Optional[int]:
+    prov = getattr(item, "prov", None)
+    return prov[0].page_no if prov else None
+
+
+def _tail_overlap(text: str) -> str:
+    """Последнее предложение абзаца как перекрытие; длинное не переносится совсем"""
+    sentences = _SENTENCE_END_RE.split(text.strip())
+    tail = sentences[-1] if sentences else ""
+    return tail if 0 < len(tail) <= CHUNK_MAX_OVERLAP and len(sentences) > 1 else ""
+
+
+def _split_point(text: str, room: int) -> int:
+    """Позиция последнего пробела, до которой text помещается в room символов; 0 - негде разрезать"""
+    return max(text.rfind("\n", 0, room + 1), text.rfind(" ", 0, room + 1), 0)
+
+
+def _table_parts(markdown: str) -> List[str]:
+    """Большая таблица режется по строкам, шапка повторяется в каждой части"""
+    lines = markdown.strip().splitlines()
+    if len(markdown) <= CHUNK_SIZE or len(lines) <= 3:
+        return [markdown.strip()]
+    header, rows = lines[:2], lines[2:]
+    parts, current = [], list(header)
+    for row in rows:
+        if len(current) > 2 and sum(len(line) + 1 for line in current) + len(row) > CHUNK_SIZE:
+            parts.append("\n".join(current))
+            current = list(header)
+        current.append(row)
+    parts.append("\n".join(current))
+    return parts
+
+
+class _ChunkBuilder:
+    def __init__(self, source: str):
+        self.source = source
+        self.chunks: List[Document] = []
+        self._heading_stack: List[tuple] = []  # (уровень, текст); заголовок документа - уровень 0
+        self._parts: List[str] = []
+        self._size = 0
+        self._pages: List[int] = []
+        self._section: Optional[str] = None
+
+    @property
+    def headings(self) -> List[str]:
+        return [text for _, text in self._heading_stack]
+
+    def _metadata(self, pages: List[int], content_type: str, headings: Optional[str] = None) -> Dict[str, Any]:
+        # Chroma хранит только скалярные метаданные, поэтому путь разделов - строкой
+        metadata = {"source": self.source, "chunk_index": len(self.chunks), "content_type": content_type,
+                    "headings": headings if headings is not None else " > ".join(self.headings)}
+        if pages:
+            metadata["page"] = min(pages)
+            metadata["page_end"] = max(pages)
+        return metadata
+
+    def flush(self, overlap: str = "") -> None:
+        if self._parts:
+            text = "\n\n".join(self._parts).strip()
+            if text:
+                self.chunks.append(Document(page_content=text, metadata=self._metadata(
+                    self._pages, "text", self._section
+                )))
+        # _size считает и разделитель "\n\n" после каждой части: длина чанка не больше CHUNK_SIZE
+        self._parts, self._size, self._pages = ([overlap], len(overlap) + 2, []) if overlap else ([], 0, [])
+        self._section = None
+
+    def heading(self, text: str, level: int, page: Optional[int]) -> None:
+        # Маленькое вступление раздела не закрывается, а уходит в один чанк с первым подразделом;
+        # соседний раздел того же или верхнего уровня всегда начинает новый чанк, перекрытие через границу не переносится
+        marked = "#" * min(level + 1, 6) + " " + text.strip()
+        sibling = bool(self._heading_stack) and level <= self._heading_stack[-1][0]
+        if sibling or self._size >= CHUNK_MIN_SIZE or self._size + len(marked) > CHUNK_SIZE:
+            self.flush()
+        while self._heading_stack and self._heading_stack[-1][0] >= level:
+            self._heading_stack.pop()
+        self._heading_stack.append((level, text))
+        self.add_text(marked, page)
+        # Внутри чанка каждый следующий заголовок глубже предыдущего: чанк относится к самому глубокому разделу
+        self._section = " > ".join(self.headings)
+
+    def add_text(self, text: str, page: Optional[int]) -> None:
+        text = text.strip()
+        if not text:
+            return
+        if len(text) > CHUNK_SIZE:
+            for piece in _long_text_splitter.split_text(text):
+                self.add_text(piece, page)
+            return
+        if self._size + len(text) > CHUNK_SIZE:
+            if self._size >= CHUNK_MIN_SIZE:
+                overlap = _tail_overlap(self._parts[-1])
+                self.flush(overlap if len(overlap) + 2 + len(text) <= CHUNK_SIZE else "")
+            else:
+                # Начало меньше CHUNK_MIN_SIZE (например, один заголовок) не отрезается отдельным чанком:
+                # текст дописывается в него до CHUNK_SIZE, остаток начинает следующий чанк
+                cut = _split_point(text, CHUNK_SIZE - self._size)
+                if cut:
+                    self._append(text[:cut].rstrip(), page)
+                    text = text[cut:].strip()
+                self.flush()
+        self._append(text, page)
+
+    def _append(self, text: str, page: Optional[int]) -> None:
+        if self._section is None:
+            self._section = " > ".join(self.headings)
+        self._parts.append(text)
+        self._size += len(text) + 2
+        if page:
+            self._pages.append(page)
+
+    def add_table(self, markdown: str, caption: str, page: Optional[int]) -> None:
+        # Таблица - отдельный чанк (или несколько с общей шапкой), соседний текст не режет ее строки
+        self.flush()
+        for part in _table_parts(markdown):
+            text = f"{caption}\n\n{part}" if caption else part
+            self.chunks.append(Document(page_content=text, metadata=self._metadata([page] if page else [], "table")))
+
+
+def chunk_docling_document(document: Any, source: str) -> List[Document]:
+    """
+    Обходит дерево DoclingDocument и собирает чанки по разделам:
+    заголовки задают путь (metadata["headings"]), таблицы идут отдельными чанками,
+    у каждого чанка - страницы (page, page_end) и порядковый номер chunk_index
+    """
+    builder = _ChunkBuilder(source)
+    # Подписи таблиц уже вошли в чанк таблицы и не должны повторяться отдельным текстом
+    table_captions = set()
+    for item, _ in document.iterate_items():
+        label = _label(item)
+        page = _page(item)
+        if label in SKIPPED_LABELS or getattr(item, "self_ref", None) in table_captions:
+            continue
+        if label == "title":
+            builder.heading(item.text, 0, page)
+        elif label == "section_header":
+            builder.heading(item.text, getattr(item, "level", 1), page)
+        elif label == "table":
+            table_captions.update(ref.cref for ref in getattr(item, "captions", []))
+            caption = item.caption_text(document) if hasattr(item, "caption_text") else ""
+            builder.add_table(item.export_to_markdown(doc=document), caption, page)
+        elif label == "list_item":
+            builder.add_text(f"{getattr(item, 'marker', '') or '-'} {item.text}", page)
+        elif hasattr(item, "text"):
+            builder.add_text(item.text, page)
+    builder.flush()
+    return builder.chunks
+
+
+def chunk_docling_documents(documents: Iterable[Any], source: str) -> List[Document]:
+    chunks: List[Document] = []
+    for document in documents:
+        for chunk in chunk_docling_document(document, source):
+            chunk.metadata["chunk_index"] = len(chunks)
+            chunks.append(chunk)
+    return chunks
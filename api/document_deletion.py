@@ -0,0 +1,76 @@
+# document_deletion.py - удаление документов через outbox: PostgreSQL -> tombstone -> Chroma, с фоновым доочищением
+import os
+import time
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+from chroma_utils import delete_chunks
+from db_utils import clear_tombstones, get_pending_tombstones, record_tombstone_failure, tombstone_documents
+
+TOMBSTONE_SWEEP_INTERVAL = float(os.getenv("TOMBSTONE_SWEEP_INTERVAL", "30"))
+TOMBSTONE_SWEEP_BATCH = int(os.getenv("TOMBSTONE_SWEEP_BATCH", "200"))
+
+
+def purge_tombstones(tombstones: List[Dict[str, Any]]) -> bool:
+    """Удаляет чанки документов из Chroma и закрывает их tombstone; при ошибке запись остается для sweeper"""
+    if not tombstones:
+        return True
+    file_ids = [tombstone["file_id"] for tombstone in tombstones]
+    try:
+        deleted = delete_chunks(tombstones)
+        clear_tombstones(file_ids)
+        logging.info(f"Purged {len(file_ids)} documents ({deleted} chunks by id) from Chroma")
+        return True
+    except Exception as e:
+        logging.error(f"Failed to purge documents {file_ids} from Chroma, left for the sweeper: {e}")
+        try:
+            record_tombstone_failure(file_ids, str(e))
+        except Exception as db_error:
+            logging.error(f"Failed to record tombstone failure: {db_error}")
+        return False
+
+
+def delete_documents(file_ids: Optional[List[int]] = None, client_id: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Удаляет документы: записи в document_store атомарно превращаются в tombstone,
+    затем чанки удаляются из Chroma. file_ids=None - вся библиотека клиента
+    """
+    tombstones = tombstone_documents(file_ids, client_id)
+    purged = purge_tombstones(tombstones)
+    deleted_ids = [tombstone["file_id"] for tombstone in tombstones]
+    return {"deleted": deleted_ids, "pending": [] if purged else deleted_ids}
+
+
+class TombstoneSweeper:
+    """Фоновый поток: повторяет удаление из Chroma для tombstone, которые не удалось закрыть сразу"""
+
+    def __init__(self, interval: float = TOMBSTONE_SWEEP_INTERVAL, batch: int = TOMBSTONE_SWEEP_BATCH):
+        self.interval = interval
+        self.batch = batch
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def sweep(self) -> int:
+        tombstones = get_pending_tombstones(self.batch)
+        if tombstones and purge_tombstones(tombstones):
+            return len(tombstones)
+        return 0
+
+    def _loop(self) -> None:
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                logging.error(f"Tombstone sweep failed: {e}")
+            time.sleep(self.interval)
+
+    def start(self) -> None:
+        """Запускает sweeper один раз на процесс"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="tombstone-sweeper", daemon=True)
+                self._thread.start()
+
+
+tombstone_sweeper = TombstoneSweeper()
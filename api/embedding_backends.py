@@ -0,0 +1,117 @@
+# embedding_backends.py - реестр моделей эмбеддингов: многоязычные модели, ONNX/int8 на CPU, пакетное кодирование
+import os
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+# Модель по умолчанию - прежняя all-MiniLM-L6-v2, чтобы существующие коллекции читались без миграции
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "minilm")
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME")
+# Путь к локальной копии модели или к кэшу sentence-transformers.
+# Если задан, модель грузится только с диска, без запросов к huggingface.co
+EMBEDDING_MODEL_PATH = os.getenv("EMBEDDING_MODEL_PATH")
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR")
+EMBEDDING_OFFLINE = os.getenv(
+    "EMBEDDING_OFFLINE", "true" if (EMBEDDING_MODEL_PATH or EMBEDDING_CACHE_DIR) else "false"
+).lower() in ("1", "true", "yes")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))  # 0 - решает torch/onnxruntime
+# Модель для ONNX-бэкенда (id или каталог после chroma_migrations.py quantize-embeddings) и файл int8-весов в ней
+EMBEDDING_ONNX_MODEL = os.getenv("EMBEDDING_ONNX_MODEL", "intfloat/multilingual-e5-small")
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_qint8_avx512_vnni.onnx")
+
+# model - id на huggingface; prefixes - e5 обучены с "query: " / "passage: " и без них теряют качество
+EMBEDDING_MODELS: Dict[str, Dict[str, Any]] = {
+    "minilm": {"model": "all-MiniLM-L6-v2", "backend": "torch"},
+    "e5-small": {
+        "model": "intfloat/multilingual-e5-small", "backend": "torch",
+        "query_prefix": "query: ", "passage_prefix": "passage: ",
+    },
+    "e5-small-onnx-int8": {
+        "model": EMBEDDING_ONNX_MODEL, "backend": "onnx", "onnx_file": EMBEDDING_ONNX_FILE,
+        "query_prefix": "query: ", "passage_prefix": "passage: ",
+    },
+}
+
+
+class SentenceTransformerBackend(Embeddings):
+    """Модель sentence-transformers (torch или ONNX Runtime), загружается при первом обращении"""
+
+    def __init__(self, name: str, spec: Dict[str, Any]):
+        self.name = name
+        self.spec = spec
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model_id(self) -> str:
+        if self.name == EMBEDDING_BACKEND:
+            return EMBEDDING_MODEL_PATH or EMBEDDING_MODEL_NAME or self.spec["model"]
+        return self.spec["model"]
+
+    def _load(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    if EMBEDDING_OFFLINE:
+                        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+                        os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+                    from sentence_transformers import SentenceTransformer
+
+                    kwargs: Dict[str, Any] = {"device": "cpu", "cache_folder": EMBEDDING_CACHE_DIR}
+                    model_kwargs: Dict[str, Any] = {"local_files_only": True} if EMBEDDING_OFFLINE else {}
+                    if self.spec.get("backend") == "onnx":
+                        kwargs["backend"] = "onnx"
+                        model_kwargs["provider"] = "CPUExecutionProvider"
+                        if self.spec.get("onnx_file"):
+                            model_kwargs["file_name"] = self.spec["onnx_file"]
+                        if EMBEDDING_THREADS > 0:
+                            import onnxruntime
+                            session_options = onnxruntime.SessionOptions()
+                            session_options.intra_op_num_threads = EMBEDDING_THREADS
+                            model_kwargs["session_options"] = session_options
+                    elif EMBEDDING_THREADS > 0:
+                        import torch
+                        torch.set_num_threads(EMBEDDING_THREADS)
+                    self._model = SentenceTransformer(self.model_id, model_kwargs=model_kwargs, **kwargs)
+                    logging.info(f"Embedding model loaded: {self.name} ({self.model_id}, {self.spec.get('backend')})")
+        return self._model
+
+    @property
+    def dimension(self) -> int:
+        return self._load().get_sentence_embedding_dimension()
+
+    def _encode(self, texts: List[str], prefix: str) -> List[List[float]]:
+        if not texts:
+            return []
+        vectors = self._load().encode(
+            [prefix + text for text in texts],
+            batch_size=EMBEDDING_BATCH_SIZE,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+        return vectors.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._encode(texts, self.spec.get("passage_prefix", ""))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._encode([text], self.spec.get("query_prefix", ""))[0]
+
+
+_backends: Dict[str, SentenceTransformerBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def get_embeddings(name: Optional[str] = None) -> SentenceTransformerBackend:
+    """Экземпляр модели эмбеддингов по имени из EMBEDDING_MODELS; один на процесс"""
+    name = name or EMBEDDING_BACKEND
+    if name not in EMBEDDING_MODELS:
+        raise ValueError(f"Unknown embedding backend {name!r}. Available: {', '.join(EMBEDDING_MODELS)}")
+    with _backends_lock:
+        backend = _backends.get(name)
+        if backend is None:
+            backend = _backends[name] = SentenceTransformerBackend(name, EMBEDDING_MODELS[name])
+        return backend
@@ -0,0 +1,195 @@
+# export_utils.py - экспорт тестов в PDF/DOCX: разбор Markdown один раз, рендер по требованию с кэшем
+import os
+import re
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from typing import Dict, List, Optional
+
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Шрифты с кириллицей; берется первый найденный
+EXPORT_FONT_PATHS = [
+    path for path in (
+        os.getenv("EXPORT_FONT_PATH"),
+        os.path.join(_BASE_DIR, "..", "app", "pages", "DejaVuSans.ttf"),
+        os.path.join(_BASE_DIR, "..", "Arial.ttf"),
+    ) if path
+]
+EXPORT_CACHE_MAX_ENTRIES = int(os.getenv("EXPORT_CACHE_MAX_ENTRIES", "200"))
+
+FONT_NAME = "ExportFont"
+FALLBACK_FONT_NAME = "Helvetica"
+FONT_SIZES = {"heading1": 16, "heading2": 14, "heading3": 13, "paragraph": 12, "list_item": 12}
+
+_font_lock = threading.Lock()
+_font_name: Optional[str] = None
+
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.*)$")
+_LIST_RE = re.compile(r"^\s*(?:[-*+]|\d+[.)])\s+")
+_INLINE_RE = re.compile(r"(\*\*|__|`)")
+
+
+class Block:
+    """Элемент макета: заголовок, абзац, пункт списка или пустая строка"""
+    __slots__ = ("kind", "text")
+
+    def __init__(self, kind: str, text: str):
+        self.kind = kind
+        self.text = text
+
+
+def parse_markdown(markdown_text: str) -> List[Block]:
+    """Разбирает Markdown в список блоков. Каждая строка - отдельный блок: в тестах важны переводы строк"""
+    blocks: List[Block] = []
+    for raw_line in markdown_text.splitlines():
+        line = _INLINE_RE.sub("", raw_line).strip()
+        if not line:
+            blocks.append(Block("blank", ""))
+            continue
+        heading = _HEADING_RE.match(line)
+        if heading:
+            level = min(len(heading.group(1)), 3)
+            blocks.append(Block(f"heading{level}", heading.group(2).strip()))
+        elif _LIST_RE.match(line):
+            blocks.append(Block("list_item", line))
+        else:
+            blocks.append(Block("paragraph", line))
+    return blocks
+
+
+def register_fonts() -> str:
+    """Регистрирует шрифт с кириллицей в reportlab один раз на процесс"""
+    global _font_name
+    if _font_name is None:
+        with _font_lock:
+            if _font_name is None:
+                from reportlab.pdfbase import pdfmetrics
+                from reportlab.pdfbase.ttfonts import TTFont
+                for path in EXPORT_FONT_PATHS:
+                    if os.path.exists(path):
+                        try:
+                            pdfmetrics.registerFont(TTFont(FONT_NAME, path))
+                            _font_name = FONT_NAME
+                            logging.info(f"Export font registered: {path}")
+                            break
+                        except Exception as e:
+                            logging.warning(f"Failed to register font {path}: {e}")
+                if _font_name is None:
+                    logging.warning("No Cyrillic font found for export, falling back to Helvetica")
+                    _font_name = FALLBACK_FONT_NAME
+    return _font_name
+
+
+def render_pdf(blocks: List[Block]) -> bytes:
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.utils import simpleSplit
+    from reportlab.pdfgen import canvas
+
+    font_name = register_fonts()
+    page_width, page_height = A4
+    margin = 50
+    max_width = page_width - 2 * margin
+
+    buffer = BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    text = pdf.beginText(margin, page_height - margin)
+    y = page_height - margin
+
+    for block in blocks:
+        size = FONT_SIZES.get(block.kind, FONT_SIZES["paragraph"])
+        leading = size * 1.4
+        # Перенос по словам с учетом ширины символов шрифта, а не по числу символов
+        lines = simpleSplit(block.text, font_name, size, max_width) if block.text else [""]
+        text.setFont(font_name, size, leading)
+        for line in lines:
+            if y - leading < margin:
+                pdf.drawText(text)
+                pdf.showPage()
+                y = page_height - margin
+                text = pdf.beginText(margin, y)
+                text.setFont(font_name, size, leading)
+            text.textLine(line)
+            y -= leading
+
+    pdf.drawText(text)
+    pdf.save()
+    return buffer.getvalue()
+
+
+def render_docx(blocks: List[Block]) -> bytes:
+    from docx import Document
+    from docx.shared import Pt
+
+    doc = Document()
+    style = doc.styles['Normal']
+    style.font.name = 'Arial'
+    style.font.size = Pt(12)
+
+    for block in blocks:
+        if block.kind == "blank":
+            continue
+        if block.kind.startswith("heading"):
+            doc.add_heading(block.text, level=int(block.kind[-1]))
+        elif block.kind == "list_item":
+            paragraph = doc.add_paragraph(block.text)
+            paragraph.paragraph_format.left_indent = Pt(18)
+        else:
+            # Word сам переносит строки, ручная нарезка не нужна
+            doc.add_paragraph(block.text)
+
+    buffer = BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+RENDERERS = {"pdf": render_pdf, "docx": render_docx}
+MEDIA_TYPES = {
+    "pdf": "application/pdf",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "md": "text/markdown; charset=utf-8",
+}
+
+
+class ExportCache:
+    """LRU-кэш экспортов по sha256 содержимого: макет строится при регистрации, файлы - при первом скачивании"""
+
+    def __init__(self, max_entries: int = EXPORT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict[str, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def register(self, markdown_text: str) -> str:
+        """Макет всегда строится из Markdown: он же ключ кэша и то, что видно в предпросмотре"""
+        export_id = hashlib.sha256(markdown_text.encode("utf-8")).hexdigest()
+        with self._lock:
+            if export_id in self._entries:
+                self._entries.move_to_end(export_id)
+                return export_id
+        blocks = parse_markdown(markdown_text)
+        with self._lock:
+            self._entries[export_id] = {"md": markdown_text.encode("utf-8"), "blocks": blocks}
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return export_id
+
+    def render(self, export_id: str, fmt: str) -> Optional[bytes]:
+        """Возвращает файл нужного формата; None, если экспорт неизвестен или вытеснен"""
+        if fmt not in MEDIA_TYPES:
+            raise ValueError(f"Unsupported export format: {fmt}")
+        with self._lock:
+            entry = self._entries.get(export_id)
+            if entry is None:
+                return None
+            self._entries.move_to_end(export_id)
+            cached = entry.get(fmt)
+        if cached is not None:
+            return cached
+        data = RENDERERS[fmt](entry["blocks"])
+        with self._lock:
+            entry[fmt] = data
+        return data
+
+
+export_cache = ExportCache()
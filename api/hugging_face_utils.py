@@ -1,11 +1,159 @@
 # hugging_face_utils.py
 import os
+import time
 import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, List, Union
 from dotenv import load_dotenv
 from huggingface_hub import InferenceClient
 
 load_dotenv()
 
+HF_INFERENCE_BASE_URL = os.getenv("HF_INFERENCE_BASE_URL") or None
+HF_REQUEST_TIMEOUT = float(os.getenv("HF_REQUEST_TIMEOUT", "60"))
+# Через сколько секунд без ответа запускать запрос к следующей модели параллельно
+HF_HEDGE_DELAY = float(os.getenv("HF_HEDGE_DELAY", "8"))
+HF_TOTAL_DEADLINE = float(os.getenv("HF_TOTAL_DEADLINE", "90"))
+HF_MAX_PARALLEL_ATTEMPTS = int(os.getenv("HF_MAX_PARALLEL_ATTEMPTS", "3"))
+HF_BREAKER_FAILURES = int(os.getenv("HF_BREAKER_FAILURES", "3"))
+HF_BREAKER_COOLDOWN = float(os.getenv("HF_BREAKER_COOLDOWN", "60"))
+# Сколько секунд считать известное состояние модели актуальным и как часто перепроверять устаревшие
+HF_HEALTH_TTL = float(os.getenv("HF_HEALTH_TTL", "300"))
+HF_PROBE_INTERVAL = float(os.getenv("HF_PROBE_INTERVAL", "60"))
+HF_PROBE_PARALLELISM = int(os.getenv("HF_PROBE_PARALLELISM", "4"))
+HF_LATENCY_EWMA_ALPHA = float(os.getenv("HF_LATENCY_EWMA_ALPHA", "0.3"))
+
+
+class ModelsUnavailableError(Exception):
+    """Ни одна модель цепочки не ответила до HF_TOTAL_DEADLINE"""
+
+
+class CircuitBreaker:
+    """
+    Предохранитель модели: после HF_BREAKER_FAILURES ошибок подряд модель пропускается
+    на HF_BREAKER_COOLDOWN секунд, затем пропускается одна пробная попытка
+    """
+
+    def __init__(self, failure_threshold: int = HF_BREAKER_FAILURES, cooldown: float = HF_BREAKER_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half_open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def is_available(self) -> bool:
+        """Проверка без захвата пробной попытки - для выбора кандидатов"""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            return time.monotonic() - self.opened_at >= self.cooldown and not self._probe_in_flight
+
+    def allow(self) -> bool:
+        """Разрешает запрос; в полуоткрытом состоянии - только один пробный"""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.cooldown or self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+class ModelHealth:
+    __slots__ = ("available", "checked_at", "latency_ewma", "successes", "failures", "last_error")
+
+    def __init__(self):
+        self.available = None  # None - еще не проверялась
+        self.checked_at = 0.0
+        self.latency_ewma = None
+        self.successes = 0
+        self.failures = 0
+        self.last_error = None
+
+
+class ModelHealthTracker:
+    """
+    Состояние моделей: обновляется пассивно по исходам настоящих запросов
+    и активно фоновым проверяльщиком для устаревших записей
+    """
+
+    def __init__(self, ttl: float = HF_HEALTH_TTL, alpha: float = HF_LATENCY_EWMA_ALPHA):
+        self.ttl = ttl
+        self.alpha = alpha
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, ok: bool, latency: float = None, error: str = None) -> None:
+        with self._lock:
+            health = self._models.setdefault(model, ModelHealth())
+            health.available = ok
+            health.checked_at = time.monotonic()
+            if ok:
+                health.successes += 1
+                health.last_error = None
+                if latency is not None:
+                    health.latency_ewma = latency if health.latency_ewma is None else \
+                        self.alpha * latency + (1 - self.alpha) * health.latency_ewma
+            else:
+                health.failures += 1
+                health.last_error = error
+
+    def is_stale(self, model: str) -> bool:
+        with self._lock:
+            health = self._models.get(model)
+            return health is None or time.monotonic() - health.checked_at > self.ttl
+
+    def available(self, model: str):
+        """True/False по свежим данным, None - если данных нет или они устарели"""
+        with self._lock:
+            health = self._models.get(model)
+            if health is None or time.monotonic() - health.checked_at > self.ttl:
+                return None
+            return health.available
+
+    def latency(self, model: str) -> float:
+        with self._lock:
+            health = self._models.get(model)
+            return health.latency_ewma if health and health.latency_ewma is not None else float("inf")
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                model: {
+                    "available": health.available,
+                    "age_seconds": round(now - health.checked_at, 1),
+                    "latency_ewma": round(health.latency_ewma, 3) if health.latency_ewma is not None else None,
+                    "successes": health.successes,
+                    "failures": health.failures,
+                    "last_error": health.last_error,
+                }
+                for model, health in self._models.items()
+            }
+
+
 class HuggingFaceClient:
     def __init__(self):
         self.hf_token = os.getenv("HF_API_TOKEN")
@@ -43,91 +191,150 @@ class HuggingFaceClient:
     "zephyr-7b",       # Надежный
     "gpt2"             # Fallback
 ]
-        # Инициализируем клиент
-        self.client = InferenceClient(token=self.hf_token)
+        self.breakers = {model_key: CircuitBreaker() for model_key in self.working_models}
+        self.health = ModelHealthTracker()
+        self._prober_thread = None
+        self._prober_lock = threading.Lock()
+        self._probe_executor = ThreadPoolExecutor(max_workers=HF_PROBE_PARALLELISM, thread_name_prefix="hf-probe")
+        # Инициализируем клиент; HF_INFERENCE_BASE_URL позволяет направить запросы на локальный mock-сервер
+        self.client = InferenceClient(base_url=HF_INFERENCE_BASE_URL, token=self.hf_token, timeout=HF_REQUEST_TIMEOUT)
+        self._executor = ThreadPoolExecutor(max_workers=HF_MAX_PARALLEL_ATTEMPTS * 4, thread_name_prefix="hf-hedge")
+    
+    def _generate_once(self, model: str, prompt: Union[str, List[Dict[str, str]]], max_length: int, temperature: float) -> str:
+        """
+        Один запрос к одной модели без fallback; бросает исключение при ошибке или пустом ответе.
+        prompt - строка или готовый список сообщений chat_completion
+        """
+        model_name = self.working_models.get(model, model)
+        logging.info(f"Generating text with model: {model_name}")
+        response = self.client.chat_completion(
+            model=model_name,
+            messages=prompt if isinstance(prompt, list) else [{"role": "user", "content": prompt}],
+            max_tokens=max_length,
+            temperature=temperature,
+        )
+        if not response or not getattr(response, 'choices', None):
+            raise ValueError(f"Unexpected response format: {response}")
+        generated_text = (response.choices[0].message.content or "").strip()
+        if not generated_text:
+            raise ValueError("Empty response")
+        return generated_text
     
-    def generate_text(self, prompt: str, model: str = "deepseek-r1", max_length: int = 2000, temperature: float = 0.7) -> str:
-        """Генерация текста через современный chat_completion API"""
+    def _attempt(self, model: str, prompt: Union[str, List[Dict[str, str]]], max_length: int, temperature: float) -> str:
+        breaker = self.breakers.setdefault(model, CircuitBreaker())
+        if not breaker.allow():
+            raise RuntimeError(f"Circuit breaker for {model} is open")
+        started = time.monotonic()
         try:
-            model_name = self.working_models.get(model, model)
-            
-            logging.info(f"Generating text with model: {model_name}")
-            
-            # Используем новый chat_completion API
-            response = self.client.chat_completion(
-                model=model_name,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=max_length,
-                temperature=temperature,
-                # provider="auto"  # Автоматический выбор провайдера
-            )
-            
-            # Извлекаем ответ
-            if response and hasattr(response, 'choices') and len(response.choices) > 0:
-                generated_text = response.choices[0].message.content.strip()
-                logging.info(f"Successfully generated text: {generated_text[:100]}...")
-                return generated_text
-            else:
-                logging.error(f"Unexpected response format: {response}")
-                return self._try_fallback_chain(prompt, model)
-                
+            result = self._generate_once(model, prompt, max_length, temperature)
         except Exception as e:
-            error_msg = f"Hugging Face chat_completion error: {str(e)}"
-            logging.error(error_msg)
-            return self._try_fallback_chain(prompt, model)
+            breaker.record_failure()
+            self.health.record(model, False, error=str(e))
+            raise
+        breaker.record_success()
+        self.health.record(model, True, time.monotonic() - started)
+        return result
+    
+    def _candidates(self, model: str) -> List[str]:
+        """
+        Запрошенная модель, затем цепочка приоритетов. Модели с разомкнутым предохранителем пропускаются,
+        заведомо недоступные по свежим данным уходят в конец, доступные - по приоритету цепочки
+        """
+        chain = [key for key in self.priority_chain if key != model]
+        chain.sort(key=lambda key: self.health.available(key) is False)
+        return [key for key in [model] + chain if self.breakers.setdefault(key, CircuitBreaker()).is_available()]
     
-    def _try_fallback_chain(self, prompt: str, failed_model: str = None) -> str:
-        """Пробует использовать цепочку запасных моделей"""
-        start_index = 0
-        if failed_model:
-            for i, model in enumerate(self.priority_chain):
-                if model == failed_model:
-                    start_index = i + 1
-                    break
+    def generate_text(self, prompt: Union[str, List[Dict[str, str]]], model: str = "deepseek-r1", max_length: int = 2000, temperature: float = 0.7) -> str:
+        """
+        Генерация текста через chat_completion с хеджированием:
+        если модель не ответила за HF_HEDGE_DELAY секунд или упала, запускается следующая из цепочки,
+        берется первый успешный ответ. Общее время ограничено HF_TOTAL_DEADLINE.
+        Если не ответила ни одна модель - ModelsUnavailableError
+        """
+        deadline = time.monotonic() + HF_TOTAL_DEADLINE
+        candidates = deque(self._candidates(model))
+        pending = {}
         
-        for i in range(start_index, len(self.priority_chain)):
-            fallback_model = self.priority_chain[i]
-            logging.info(f"Trying fallback model {i+1}/{len(self.priority_chain)}: {fallback_model}")
+        while candidates or pending:
+            if candidates and len(pending) < HF_MAX_PARALLEL_ATTEMPTS:
+                candidate = candidates.popleft()
+                logging.info(f"Starting attempt with model {candidate} ({len(pending) + 1} in flight)")
+                future = self._executor.submit(self._attempt, candidate, prompt, max_length, temperature)
+                pending[future] = candidate
             
-            try:
-                # Используем базовые параметры для fallback
-                result = self.generate_text(
-                    prompt=prompt,
-                    model=fallback_model,
-                    max_length=1500,
-                    temperature=0.7
-                )
-                
-                if result and not result.startswith("Ошибка"):
-                    logging.info(f"Fallback model {fallback_model} succeeded")
-                    return result
-                    
-            except Exception as e:
-                logging.warning(f"Fallback model {fallback_model} also failed: {e}")
-                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logging.error(f"HF deadline of {HF_TOTAL_DEADLINE}s exceeded")
+                break
+            # Пока есть кого запускать, ждем только до порога хеджирования
+            timeout = min(HF_HEDGE_DELAY, remaining) if candidates else remaining
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            
+            for future in done:
+                candidate = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logging.warning(f"Model {candidate} failed: {e}")
+                    continue
+                logging.info(f"Model {candidate} succeeded: {result[:100]}...")
+                for other in pending:
+                    other.cancel()
+                return result
         
-        error_msg = "Извините, все модели временно недоступны. Пожалуйста, попробуйте позже."
+        # Незавершенные попытки досчитаются в фоне и обновят предохранители
+        for future in pending:
+            future.cancel()
         logging.error("All models failed")
-        return error_msg
+        raise ModelsUnavailableError("All Hugging Face models are temporarily unavailable")
     
-    def get_available_models(self) -> list:
-        """Возвращает список доступных моделей"""
-        available_models = []
-        
-        for model_key, model_name in self.working_models.items():
+    def _probe(self, model: str) -> None:
+        """Проверка доступности коротким запросом; результат попадает в health"""
+        started = time.monotonic()
+        try:
+            self.client.chat_completion(
+                model=self.working_models.get(model, model),
+                messages=[{"role": "user", "content": "test"}],
+                max_tokens=1
+            )
+            self.health.record(model, True, time.monotonic() - started)
+            logging.info(f"✓ Model {model} is available")
+        except Exception as e:
+            self.health.record(model, False, error=str(e))
+            logging.warning(f"✗ Model {model} is unavailable: {e}")
+    
+    def probe_stale(self) -> None:
+        """Параллельно (не больше HF_PROBE_PARALLELISM) перепроверяет модели без свежих данных"""
+        stale = [model for model in self.working_models if self.health.is_stale(model)]
+        for future in [self._probe_executor.submit(self._probe, model) for model in stale]:
+            future.result()
+    
+    def _prober_loop(self) -> None:
+        while True:
             try:
-                # Простая проверка доступности модели
-                test_response = self.client.chat_completion(
-                    model=model_name,
-                    messages=[{"role": "user", "content": "test"}],
-                    max_tokens=1
-                )
-                available_models.append(model_key)
-                logging.info(f"✓ Model {model_key} is available")
+                self.probe_stale()
             except Exception as e:
-                logging.warning(f"✗ Model {model_key} is unavailable: {e}")
-        
-        return available_models
+                logging.error(f"Model prober failed: {e}")
+            time.sleep(HF_PROBE_INTERVAL)
+    
+    def start_prober(self) -> None:
+        """Запускает фоновую проверку моделей один раз на процесс"""
+        with self._prober_lock:
+            if self._prober_thread is None:
+                self._prober_thread = threading.Thread(target=self._prober_loop, name="hf-prober", daemon=True)
+                self._prober_thread.start()
+    
+    def get_available_models(self) -> list:
+        """
+        Возвращает доступные модели по кэшированным данным, не дожидаясь проверки.
+        При первом вызове запускает фоновую проверку; пока данных нет, список может быть пустым
+        """
+        self.start_prober()
+        available_models = [
+            model for model in self.working_models
+            if self.health.available(model) and self.breakers[model].is_available()
+        ]
+        return sorted(available_models, key=self.health.latency)
 
 # Глобальный клиент
 hf_client = HuggingFaceClient()
\ No newline at end of file
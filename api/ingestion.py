@@ -0,0 +1,202 @@
+# ingestion.py - конвейер индексации: чанки -> пакетный эмбеддинг в пуле потоков -> запись в Chroma крупными пачками
+import os
+import time
+import uuid
+import queue
+import logging
+import threading
+from contextlib import nullcontext
+from typing import Any, Callable, ContextManager, Dict, Iterable, List, Optional
+
+from langchain_core.documents import Document
+
+# Пачка для модели: encode внутри еще делит ее по EMBEDDING_BATCH_SIZE
+INGEST_EMBED_BATCH = int(os.getenv("INGEST_EMBED_BATCH", "64"))
+# torch и onnxruntime отпускают GIL в encode, поэтому потоки действительно работают параллельно
+INGEST_EMBED_WORKERS = int(os.getenv("INGEST_EMBED_WORKERS", "2"))
+INGEST_WRITE_BATCH = int(os.getenv("INGEST_WRITE_BATCH", "256"))
+# Сколько пачек может ждать между стадиями: ограничивает память на больших документах
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "4"))
+
+_STOP = object()
+
+
+class IngestionStats:
+    """Счетчики по стадиям (split, embed, write): чанки, пачки, занятое время; throughput - чанков в секунду"""
+
+    STAGES = ("split", "embed", "write")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {stage: {"chunks": 0, "batches": 0, "seconds": 0.0} for stage in self.STAGES}
+        self._documents = 0
+        self._failed = 0
+        self._last: Dict[str, Any] = {}
+
+    def record(self, stage: str, chunks: int, seconds: float) -> None:
+        with self._lock:
+            counters = self._stages[stage]
+            counters["chunks"] += chunks
+            counters["batches"] += 1
+            counters["seconds"] += seconds
+
+    def finish(self, chunks: int, seconds: float, failed: bool = False) -> None:
+        with self._lock:
+            self._documents += 1
+            self._failed += int(failed)
+            self._last = {"chunks": chunks, "seconds": round(seconds, 3),
+                          "chunks_per_second": round(chunks / seconds, 1) if seconds else None}
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = {
+                stage: {
+                    "chunks": counters["chunks"],
+                    "batches": counters["batches"],
+                    "busy_seconds": round(counters["seconds"], 3),
+                    "chunks_per_second": round(counters["chunks"] / counters["seconds"], 1) if counters["seconds"] else None,
+                }
+                for stage, counters in self._stages.items()
+            }
+            return {"documents": self._documents, "failed": self._failed, "last_document": dict(self._last),
+                    "stages": stages}
+
+
+ingestion_stats = IngestionStats()
+
+
+def ingest_documents(vectorstore: Any, chunks: Iterable[Document], ids: Optional[Iterable[str]] = None,
+                     embed_batch: int = INGEST_EMBED_BATCH, workers: int = INGEST_EMBED_WORKERS,
+                     write_batch: int = INGEST_WRITE_BATCH, lock: Optional[ContextManager] = None,
+                     current_vectorstore: Optional[Callable[[], Any]] = None) -> List[str]:
+    """
+    Индексирует чанки в коллекцию vectorstore и возвращает их id в исходном порядке.
+    ids - готовые id чанков (по одному на чанк), без них генерируются uuid.
+    Пока пул считает эмбеддинги следующих пачек, поток записи пишет готовые в Chroma.
+    lock берется только на запись каждой пачки: эмбеддинги считаются без него.
+    current_vectorstore вызывается под lock и возвращает коллекцию, куда писать сейчас: если коллекцию
+    переключили (compact, rebuild-hnsw), пачки идут в новую; если сменилась модель эмбеддингов - ошибка.
+    При ошибке уже записанные чанки удаляются, исключение пробрасывается
+    """
+    embeddings = vectorstore.embeddings
+    lock = lock if lock is not None else nullcontext()
+    # Коллекции, куда попали записанные чанки: после переключения их может быть две
+    targets: List[Any] = [vectorstore._collection]
+    embed_queue: "queue.Queue" = queue.Queue(maxsize=INGEST_QUEUE_SIZE)
+    write_queue: "queue.Queue" = queue.Queue(maxsize=INGEST_QUEUE_SIZE)
+    errors: List[BaseException] = []
+    written: List[str] = []
+    started = time.perf_counter()
+
+    def embed_worker() -> None:
+        while True:
+            batch = embed_queue.get()
+            if batch is _STOP:
+                return
+            if errors:
+                continue  # после ошибки только разбираем очередь, чтобы не заблокировать производителя
+            try:
+                stage = time.perf_counter()
+                vectors = embeddings.embed_documents(batch["documents"])
+                ingestion_stats.record("embed", len(vectors), time.perf_counter() - stage)
+                write_queue.put(dict(batch, embeddings=vectors))
+            except BaseException as e:
+                errors.append(e)
+
+    def target_collection() -> Any:
+        if current_vectorstore is None:
+            return targets[0]
+        current = current_vectorstore()
+        if current.embeddings is not embeddings:
+            raise RuntimeError("Embedding model of the collection changed during ingestion, index the document again")
+        if all(current._collection is not target for target in targets):
+            targets.append(current._collection)
+        return current._collection
+
+    def flush(pending: Dict[str, list]) -> None:
+        stage = time.perf_counter()
+        with lock:
+            target_collection().upsert(**pending)
+            written.extend(pending["ids"])
+        ingestion_stats.record("write", len(pending["ids"]), time.perf_counter() - stage)
+
+    def writer() -> None:
+        pending: Dict[str, list] = {"ids": [], "embeddings": [], "documents": [], "metadatas": []}
+        while True:
+            batch = write_queue.get()
+            if batch is _STOP:
+                break
+            if errors:
+                continue
+            for key in pending:
+                pending[key].extend(batch[key])
+            if len(pending["ids"]) >= write_batch:
+                try:
+                    flush(pending)
+                except BaseException as e:
+                    errors.append(e)
+                pending = {key: [] for key in pending}
+        if pending["ids"] and not errors:
+            try:
+                flush(pending)
+            except BaseException as e:
+                errors.append(e)
+
+    embed_threads = [threading.Thread(target=embed_worker, daemon=True) for _ in range(max(1, workers))]
+    write_thread = threading.Thread(target=writer, daemon=True)
+    for thread in embed_threads + [write_thread]:
+        thread.start()
+
+    given_ids = iter(ids) if ids is not None else None
+    ids = []
+    try:
+        batch: Dict[str, list] = {"ids": [], "documents": [], "metadatas": []}
+        stage = time.perf_counter()
+        for chunk in chunks:
+            if errors:
+                break
+            chunk_id = next(given_ids) if given_ids is not None else str(uuid.uuid4())
+            ids.append(chunk_id)
+            batch["ids"].append(chunk_id)
+            batch["documents"].append(chunk.page_content)
+            batch["metadatas"].append(chunk.metadata)
+            if len(batch["ids"]) >= embed_batch:
+                ingestion_stats.record("split", len(batch["ids"]), time.perf_counter() - stage)
+                embed_queue.put(batch)
+                batch = {"ids": [], "documents": [], "metadatas": []}
+                stage = time.perf_counter()
+        if batch["ids"] and not errors:
+            ingestion_stats.record("split", len(batch["ids"]), time.perf_counter() - stage)
+            embed_queue.put(batch)
+    except BaseException as e:
+        errors.append(e)
+    finally:
+        for _ in embed_threads:
+            embed_queue.put(_STOP)
+        for thread in embed_threads:
+            thread.join()
+        write_queue.put(_STOP)
+        write_thread.join()
+
+    elapsed = time.perf_counter() - started
+    if errors:
+        if written:
+            with lock:
+                if current_vectorstore is not None:
+                    # Переключение могло перенести записанные чанки в новую коллекцию (в т.ч. с другой моделью)
+                    try:
+                        current = current_vectorstore()._collection
+                        if all(current is not target for target in targets):
+                            targets.append(current)
+                    except Exception as e:
+                        logging.error(f"Failed to resolve the current collection for rollback: {e}")
+                for target in targets:
+                    try:
+                        target.delete(ids=written)
+                    except Exception as e:
+                        logging.error(f"Failed to roll back {len(written)} written chunks: {e}")
+        ingestion_stats.finish(len(ids), elapsed, failed=True)
+        raise errors[0]
+    ingestion_stats.finish(len(ids), elapsed)
+    logging.info(f"Ingested {len(ids)} chunks in {elapsed:.2f}s ({workers} embed workers)")
+    return ids
@@ -1,9 +1,10 @@
 # langchain_utils.py
-from langchain_community.chat_models import ChatOllama
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.chains import create_history_aware_retriever, create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from chroma_utils import vectorstore
+from retrieval import HybridRetriever
+from llm_backends import get_backend
+from pydantic_models import ModelName
 import logging
 
 from langchain_core.messages import HumanMessage, AIMessage
@@ -35,14 +36,14 @@ class SimpleChatHistory(BaseChatMessageHistory):
     def messages(self, value: List[Dict[str, Any]]) -> None:
         self._messages = value
 
+def get_llm(temperature: float = 0.3, num_predict: int = 2000, model: ModelName = ModelName.VIKHR):
+    """Чат-модель выбранного бэкенда (Ollama, Hugging Face или локальная) с общими настройками"""
+    return get_backend(model).chat_model(temperature=temperature, num_predict=num_predict)
+
 def get_chat_agent():
     """Создает чат-агента для обсуждения системы OneClickTest"""
     try:
-        llm = ChatOllama(
-            model="lakomoor/vikhr-llama-3.2-1b-instruct:1b",
-            temperature=0.3,
-            num_predict=1000
-        )
+        llm = get_llm(temperature=0.3, num_predict=1000)
         
         # Системный промпт для агента поддержки
         system_prompt = """
@@ -92,7 +93,9 @@ def get_chat_agent():
 
 
 
-retriever = vectorstore.as_retriever(search_kwargs={"k": 2})
+def get_retriever(client_id: int = None, document_ids: List[int] = None) -> HybridRetriever:
+    """Гибридный ретривер (BM25 + векторы) по документам клиента или только по document_ids"""
+    return HybridRetriever(client_id=client_id, file_ids=document_ids or None)
 
 # Русский системный промпт для Vikhr модели
 contextualize_q_system_prompt = (
@@ -109,14 +112,10 @@ contextualize_q_prompt = ChatPromptTemplate.from_messages([
     ("human", "{input}"),
 ])
 
-def get_rag_chain():
-    """Создает RAG цепочку для Vikhr модели"""
+def get_rag_chain(model: ModelName = ModelName.VIKHR, retriever=None):
+    """Создает RAG цепочку для выбранной модели (по умолчанию Vikhr)"""
     try:
-        llm = ChatOllama(
-            model="lakomoor/vikhr-llama-3.2-1b-instruct:1b",
-            temperature=0.3,
-            num_predict=2000
-        )
+        llm = get_llm(temperature=0.3, num_predict=2000, model=model)
         
         qa_prompt = ChatPromptTemplate.from_messages([
             ("system", "Ты профессиональный генератор тестов. Создавай вопросы строго на основе предоставленного контекста."),
@@ -125,7 +124,7 @@ def get_rag_chain():
             ("human", "{input}")
         ])
         
-        history_aware_retriever = create_history_aware_retriever(llm, retriever, contextualize_q_prompt)
+        history_aware_retriever = create_history_aware_retriever(llm, retriever or get_retriever(), contextualize_q_prompt)
         question_answer_chain = create_stuff_documents_chain(llm, qa_prompt)
         rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
         
@@ -140,10 +139,12 @@ def get_rag_chain():
         
         return FallbackChain()
 
-# Проверка доступности модели при импорте
-try:
-    llm = ChatOllama(model="lakomoor/vikhr-llama-3.2-1b-instruct:1b")
-    test_response = llm.invoke("Привет")
-    print("✅ Модель Vikhr доступна!")
-except Exception as e:
-    print(f"❌ Модель Vikhr недоступна: {e}")
\ No newline at end of file
+def warm_up_llm() -> bool:
+    """Явный прогрев: загружает модель в память Ollama коротким запросом"""
+    try:
+        get_llm(num_predict=1).invoke("Привет")
+        print("✅ Модель Vikhr доступна!")
+        return True
+    except Exception as e:
+        print(f"❌ Модель Vikhr недоступна: {e}")
+        return False
@@ -0,0 +1,293 @@
+# llm_backends.py - реестр бэкендов генерации: Ollama, Hugging Face Inference и локальная модель на CPU
+import os
+import abc
+import time
+import queue
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+from langchain_community.chat_models import ChatOllama
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from llm_scheduler import LLMScheduler, llm_scheduler
+from pydantic_models import ModelName
+
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", ModelName.VIKHR.value)
+# Сколько Ollama держит модель в памяти после запроса
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# Одновременные запросы к Hugging Face Inference ограничены квотами, а не железом
+HF_MAX_IN_FLIGHT = int(os.getenv("HF_MAX_IN_FLIGHT", "4"))
+
+LOCAL_LLM_MODEL = os.getenv("LOCAL_LLM_MODEL", "HuggingFaceTB/SmolLM2-360M-Instruct")
+LOCAL_LLM_MAX_BATCH = int(os.getenv("LOCAL_LLM_MAX_BATCH", "8"))
+# Сколько ждать попутчиков для пакета после первого запроса
+LOCAL_LLM_BATCH_WAIT_MS = float(os.getenv("LOCAL_LLM_BATCH_WAIT_MS", "20"))
+LOCAL_LLM_THREADS = int(os.getenv("LOCAL_LLM_THREADS", "0"))  # 0 - решает torch
+
+_ROLES = {"system": "system", "human": "user", "ai": "assistant"}
+
+
+class BackendUnavailable(Exception):
+    """Бэкенд не смог ответить (например, недоступны все модели Hugging Face); API отвечает 503"""
+
+
+def to_chat_messages(messages: List[BaseMessage]) -> List[Dict[str, str]]:
+    """Сообщения LangChain в формат chat_completion / chat template"""
+    return [{"role": _ROLES.get(message.type, "user"), "content": message.content} for message in messages]
+
+
+class CallableChatModel(BaseChatModel):
+    """Чат-модель LangChain поверх функции messages -> text, чтобы цепочки работали с любым бэкендом"""
+    backend_name: str
+    generate_fn: Any
+    temperature: float = 0.3
+    num_predict: int = 2000
+
+    @property
+    def _llm_type(self) -> str:
+        return self.backend_name
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        text = self.generate_fn(to_chat_messages(messages), self.temperature, self.num_predict)
+        if stop:
+            for token in stop:
+                text = text.split(token)[0]
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+
+class LLMBackend(abc.ABC):
+    """Бэкенд генерации: отдает чат-модель LangChain и свой планировщик допуска"""
+    name = "base"
+    # Переиспользует ли сервер KV-кэш общего префикса промпта между запросами
+    supports_prefix_cache = False
+
+    def __init__(self, scheduler: LLMScheduler):
+        self.scheduler = scheduler
+
+    @abc.abstractmethod
+    def chat_model(self, temperature: float = 0.3, num_predict: int = 2000, json_mode: bool = False) -> BaseChatModel:
+        """json_mode - ограничить вывод валидным JSON, если бэкенд это умеет; иначе JSON задается только промптом"""
+
+    def warm_up(self) -> bool:
+        try:
+            self.chat_model(num_predict=1).invoke("Привет")
+            return True
+        except Exception as e:
+            logging.warning(f"Warm-up of {self.name} backend failed: {e}")
+            return False
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"backend": self.name, **self.scheduler.metrics()}
+
+
+class OllamaBackend(LLMBackend):
+    name = "ollama"
+    supports_prefix_cache = True
+
+    def __init__(self, model: str, scheduler: LLMScheduler):
+        super().__init__(scheduler)
+        self.model = model
+
+    def chat_model(self, temperature: float = 0.3, num_predict: int = 2000, json_mode: bool = False) -> BaseChatModel:
+        return ChatOllama(
+            model=self.model,
+            keep_alive=OLLAMA_KEEP_ALIVE,
+            temperature=temperature,
+            num_predict=num_predict,
+            # Грамматика JSON на стороне Ollama: модель не может выйти за синтаксис
+            format="json" if json_mode else None
+        )
+
+
+class HuggingFaceBackend(LLMBackend):
+    """Hugging Face Inference через hf_client: хеджированный fallback по цепочке моделей"""
+    name = "huggingface"
+
+    def __init__(self, model_key: str, scheduler: LLMScheduler):
+        super().__init__(scheduler)
+        self.model_key = model_key
+
+    def _generate(self, messages: List[Dict[str, str]], temperature: float, num_predict: int) -> str:
+        # Клиент создается при импорте модуля, поэтому импорт откладывается до первого запроса
+        from hugging_face_utils import ModelsUnavailableError, hf_client
+        try:
+            return hf_client.generate_text(messages, model=self.model_key, max_length=num_predict,
+                                           temperature=temperature)
+        except ModelsUnavailableError as e:
+            raise BackendUnavailable(str(e)) from e
+
+    def chat_model(self, temperature: float = 0.3, num_predict: int = 2000, json_mode: bool = False) -> BaseChatModel:
+        return CallableChatModel(backend_name=self.name, generate_fn=self._generate,
+                                 temperature=temperature, num_predict=num_predict)
+
+
+class _LocalRequest:
+    __slots__ = ("messages", "temperature", "max_new_tokens", "done", "result", "error")
+
+    def __init__(self, messages: List[Dict[str, str]], temperature: float, max_new_tokens: int):
+        self.messages = messages
+        self.temperature = temperature
+        self.max_new_tokens = max_new_tokens
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class BatchingEngine:
+    """
+    Локальная модель transformers на CPU с динамическим пакетированием:
+    один поток-исполнитель забирает из очереди все запросы, пришедшие за LOCAL_LLM_BATCH_WAIT_MS
+    (не больше LOCAL_LLM_MAX_BATCH), и прогоняет их одним generate. Пока пакет считается,
+    новые запросы копятся и уходят следующим пакетом.
+    """
+
+    def __init__(self, model_id: str, max_batch: int = LOCAL_LLM_MAX_BATCH,
+                 max_wait_ms: float = LOCAL_LLM_BATCH_WAIT_MS):
+        self.model_id = model_id
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue[_LocalRequest]" = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._model = None
+        self._tokenizer = None
+        self._stats = {"batches": 0, "requests": 0, "generate_seconds": 0.0}
+
+    def _load(self) -> None:
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        if LOCAL_LLM_THREADS > 0:
+            torch.set_num_threads(LOCAL_LLM_THREADS)
+        started = time.perf_counter()
+        tokenizer = AutoTokenizer.from_pretrained(self.model_id)
+        # Декодер-only модели дописывают справа, поэтому паддинг слева
+        tokenizer.padding_side = "left"
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        model = AutoModelForCausalLM.from_pretrained(self.model_id, torch_dtype=torch.float32)
+        model.eval()
+        self._tokenizer, self._model = tokenizer, model
+        print(f"✅ Локальная модель {self.model_id} загружена за {time.perf_counter() - started:.1f} c")
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="local-llm", daemon=True)
+                self._thread.start()
+
+    def submit(self, messages: List[Dict[str, str]], temperature: float, max_new_tokens: int) -> str:
+        self._ensure_started()
+        request = _LocalRequest(messages, temperature, max_new_tokens)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _collect(self) -> List[_LocalRequest]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self) -> None:
+        load_error = None
+        try:
+            self._load()
+        except Exception as e:
+            logging.error(f"Failed to load local model {self.model_id}: {e}")
+            load_error = e
+        while True:
+            batch = self._collect()
+            if load_error is not None:
+                for request in batch:
+                    request.error = load_error
+                    request.done.set()
+                continue
+            # Температура задается на весь generate, поэтому пакет делится по ней
+            groups: Dict[float, List[_LocalRequest]] = {}
+            for request in batch:
+                groups.setdefault(request.temperature, []).append(request)
+            for temperature, group in groups.items():
+                try:
+                    self._run(group, temperature)
+                except Exception as e:
+                    logging.error(f"Local batch of {len(group)} failed: {e}")
+                    for request in group:
+                        request.error = e
+                finally:
+                    for request in group:
+                        request.done.set()
+
+    def _run(self, group: List[_LocalRequest], temperature: float) -> None:
+        import torch
+
+        tokenizer, model = self._tokenizer, self._model
+        prompts = [
+            tokenizer.apply_chat_template(request.messages, tokenize=False, add_generation_prompt=True)
+            for request in group
+        ]
+        inputs = tokenizer(prompts, return_tensors="pt", padding=True)
+        max_new_tokens = max(request.max_new_tokens for request in group)
+        started = time.perf_counter()
+        with torch.inference_mode():
+            output = model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                do_sample=temperature > 0,
+                temperature=temperature if temperature > 0 else None,
+                pad_token_id=tokenizer.pad_token_id
+            )
+        elapsed = time.perf_counter() - started
+        new_tokens = output[:, inputs["input_ids"].shape[1]:]
+        for request, row in zip(group, new_tokens):
+            request.result = tokenizer.decode(row[:request.max_new_tokens], skip_special_tokens=True).strip()
+        self._stats["batches"] += 1
+        self._stats["requests"] += len(group)
+        self._stats["generate_seconds"] += elapsed
+
+    def metrics(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats["avg_batch_size"] = round(stats["requests"] / stats["batches"], 2) if stats["batches"] else 0.0
+        stats["waiting"] = self._queue.qsize()
+        stats["loaded"] = self._model is not None
+        return stats
+
+
+class LocalBackend(LLMBackend):
+    """Модель в процессе API на CPU; параллельные запросы объединяются в пакеты"""
+    name = "local"
+
+    def __init__(self, model_id: str, scheduler: LLMScheduler):
+        super().__init__(scheduler)
+        self.engine = BatchingEngine(model_id)
+
+    def chat_model(self, temperature: float = 0.3, num_predict: int = 2000, json_mode: bool = False) -> BaseChatModel:
+        return CallableChatModel(backend_name=self.name, generate_fn=self.engine.submit,
+                                 temperature=temperature, num_predict=num_predict)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {**super().metrics(), "batching": self.engine.metrics()}
+
+
+BACKENDS: Dict[ModelName, LLMBackend] = {
+    ModelName.VIKHR: OllamaBackend(OLLAMA_MODEL, llm_scheduler),
+    ModelName.SMOL_LM_3B: HuggingFaceBackend("smol-lm-3b", LLMScheduler(max_in_flight=HF_MAX_IN_FLIGHT)),
+    # Допуск пропускает целый пакет, иначе объединять было бы нечего
+    ModelName.LOCAL_CPU: LocalBackend(LOCAL_LLM_MODEL, LLMScheduler(max_in_flight=LOCAL_LLM_MAX_BATCH)),
+}
+
+
+def get_backend(model: ModelName = ModelName.VIKHR) -> LLMBackend:
+    return BACKENDS[ModelName(model)]
@@ -0,0 +1,126 @@
+# llm_scheduler.py - допуск запросов к Ollama: лимит одновременных генераций, приоритеты и честная очередь
+import os
+import time
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from enum import IntEnum
+from typing import Any, Deque, Dict, Hashable, Iterator
+
+# Должно совпадать с OLLAMA_NUM_PARALLEL сервера Ollama: больше запросов он все равно не обработает одновременно
+OLLAMA_NUM_PARALLEL = int(os.getenv("OLLAMA_NUM_PARALLEL", "2"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0  # чат: короткие ответы, пользователь ждет
+    BATCH = 1        # генерация тестов: длинные ответы
+
+
+class SchedulerQueueFull(Exception):
+    """Очередь переполнена; API отвечает 429"""
+
+
+class _Ticket:
+    __slots__ = ("client", "priority", "enqueued_at", "granted")
+
+    def __init__(self, client: Hashable, priority: Priority):
+        self.client = client
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+
+
+class LLMScheduler:
+    """
+    Не больше max_in_flight генераций одновременно.
+    Свободный слот получает очередь с высшим приоритетом; внутри приоритета
+    клиенты обслуживаются по кругу, чтобы один клиент с пачкой запросов не занял всех.
+    """
+
+    def __init__(self, max_in_flight: int = OLLAMA_NUM_PARALLEL, max_queue: int = LLM_MAX_QUEUE):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self._cond = threading.Condition()
+        self._queues: Dict[Priority, "OrderedDict[Hashable, Deque[_Ticket]]"] = {
+            priority: OrderedDict() for priority in Priority
+        }
+        self._queued = 0
+        self._in_flight = 0
+        self._stats = {"admitted": 0, "rejected": 0, "completed": 0}
+        self._wait_ms_avg = {priority: 0.0 for priority in Priority}
+
+    def _dispatch(self) -> None:
+        while self._in_flight < self.max_in_flight and self._queued:
+            for priority in Priority:
+                clients = self._queues[priority]
+                if clients:
+                    break
+            client, tickets = next(iter(clients.items()))
+            ticket = tickets.popleft()
+            if tickets:
+                clients.move_to_end(client)
+            else:
+                del clients[client]
+            self._queued -= 1
+            self._in_flight += 1
+            ticket.granted = True
+            wait_ms = (time.monotonic() - ticket.enqueued_at) * 1000
+            self._wait_ms_avg[priority] = 0.9 * self._wait_ms_avg[priority] + 0.1 * wait_ms
+        self._cond.notify_all()
+
+    def queue_depth(self) -> int:
+        with self._cond:
+            return self._queued
+
+    def _is_full(self) -> bool:
+        return self._in_flight >= self.max_in_flight and self._queued >= self.max_queue
+
+    def is_full(self) -> bool:
+        with self._cond:
+            return self._is_full()
+
+    @contextmanager
+    def slot(self, client: Hashable, priority: Priority = Priority.INTERACTIVE,
+             reject_when_full: bool = True) -> Iterator[None]:
+        """
+        Ждет свободный слот и держит его на время блока with.
+        reject_when_full=False - для потоков пакетной генерации: их число уже ограничено пулом
+        """
+        ticket = _Ticket(client if client is not None else "anonymous", priority)
+        with self._cond:
+            if reject_when_full and self._is_full():
+                self._stats["rejected"] += 1
+                raise SchedulerQueueFull(f"LLM queue is full ({self._queued} waiting)")
+            self._queues[priority].setdefault(ticket.client, deque()).append(ticket)
+            self._queued += 1
+            self._stats["admitted"] += 1
+            self._dispatch()
+            while not ticket.granted:
+                self._cond.wait()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._stats["completed"] += 1
+                self._dispatch()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "max_in_flight": self.max_in_flight,
+                "max_queue": self.max_queue,
+                "in_flight": self._in_flight,
+                "queued": self._queued,
+                "queued_by_priority": {
+                    priority.name.lower(): sum(len(tickets) for tickets in self._queues[priority].values())
+                    for priority in Priority
+                },
+                "clients_waiting": len({client for queues in self._queues.values() for client in queues}),
+                "avg_wait_ms": {priority.name.lower(): round(value, 1) for priority, value in self._wait_ms_avg.items()},
+                **self._stats,
+            }
+
+
+llm_scheduler = LLMScheduler()
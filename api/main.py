@@ -1,77 +1,193 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Response, Query
-from pydantic_models import QueryInput, QueryResponse, DocumentInfo, DeleteFileRequest, TestPDFInfo, TestGenerationRequest
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic_models import QueryInput, QueryResponse, DocumentInfo, DeleteFileRequest, DeleteDocumentsRequest, TestPDFInfo, TestGenerationRequest
 from pydantic_models import TestGenerationRequest, QuestionType, DifficultyLevel
-from langchain_utils import get_rag_chain
+from pydantic_models import AssistantInput, AssistantResponse, LoginRequest, RegisterRequest, ClientInfo, BankTask
+from pydantic_models import ExportRequest, ExportInfo, SaveExportRequest, BatchTestGenerationRequest, ReembedRequest
+from pydantic_models import CompactRequest, HnswRebuildRequest
+from langchain_utils import get_rag_chain, get_retriever, get_chat_agent, warm_up_llm
+from auth_utils import authenticate_client, register_client
 from db_utils import (
     insert_application_logs, get_chat_history, get_all_documents, insert_document_record, 
     delete_document_record, insert_test_pdf_record, get_all_test_pdfs, delete_test_pdf_record,
-    get_test_pdf_content,check_filename_uniqueness
+    get_test_pdf_content,check_filename_uniqueness, get_default_client_id, initialize_database,
+    check_database, get_document_record, touch_document_record
 )
-from langchain_utils import  get_rag_chain
-from chroma_utils import vectorstore,index_document_to_chroma, delete_doc_from_chroma,check_document_uniqueness, load_and_split_document
+from readiness import readiness
+from reranker import RERANK_ENABLED, reranker
+import task_bank
+from export_utils import export_cache, register_fonts, MEDIA_TYPES
+from quiz_schema import append_questions, render_markdown
+from quiz_generation import generate_test_content, generate_tests_batch, BATCH_MAX_VARIANTS
+from llm_scheduler import Priority, SchedulerQueueFull
+from llm_backends import BACKENDS, BackendUnavailable, get_backend
+from chroma_migrations import collection_job, reembed_collection
+from ingestion import ingestion_stats
+from document_deletion import delete_documents, tombstone_sweeper
+from chroma_maintenance import chroma_maintainer, compact, list_snapshots, rebuild_hnsw, snapshot, store_stats
+from embedding_backends import EMBEDDING_MODELS
+from chroma_utils import active_collection, claim_store, collection_name, get_file_chunks, warm_up_collection, warm_up_embeddings, index_document_to_chroma, replace_document_in_chroma,check_document_uniqueness, load_and_split_document
 import os
+import json
 import uuid
 import logging
 import shutil
+import psycopg2
 from typing import Optional,Tuple
 
 logging.basicConfig(filename='app.log', level=logging.INFO)
 
 app = FastAPI()
 
+def _warm_up_postgres():
+    initialize_database()
+    check_database()
+
+def _warm_up_ollama():
+    if not warm_up_llm():
+        raise RuntimeError("Ollama model is not available")
+
+readiness.register("postgres", _warm_up_postgres)
+readiness.register("chroma", warm_up_collection)
+readiness.register("embedding_model", warm_up_embeddings)
+readiness.register("ollama", _warm_up_ollama)
+if RERANK_ENABLED:
+    readiness.register("reranker", reranker.warm_up)
+
+@app.on_event("startup")
+def on_startup():
+    """Подключение к БД и прогрев моделей идут в фоне; готовность отдает /readyz"""
+    readiness.start()
+    # CLI-команды, переключающие коллекции, не запустятся, пока API держит хранилище
+    if not claim_store():
+        logging.error("Chroma store is held by a maintenance command, collection switches may be missed until it ends")
+    register_fonts()
+    tombstone_sweeper.start()
+    chroma_maintainer.start()
+
+@app.get("/healthz")
+def healthz():
+    """Liveness: процесс жив и отвечает"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readyz():
+    """Readiness: все компоненты прогреты, с временем прогрева каждого; reranker - работает ли переранжирование сейчас"""
+    report = readiness.report()
+    report["reranker"] = reranker.status()
+    return JSONResponse(status_code=200 if report["ready"] else 503, content=report)
+
+@app.get("/metrics/llm")
+def llm_metrics():
+    """Загрузка очередей к моделям: сколько генераций идет, сколько ждет и как долго"""
+    return {model.value: backend.metrics() for model, backend in BACKENDS.items()}
+
+@app.get("/metrics/ingestion")
+def ingestion_metrics():
+    """Пропускная способность индексации по стадиям: разбиение, эмбеддинг, запись в Chroma"""
+    return ingestion_stats.snapshot()
+
+@app.get("/collections/embeddings")
+def collection_embeddings(client_id: int = Query(None)):
+    """Активная физическая коллекция и модель эмбеддингов; доступные модели и состояние фоновой операции"""
+    return {
+        "active": active_collection(collection_name(client_id)),
+        "available": sorted(EMBEDDING_MODELS),
+        "job": collection_job.status
+    }
+
+@app.post("/collections/reembed", status_code=202)
+def start_reembed(request: ReembedRequest):
+    """Запускает фоновое перестроение коллекции под другую модель; поиск работает со старой до переключения"""
+    if request.embedding not in EMBEDDING_MODELS:
+        raise HTTPException(status_code=400, detail=f"Unknown embedding backend {request.embedding}. Available: {', '.join(EMBEDDING_MODELS)}")
+    try:
+        return collection_job.start("reembed", reembed_collection, embedding=request.embedding, client_id=request.client_id)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/maintenance/chroma/stats")
+def chroma_stats():
+    """Коллекции, сегменты HNSW (файлы, доля удаленных элементов), рекомендуемые параметры HNSW, размеры на диске"""
+    return {**store_stats(), "job": collection_job.status}
+
+@app.post("/maintenance/chroma/compact", status_code=202)
+def chroma_compact(request: CompactRequest):
+    """Фоновая компактизация коллекции: пересборка без удаленных элементов, очистка сегментов, VACUUM"""
+    try:
+        return collection_job.start("compact", compact, client_id=request.client_id, force=request.force)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.post("/maintenance/chroma/rebuild-hnsw", status_code=202)
+def chroma_rebuild_hnsw(request: HnswRebuildRequest):
+    """Фоновая пересборка HNSW с новыми M / ef_construction / ef_search; поиск работает со старым индексом до переключения"""
+    try:
+        return collection_job.start("rebuild-hnsw", rebuild_hnsw, client_id=request.client_id, m=request.m,
+                                    ef_construction=request.ef_construction, ef_search=request.ef_search)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.post("/maintenance/chroma/snapshot")
+def chroma_snapshot():
+    """Согласованный снапшот хранилища; запись в Chroma на это время приостанавливается"""
+    return snapshot()
+
+@app.get("/maintenance/chroma/snapshots")
+def chroma_snapshots():
+    return {"snapshots": list_snapshots()}
+
 @app.post("/generate-test")
 def generate_test(request: TestGenerationRequest):
     """
     Генерирует тест по заданным параметрам (совместимость с generate_page.py)
     """
     try:
-        # Получаем текст документа
-        docs = vectorstore.get(where={"file_id": request.document_id})
-        if not docs or not docs.get('documents'):
-            raise HTTPException(status_code=404, detail="Document not found")
-        
-        document_text = "\n\n".join(docs['documents'])
-        
-        # Создаем промпт для генерации теста
-        prompt = f"""
-        Сгенерируй тест на основе предоставленного документа.
-        Тип вопросов: {request.question_type}
-        Уровень сложности: {request.difficulty}
-        Количество вопросов: {request.question_count}
-        """
-        
-        # Получаем RAG цепочку с нужными параметрами для генерации теста
-        rag_chain = get_rag_chain(
-            model="smol-lm-3b",
-            question_type=request.question_type,
-            difficulty=request.difficulty,
-            question_count=request.question_count
-        )
-        
-        # Генерируем тест
-        result = rag_chain.invoke({
-            "input": prompt,
-            "chat_history": [],
-            "context": document_text
-        })
-        
-        test_content = result['answer']
+        result = generate_test_content(request)
         
         # Логируем генерацию
         insert_application_logs(
             session_id=str(uuid.uuid4()),
             user_query=f"Generate test: {request.question_type}, {request.difficulty}, {request.question_count} questions",
-            gpt_response=test_content,
-            model="smol-lm-3b"
+            gpt_response=result["test_content"],
+            model=request.model.value
         )
         
-        return {"test_content": test_content, "document_id": request.document_id}
+        return result
         
+    except LookupError:
+        raise HTTPException(status_code=404, detail="Document not found")
+    except SchedulerQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+    except BackendUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
     except Exception as e:
         logging.error(f"Error generating test: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error generating test: {str(e)}")
 
 
+@app.post("/generate-tests/batch")
+def generate_tests_batch_endpoint(request: BatchTestGenerationRequest):
+    """
+    Пакетная генерация вариантов. Ответ - NDJSON: по строке на вариант в порядке готовности,
+    поле index указывает на позицию варианта в запросе
+    """
+    specs = request.to_specs()
+    if not specs:
+        raise HTTPException(status_code=400, detail="Provide variants or document_ids")
+    if len(specs) > BATCH_MAX_VARIANTS:
+        raise HTTPException(status_code=400, detail=f"Too many variants: {len(specs)} > {BATCH_MAX_VARIANTS}")
+    # Сами варианты ждут слота без отказа, поэтому перегрузку проверяем до старта пакета
+    if any(get_backend(model).scheduler.is_full() for model in {spec.model for spec in specs}):
+        raise HTTPException(status_code=429, detail="LLM queue is full", headers={"Retry-After": "5"})
+
+    def stream():
+        for result in generate_tests_batch(specs):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
 
 @app.post("/upload-doc")
 def upload_and_index_document(
@@ -122,14 +238,14 @@ def upload_and_index_document(
         print(f"✅ Document record inserted with ID: {file_id}")
         
         print(f"🔍 Индексация документа в ChromaDB...")
-        success = index_document_to_chroma(temp_file_path, file_id)
+        success = index_document_to_chroma(temp_file_path, file_id, client_id)
 
         if success:
             logging.info(f"File {file.filename} successfully uploaded and indexed with file_id {file_id}")
             print(f"🎉 Файл успешно загружен и проиндексирован! ID: {file_id}")
             
             # Проверим, что документ действительно добавлен в ChromaDB
-            docs = vectorstore.get(where={"file_id": file_id})
+            docs = get_file_chunks(file_id, client_id, include=())
             print(f"📚 Проверка ChromaDB: найдено {len(docs['ids'])} чанков для file_id {file_id}")
             
             return {"message": f"File {file.filename} has been successfully uploaded and indexed.", "file_id": file_id}
@@ -152,29 +268,115 @@ def upload_and_index_document(
     finally:
         if os.path.exists(temp_file_path):
             os.remove(temp_file_path)
+@app.post("/replace-doc/{file_id}")
+def replace_document(file_id: int, file: UploadFile = File(...)):
+    """
+    Заменяет содержимое документа новой версией файла.
+    Пересчитываются эмбеддинги только измененных чанков, file_id и имя документа сохраняются
+    """
+    allowed_extensions = ['.pdf', '.docx', '.html']
+    file_extension = os.path.splitext(file.filename)[1].lower()
+    if file_extension not in allowed_extensions:
+        raise HTTPException(status_code=400, detail=f"Unsupported file type. Allowed types are: {', '.join(allowed_extensions)}")
+
+    record = get_document_record(file_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"Document with file_id {file_id} not found")
+
+    temp_file_path = f"temp_{uuid.uuid4().hex}{file_extension}"
+    try:
+        with open(temp_file_path, "wb") as buffer:
+            shutil.copyfileobj(file.file, buffer)
+        stats = replace_document_in_chroma(temp_file_path, file_id, record['client_id'])
+        if stats is None:
+            raise HTTPException(status_code=500, detail=f"Failed to re-index {file.filename}.")
+        touch_document_record(file_id)
+        return {"message": f"Document {record['filename']} has been updated.", "file_id": file_id, **stats}
+    finally:
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+
 @app.post("/chat", response_model=QueryResponse)
 def chat(query_input: QueryInput):
     session_id = query_input.session_id or str(uuid.uuid4())
     logging.info(f"Session ID: {session_id}, User Query: {query_input.question}, Model: {query_input.model.value}")
     
     chat_history = get_chat_history(session_id)
-    rag_chain = get_rag_chain()  # Используем одну модель без параметров
+    retriever = get_retriever(query_input.client_id, query_input.document_ids)
+    rag_chain = get_rag_chain(query_input.model, retriever)
     
+    client = query_input.client_id if query_input.client_id is not None else session_id
     try:
-        answer = rag_chain.invoke({
-            "input": query_input.question,
-            "chat_history": chat_history
-        })['answer']
+        with get_backend(query_input.model).scheduler.slot(client, Priority.INTERACTIVE):
+            answer = rag_chain.invoke({
+                "input": query_input.question,
+                "chat_history": chat_history
+            })['answer']
+    except SchedulerQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+    except BackendUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
     except Exception as e:
         logging.error(f"Ошибка при вызове RAG цепи: {e}")
         answer = "Извините, произошла ошибка при генерации ответа."
 
     insert_application_logs(session_id, query_input.question, answer, query_input.model.value)
     logging.info(f"Session ID: {session_id}, AI Response: {answer}")
-    return QueryResponse(answer=answer, session_id=session_id, model=query_input.model)
+    logging.info(f"Session ID: {session_id}, retrieval timings: {retriever.last_timings}")
+    return QueryResponse(answer=answer, session_id=session_id, model=query_input.model,
+                         retrieval_timings=retriever.last_timings or None)
+
+
+@app.post("/assistant", response_model=AssistantResponse)
+def assistant(assistant_input: AssistantInput):
+    """Чат-ассистент поддержки OneClickTest (без RAG, история хранится на клиенте)"""
+    chat_agent = get_chat_agent()
+    try:
+        with get_backend().scheduler.slot(assistant_input.client_id, Priority.INTERACTIVE):
+            response = chat_agent.invoke({
+                "input": assistant_input.message,
+                "chat_history": [message.model_dump() for message in assistant_input.chat_history]
+            })
+        answer = response.content if hasattr(response, 'content') else str(response)
+    except SchedulerQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+    except BackendUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    except Exception as e:
+        logging.error(f"Ошибка чат-ассистента: {e}")
+        answer = "Извините, чат-агент временно недоступен. Пожалуйста, попробуйте позже."
+    return AssistantResponse(answer=answer)
+
+
+@app.post("/auth/login", response_model=ClientInfo)
+def login(request: LoginRequest):
+    client = authenticate_client(request.username, request.password)
+    if not client:
+        raise HTTPException(status_code=401, detail="Invalid username or password")
+    return client
+
+@app.post("/auth/register", response_model=ClientInfo)
+def register(request: RegisterRequest):
+    try:
+        client = register_client(request.username, request.email, request.password)
+    except psycopg2.OperationalError as e:
+        logging.error(f"Registration of {request.username} failed, database unavailable: {e}")
+        raise HTTPException(status_code=503, detail="Database is temporarily unavailable", headers={"Retry-After": "5"})
+    except Exception as e:
+        logging.error(f"Registration of {request.username} failed: {e}")
+        raise HTTPException(status_code=500, detail="Failed to register user")
+    if not client:
+        raise HTTPException(status_code=409, detail=f"User {request.username} or email {request.email} already exists")
+    return client
+
+@app.get("/clients/default")
+def default_client():
+    client_id = get_default_client_id()
+    if client_id is None:
+        raise HTTPException(status_code=500, detail="Default client is not available")
+    return {"client_id": client_id}
 
 
-@app.post("/upload-test-pdf")
 @app.post("/upload-test-pdf")
 async def upload_test_pdf(
     file: UploadFile = File(...),
@@ -221,16 +423,28 @@ def download_test_pdf(file_id: int):
 
 @app.post("/delete-doc")
 def delete_document(request: DeleteFileRequest):
-    chroma_delete_success = delete_doc_from_chroma(request.file_id)
+    try:
+        result = delete_documents([request.file_id])
+    except Exception as e:
+        logging.error(f"Error deleting document {request.file_id}: {e}")
+        return {"error": f"Failed to delete document with file_id {request.file_id}: {e}"}
+    # Если Chroma сейчас недоступна, чанки удалит фоновый sweeper: документ уже не виден в списке
+    return {"message": f"Successfully deleted document with file_id {request.file_id} from the system.", **result}
 
-    if chroma_delete_success:
-        db_delete_success = delete_document_record(request.file_id)
-        if db_delete_success:
-            return {"message": f"Successfully deleted document with file_id {request.file_id} from the system."}
-        else:
-            return {"error": f"Deleted from Chroma but failed to delete document with file_id {request.file_id} from the database."}
+@app.post("/delete-docs")
+def delete_documents_endpoint(request: DeleteDocumentsRequest):
+    """
+    Массовое удаление: список file_ids или вся библиотека клиента (all_documents).
+    Записи удаляются из PostgreSQL одной транзакцией, чанки - по сохраненным id и фильтру file_id в коллекции клиента
+    """
+    if request.all_documents:
+        client_id = request.client_id if request.client_id is not None else get_default_client_id()
+        result = delete_documents(None, client_id)
+    elif request.file_ids:
+        result = delete_documents(request.file_ids, request.client_id)
     else:
-        return {"error": f"Failed to delete document with file_id {request.file_id} from Chroma."}
+        raise HTTPException(status_code=400, detail="Provide file_ids or all_documents")
+    return {"message": f"Deleted {len(result['deleted'])} documents.", **result}
 
 @app.post("/delete-test-pdf")
 def delete_test_pdf(request: DeleteFileRequest):
@@ -277,7 +491,7 @@ def check_document_uniqueness_endpoint(file: UploadFile = File(...),client_id:in
 def get_document_text(file_id: int):
     try:
         # Получаем документ из ChromaDB
-        docs = vectorstore.get(where={"file_id": file_id})
+        docs = get_file_chunks(file_id)
         if not docs or not docs.get('documents'):
             raise HTTPException(status_code=404, detail="Document not found")
         
@@ -288,4 +502,69 @@ def get_document_text(file_id: int):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/task-bank/import")
+def import_task_bank(file: UploadFile = File(...)):
+    """Массовый импорт задач из XML (формат app/tasks.xml)"""
+    try:
+        return task_bank.import_tasks_from_xml(file.file)
+    except Exception as e:
+        logging.error(f"Error importing task bank: {e}")
+        raise HTTPException(status_code=400, detail=f"Failed to import task bank: {str(e)}")
+
+@app.get("/task-bank/subjects", response_model=list[str])
+def task_bank_subjects():
+    return task_bank.get_subjects()
+
+@app.get("/task-bank/topics", response_model=list[str])
+def task_bank_topics(subject: str):
+    return task_bank.get_topics(subject)
+
+@app.get("/task-bank/count")
+def task_bank_count(subject: str = None, topic: str = None, difficulty: str = None, question_type: str = None):
+    return {"count": task_bank.count_tasks(subject, topic, difficulty, question_type)}
+
+@app.get("/task-bank/sample", response_model=list[BankTask])
+def task_bank_sample(count: int = Query(..., ge=1, le=100), subject: str = None, topic: str = None,
+                     difficulty: str = None, question_type: str = None):
+    return task_bank.sample_tasks(count, subject, topic, difficulty, question_type)
+
+
+@app.post("/exports", response_model=ExportInfo)
+def create_export(request: ExportRequest):
+    """
+    Регистрирует тест для экспорта; файлы строятся только при скачивании.
+    Структурированный тест сначала рендерится в Markdown: файлы строятся из того же текста, что и предпросмотр.
+    Если пришли и content, и test, задачи из test дописываются к Markdown отдельным разделом
+    """
+    if request.test is not None and request.content is not None:
+        content = append_questions(request.content, [question.model_dump() for question in request.test.questions])
+        return ExportInfo(export_id=export_cache.register(content), content=content)
+    if request.test is not None:
+        content = render_markdown([question.model_dump() for question in request.test.questions])
+        return ExportInfo(export_id=export_cache.register(content), content=content)
+    if request.content is None:
+        raise HTTPException(status_code=400, detail="Provide content or test")
+    return ExportInfo(export_id=export_cache.register(request.content), content=request.content)
+
+@app.get("/exports/{export_id}/{fmt}")
+def download_export(export_id: str, fmt: str):
+    if fmt not in MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported format {fmt}. Allowed: {', '.join(MEDIA_TYPES)}")
+    data = export_cache.render(export_id, fmt)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Export not found, register the content again")
+    return Response(
+        content=data,
+        media_type=MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f"attachment; filename=generated_test.{fmt}"}
+    )
 
+@app.post("/exports/{export_id}/save")
+def save_export(export_id: str, request: SaveExportRequest):
+    """Сохраняет PDF экспорта в историю тестов клиента без повторной загрузки файла из UI"""
+    pdf_content = export_cache.render(export_id, "pdf")
+    if pdf_content is None:
+        raise HTTPException(status_code=404, detail="Export not found, register the content again")
+    client_id = request.client_id if request.client_id is not None else get_default_client_id()
+    file_id = insert_test_pdf_record(request.filename, request.document_id or None, request.session_id, pdf_content, client_id)
+    return {"file_id": file_id, "filename": request.filename}
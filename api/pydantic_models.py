@@ -2,10 +2,12 @@
 from pydantic import BaseModel, Field
 from enum import Enum
 from datetime import datetime
-from typing import Optional
+from typing import Dict, List, Optional
 
 class ModelName(str, Enum):
-    VIKHR = "lakomoor/vikhr-llama-3.2-1b-instruct:1b"
+    VIKHR = "lakomoor/vikhr-llama-3.2-1b-instruct:1b"  # Ollama
+    SMOL_LM_3B = "smol-lm-3b"  # Hugging Face Inference
+    LOCAL_CPU = "local-cpu"  # модель в процессе API (LOCAL_LLM_MODEL)
 
 class QuestionType(str, Enum):
     MULTIPLE_CHOICE = "multiple_choice"
@@ -21,11 +23,14 @@ class QueryInput(BaseModel):
     question: str
     session_id: Optional[str] = Field(default=None)
     model: ModelName = Field(default=ModelName.VIKHR)  # По умолчанию Vikhr
+    client_id: Optional[int] = None
+    document_ids: Optional[List[int]] = None  # искать контекст только в этих документах; в UI нет RAG-чата, поле только для клиентов API
 
 class QueryResponse(BaseModel):
     answer: str
     session_id: str
     model: ModelName
+    retrieval_timings: Optional[Dict[str, float]] = None  # мс по стадиям поиска контекста
 
 class DocumentInfo(BaseModel):
     id: int
@@ -45,6 +50,11 @@ class TestPDFInfo(BaseModel):
 class DeleteFileRequest(BaseModel):
     file_id: int
 
+class DeleteDocumentsRequest(BaseModel):
+    file_ids: List[int] = []
+    client_id: Optional[int] = None  # с file_ids - удаляются только документы этого клиента
+    all_documents: bool = False  # вся библиотека клиента
+
 class TestGenerationRequest(BaseModel):
     document_id: int
     question_count: int
@@ -54,4 +64,120 @@ class TestGenerationRequest(BaseModel):
     xml_subject: Optional[str] = None
     xml_topic: Optional[str] = None
     xml_task_count: int = 0
-    model: ModelName = Field(default=ModelName.VIKHR)  # По умолчанию Vikhr
\ No newline at end of file
+    model: ModelName = Field(default=ModelName.VIKHR)  # По умолчанию Vikhr
+    client_id: Optional[int] = None
+    structured: bool = True  # JSON-режим: вопросы, варианты и ключ ответов отдельными полями
+
+class ChatMessage(BaseModel):
+    role: str  # "human" или "ai"
+    content: str
+
+class AssistantInput(BaseModel):
+    message: str
+    chat_history: List[ChatMessage] = Field(default_factory=list)
+    client_id: Optional[int] = None
+
+class AssistantResponse(BaseModel):
+    answer: str
+
+class LoginRequest(BaseModel):
+    username: str
+    password: str
+
+class RegisterRequest(BaseModel):
+    username: str
+    email: str
+    password: str
+
+class ClientInfo(BaseModel):
+    id: int
+    username: str
+    email: Optional[str] = None
+
+class BankTask(BaseModel):
+    id: int
+    subject: str
+    topic: str
+    difficulty: DifficultyLevel
+    question_type: QuestionType
+    question: str
+    answer: str
+
+class TestQuestion(BaseModel):
+    question: str
+    options: List[str] = Field(default_factory=list)  # пусто для открытых вопросов
+    answer: str = ""  # буква варианта или текст ответа
+    source: str = "document"  # "document" - сгенерирован по документу, "bank" - из банка задач
+
+class GeneratedTest(BaseModel):
+    questions: List[TestQuestion] = Field(default_factory=list)
+
+class ExportRequest(BaseModel):
+    # Готовый Markdown, структурированный тест или Markdown с задачами из банка в test
+    content: Optional[str] = None
+    test: Optional[GeneratedTest] = None
+
+class ExportInfo(BaseModel):
+    export_id: str
+    content: str
+
+class SaveExportRequest(BaseModel):
+    filename: str = "generated_test.pdf"
+    document_id: Optional[int] = None
+    session_id: str = "default_session"
+    client_id: Optional[int] = None
+
+class BatchTestGenerationRequest(BaseModel):
+    # Явные спецификации вариантов и/или одинаковые параметры для списка документов
+    variants: List[TestGenerationRequest] = Field(default_factory=list)
+    document_ids: List[int] = Field(default_factory=list)
+    variants_per_document: int = Field(default=1, ge=1)
+    question_count: int = 5
+    difficulty: str = DifficultyLevel.MIDDLE.value
+    question_type: str = QuestionType.MULTIPLE_CHOICE.value
+    include_xml_tasks: bool = False
+    xml_subject: Optional[str] = None
+    xml_topic: Optional[str] = None
+    xml_task_count: int = 0
+    client_id: Optional[int] = None
+    structured: bool = True
+
+    def to_specs(self) -> List[TestGenerationRequest]:
+        # Все варианты пакета считаются запросами одного клиента для честной очереди
+        specs = [
+            spec if spec.client_id is not None else spec.model_copy(update={"client_id": self.client_id})
+            for spec in self.variants
+        ]
+        for document_id in self.document_ids:
+            for _ in range(self.variants_per_document):
+                specs.append(TestGenerationRequest(
+                    document_id=document_id,
+                    question_count=self.question_count,
+                    difficulty=self.difficulty,
+                    question_type=self.question_type,
+                    include_xml_tasks=self.include_xml_tasks,
+                    xml_subject=self.xml_subject,
+                    xml_topic=self.xml_topic,
+                    xml_task_count=self.xml_task_count,
+                    client_id=self.client_id,
+                    structured=self.structured
+                ))
+        return specs
+
+
+class ReembedRequest(BaseModel):
+    embedding: str
+    client_id: Optional[int] = None  # выделенный клиент; без него перестраивается общая коллекция
+
+
+class CompactRequest(BaseModel):
+    client_id: Optional[int] = None
+    force: bool = False  # пересобрать, даже если доля удаленных ниже CHROMA_COMPACT_RATIO
+
+
+class HnswRebuildRequest(BaseModel):
+    client_id: Optional[int] = None
+    # Не заданные параметры подбираются по размеру коллекции
+    m: Optional[int] = Field(None, ge=4, le=128)
+    ef_construction: Optional[int] = Field(None, ge=10, le=2000)
+    ef_search: Optional[int] = Field(None, ge=10, le=2000)
@@ -0,0 +1,188 @@
+# quiz_generation.py - генерация тестов по документу: одиночная и пакетная
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Optional
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from chroma_utils import get_file_chunks
+from llm_backends import BACKENDS, get_backend
+from llm_scheduler import Priority
+from pydantic_models import ModelName, TestGenerationRequest
+import task_bank
+from quiz_schema import (
+    QuestionStream, append_questions, bank_questions, format_instructions, is_multiple_choice, parse_questions,
+    render_markdown, token_budget
+)
+
+BATCH_MAX_VARIANTS = int(os.getenv("BATCH_MAX_VARIANTS", "100"))
+
+# Реальную параллельность ограничивают планировщики бэкендов; пул не должен быть меньше самого широкого из них
+_batch_executor = ThreadPoolExecutor(
+    max_workers=max(backend.scheduler.max_in_flight for backend in BACKENDS.values()),
+    thread_name_prefix="test-batch"
+)
+
+
+def get_document_text(document_id: int) -> Optional[str]:
+    docs = get_file_chunks(document_id)
+    if not docs or not docs.get('documents'):
+        return None
+    return "\n\n".join(docs['documents'])
+
+
+def build_context_messages(document_text: str) -> List[Any]:
+    """
+    Общий префикс для всех вариантов по одному документу.
+    Он должен совпадать побайтно, тогда Ollama переиспользует KV-кэш промпта
+    и не пересчитывает документ для каждого варианта.
+    """
+    return [
+        SystemMessage(content="Ты профессиональный генератор тестов. Создавай вопросы строго на основе предоставленного контекста."),
+        SystemMessage(content=f"Контекст: {document_text}"),
+    ]
+
+
+def build_variant_message(request: TestGenerationRequest, variant: Optional[int] = None) -> HumanMessage:
+    """Часть промпта, которая отличается между вариантами, всегда идет после общего префикса"""
+    prompt = (
+        "Сгенерируй тест на основе предоставленного документа.\n"
+        f"Тип вопросов: {request.question_type}\n"
+        f"Уровень сложности: {request.difficulty}\n"
+        f"Количество вопросов: {request.question_count}"
+    )
+    if variant is not None:
+        prompt += f"\nВариант №{variant}. Вопросы должны отличаться от других вариантов."
+    if request.structured:
+        prompt += "\n" + format_instructions(request.question_type, request.question_count)
+    return HumanMessage(content=prompt)
+
+
+def _generate_structured(backend, messages: List[Any], request: TestGenerationRequest,
+                         temperature: float) -> List[Dict[str, Any]]:
+    """
+    Потоковая генерация в JSON-режиме: поток закрывается, как только готовы question_count вопросов,
+    и Ollama прекращает генерацию вместо того, чтобы дописывать до num_predict
+    """
+    llm = backend.chat_model(temperature=temperature, num_predict=token_budget(request.question_count), json_mode=True)
+    stream = QuestionStream(is_multiple_choice(request.question_type))
+    chunks = llm.stream(messages)
+    try:
+        for chunk in chunks:
+            if stream.feed(chunk.content) >= request.question_count:
+                break
+    finally:
+        chunks.close()
+    if stream.questions:
+        return stream.questions[:request.question_count]
+    return parse_questions(stream.text, stream.multiple_choice)[:request.question_count]
+
+
+def generate_test_content(request: TestGenerationRequest, document_text: Optional[str] = None,
+                          variant: Optional[int] = None, reject_when_full: bool = True) -> Dict[str, Any]:
+    """
+    Генерирует один тест; бросает LookupError, если документа нет в Chroma,
+    и SchedulerQueueFull, если очередь к модели переполнена
+    """
+    if document_text is None:
+        document_text = get_document_text(request.document_id)
+        if document_text is None:
+            raise LookupError(f"Document {request.document_id} not found")
+
+    messages = build_context_messages(document_text) + [build_variant_message(request, variant)]
+    backend = get_backend(request.model)
+    # Вариантам нужна разная формулировка вопросов, поэтому температура выше
+    temperature = 0.3 if variant is None else 0.7
+    questions = None
+    with backend.scheduler.slot(request.client_id, Priority.BATCH, reject_when_full=reject_when_full):
+        if request.structured:
+            questions = _generate_structured(backend, messages, request, temperature)
+            if not questions:
+                logging.warning(f"Structured generation for document {request.document_id} returned no questions")
+        if not questions:
+            # Запасной путь - прежний свободный Markdown, без требований к JSON в промпте
+            plain_request = request.model_copy(update={"structured": False})
+            messages = messages[:-1] + [build_variant_message(plain_request, variant)]
+            test_content = backend.chat_model(temperature=temperature).invoke(messages).content
+
+    # Задачи из банка подмешиваются на сервере, без отдельного запроса из UI
+    bank_tasks = []
+    if request.include_xml_tasks and request.xml_task_count > 0:
+        bank_tasks = task_bank.sample_tasks(
+            request.xml_task_count,
+            subject=request.xml_subject,
+            topic=request.xml_topic,
+            difficulty=request.difficulty,
+            question_type=request.question_type
+        )
+
+    if questions:
+        # Markdown строится из структуры; банк задач - те же вопросы с source="bank"
+        questions += bank_questions(bank_tasks)
+        test_content = render_markdown(questions)
+    elif bank_tasks:
+        # Тот же раздел, что и в /exports: предпросмотр и файл совпадают
+        test_content = append_questions(test_content, bank_questions(bank_tasks))
+
+    return {
+        "test_content": test_content,
+        "test": {"questions": questions} if questions else None,
+        "document_id": request.document_id,
+        "bank_tasks": bank_tasks
+    }
+
+
+def _prefill(document_text: str, model: ModelName = ModelName.VIKHR, client_id: Optional[int] = None) -> None:
+    """Прогоняет общий префикс через модель, чтобы варианты начинали с готового KV-кэша"""
+    backend = get_backend(model)
+    if not backend.supports_prefix_cache:
+        return
+    try:
+        with backend.scheduler.slot(client_id, Priority.BATCH, reject_when_full=False):
+            backend.chat_model(num_predict=1).invoke(build_context_messages(document_text) + [HumanMessage(content="Готов?")])
+    except Exception as e:
+        logging.warning(f"Context prefill failed: {e}")
+
+
+def generate_tests_batch(specs: List[TestGenerationRequest]) -> Iterator[Dict[str, Any]]:
+    """
+    Генерирует варианты на пуле потоков и отдает результаты по мере готовности.
+    Варианты группируются по документу: текст читается из Chroma один раз,
+    общий префикс прогревается до запуска вариантов этого документа.
+    """
+    if len(specs) > BATCH_MAX_VARIANTS:
+        raise ValueError(f"Too many variants: {len(specs)} > {BATCH_MAX_VARIANTS}")
+
+    groups: Dict[int, List[int]] = {}
+    for index, spec in enumerate(specs):
+        groups.setdefault(spec.document_id, []).append(index)
+
+    futures = {}
+    for document_id, indexes in groups.items():
+        document_text = get_document_text(document_id)
+        if document_text is None:
+            for index in indexes:
+                yield {"index": index, "document_id": document_id, "error": "Document not found"}
+            continue
+        if len(indexes) > 1:
+            _prefill(document_text, specs[indexes[0]].model, specs[indexes[0]].client_id)
+        for variant, index in enumerate(indexes, 1):
+            started = time.perf_counter()
+            # Число ожидающих вариантов ограничено размером пула, поэтому они не отбрасываются по лимиту очереди
+            future = _batch_executor.submit(
+                generate_test_content, specs[index], document_text, variant if len(indexes) > 1 else None, False
+            )
+            futures[future] = (index, document_id, variant, started)
+
+    for future in as_completed(futures):
+        index, document_id, variant, started = futures[future]
+        result: Dict[str, Any] = {"index": index, "document_id": document_id, "variant": variant}
+        try:
+            result.update(future.result())
+        except Exception as e:
+            logging.error(f"Batch variant {index} failed: {e}")
+            result["error"] = str(e)
+        result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        yield result
@@ -0,0 +1,170 @@
+# quiz_schema.py - структурированный тест: JSON-схема для модели, потоковый разбор и рендер
+import os
+import re
+import json
+from typing import Any, Dict, List, Optional
+
+from pydantic_models import QuestionType
+from task_vocabulary import normalize_question_type
+
+# Бюджет токенов на один вопрос с вариантами и ответом; общий лимит - не больше прежних 2000
+TOKENS_PER_QUESTION = int(os.getenv("TOKENS_PER_QUESTION", "160"))
+STRUCTURED_MAX_TOKENS = int(os.getenv("STRUCTURED_MAX_TOKENS", "2000"))
+
+OPTION_LETTERS = "ABCDEFGH"
+_OPTION_PREFIX_RE = re.compile(r"^\s*(?:[A-HА-Е]|\d)\s*[).:]\s+")
+
+
+def token_budget(question_count: int) -> int:
+    """num_predict под нужное число вопросов, чтобы модель не писала лишнего"""
+    return min(STRUCTURED_MAX_TOKENS, 40 + question_count * TOKENS_PER_QUESTION)
+
+
+def is_multiple_choice(question_type: str) -> bool:
+    return normalize_question_type(question_type) != QuestionType.OPEN_ENDED.value
+
+
+def format_instructions(question_type: str, question_count: int) -> str:
+    """Описание JSON-ответа для промпта; сам JSON-режим включается у бэкенда"""
+    if is_multiple_choice(question_type):
+        item = '{"question": "текст вопроса", "options": ["вариант 1", "вариант 2", "вариант 3", "вариант 4"], "answer": "A"}'
+        rules = "У каждого вопроса ровно 4 варианта, правильный один; answer - буква правильного варианта (A, B, C или D)."
+    else:
+        item = '{"question": "текст вопроса", "answer": "краткий правильный ответ"}'
+        rules = "Вопросы открытые, без вариантов; answer - краткий правильный ответ."
+    return (
+        f"Ответь только JSON вида {{\"questions\": [{item}, ...]}} без пояснений.\n"
+        f"Количество вопросов: ровно {question_count}. {rules}\n"
+        "Все вопросы на русском языке и строго по тексту документа."
+    )
+
+
+def normalize_question(raw: Any, multiple_choice: bool) -> Optional[Dict[str, Any]]:
+    """Приводит объект от модели к виду {question, options, answer}; None, если вопрос пустой"""
+    if not isinstance(raw, dict):
+        return None
+    question = str(raw.get("question") or "").strip()
+    if not question:
+        return None
+    options = raw.get("options") or []
+    if not multiple_choice or not isinstance(options, list):
+        options = []
+    options = [str(option).strip() for option in options if str(option).strip()]
+    # Префиксы "A) " убираются, только если они есть у всех вариантов, иначе можно срезать инициал
+    if options and all(_OPTION_PREFIX_RE.match(option) for option in options):
+        options = [_OPTION_PREFIX_RE.sub("", option) for option in options]
+    answer = str(raw.get("answer") or "").strip()
+    if options:
+        letters = OPTION_LETTERS[:len(options)]
+        # Модель иногда пишет текст правильного варианта или "B)" вместо буквы
+        if answer[:1].upper() in letters and (len(answer) == 1 or not answer[1].isalnum()):
+            answer = answer[0].upper()
+        elif answer in options:
+            answer = letters[options.index(answer)]
+    return {"question": question, "options": options, "answer": answer, "source": "document"}
+
+
+class QuestionStream:
+    """
+    Инкрементальный разбор потока {"questions": [{...}, {...}, ...]}:
+    отслеживает строки и вложенность скобок и отдает каждый вопрос, как только закрылся его объект.
+    Позволяет остановить генерацию сразу после question_count вопросов.
+    """
+
+    def __init__(self, multiple_choice: bool = True):
+        self.multiple_choice = multiple_choice
+        self.questions: List[Dict[str, Any]] = []
+        self._text: List[str] = []
+        self._position = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._item_start = None
+
+    def feed(self, chunk: str) -> int:
+        """Добавляет кусок ответа модели; возвращает число разобранных вопросов"""
+        self._text.append(chunk)
+        for char in chunk:
+            index = self._position
+            self._position += 1
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+                # Корневой объект - 1, массив questions - 2, вопрос - 3
+                if char == "{" and self._depth == 3:
+                    self._item_start = index
+            elif char in "}]":
+                if char == "}" and self._depth == 3 and self._item_start is not None:
+                    self._add("".join(self._text)[self._item_start:index + 1])
+                    self._item_start = None
+                self._depth -= 1
+        return len(self.questions)
+
+    def _add(self, item_text: str) -> None:
+        try:
+            question = normalize_question(json.loads(item_text), self.multiple_choice)
+        except ValueError:
+            return
+        if question:
+            self.questions.append(question)
+
+    @property
+    def text(self) -> str:
+        return "".join(self._text)
+
+
+def parse_questions(text: str, multiple_choice: bool = True) -> List[Dict[str, Any]]:
+    """Разбор полного ответа; если JSON оборван или с мусором, берутся целые вопросы"""
+    try:
+        data = json.loads(text)
+        raw_questions = data.get("questions", []) if isinstance(data, dict) else data
+        if isinstance(raw_questions, list):
+            questions = [normalize_question(raw, multiple_choice) for raw in raw_questions]
+            return [question for question in questions if question]
+    except ValueError:
+        pass
+    stream = QuestionStream(multiple_choice)
+    start = text.find("{")
+    stream.feed(text[start:] if start >= 0 else "")
+    return stream.questions
+
+
+def bank_questions(tasks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Задачи из банка в том же формате, что и сгенерированные вопросы"""
+    return [
+        {"question": task["question"], "options": [], "answer": task["answer"], "source": "bank"}
+        for task in tasks
+    ]
+
+
+def render_markdown(questions: List[Dict[str, Any]]) -> str:
+    """Markdown теста: вопросы документа, затем задачи из банка, в конце ключ ответов"""
+    lines: List[str] = []
+    answers: List[str] = []
+    bank_header_added = False
+    for number, question in enumerate(questions, 1):
+        if question.get("source") == "bank" and not bank_header_added:
+            lines += ["ЗАДАЧИ ИЗ БАЗЫ:", ""]
+            bank_header_added = True
+        lines.append(f"{number}. {question['question']}")
+        lines += [f"{OPTION_LETTERS[i]}) {option}" for i, option in enumerate(question.get("options") or [])]
+        lines.append("")
+        answers.append(f"{number}. {question.get('answer', '')}")
+    if answers:
+        lines += ["ОТВЕТЫ:"] + answers
+    return "\n".join(lines).strip()
+
+
+def append_questions(content: str, questions: List[Dict[str, Any]]) -> str:
+    """Markdown-ответ модели и задачи из банка отдельным разделом со своей нумерацией и ключом ответов"""
+    section = render_markdown(questions)
+    return f"{content.rstrip()}\n\n{section}" if section else content
@@ -0,0 +1,89 @@
+# readiness.py - прогрев компонентов при старте и состояние готовности для /readyz
+import os
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+# Пауза перед повторным прогревом компонента, который не поднялся (например, Ollama еще не запущена)
+READINESS_RETRY_SECONDS = float(os.getenv("READINESS_RETRY_SECONDS", "10"))
+
+
+class ComponentStatus:
+    """Результат прогрева одного компонента"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.ready = False
+        self.attempts = 0
+        self.duration_ms: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "attempts": self.attempts,
+            "duration_ms": None if self.duration_ms is None else round(self.duration_ms, 1),
+            "error": self.error,
+        }
+
+
+class ReadinessRegistry:
+    """Набор компонентов, каждый прогревается в своем потоке до первого успеха"""
+
+    def __init__(self, retry_seconds: float = READINESS_RETRY_SECONDS):
+        self.retry_seconds = retry_seconds
+        self._warm_ups: Dict[str, Callable[[], None]] = {}
+        self._status: Dict[str, ComponentStatus] = {}
+        self._lock = threading.Lock()
+        self._started = False
+
+    def register(self, name: str, warm_up: Callable[[], None]) -> None:
+        """warm_up бросает исключение, если компонент не готов"""
+        self._warm_ups[name] = warm_up
+        self._status[name] = ComponentStatus(name)
+
+    def warm_up(self, name: str) -> bool:
+        status = self._status[name]
+        started = time.perf_counter()
+        try:
+            self._warm_ups[name]()
+            ok, error = True, None
+        except Exception as e:
+            ok, error = False, str(e)
+        with self._lock:
+            status.attempts += 1
+            status.duration_ms = (time.perf_counter() - started) * 1000
+            status.ready = ok
+            status.error = error
+        if ok:
+            logging.info(f"Component {name} ready in {status.duration_ms:.1f} ms")
+        else:
+            logging.warning(f"Component {name} warm-up failed: {error}")
+        return ok
+
+    def _warm_up_until_ready(self, name: str) -> None:
+        while not self.warm_up(name):
+            time.sleep(self.retry_seconds)
+
+    def start(self) -> None:
+        """Запускает прогрев всех компонентов в фоне, не блокируя старт сервера"""
+        if self._started:
+            return
+        self._started = True
+        for name in self._warm_ups:
+            threading.Thread(
+                target=self._warm_up_until_ready, args=(name,), name=f"warm-up-{name}", daemon=True
+            ).start()
+
+    def is_ready(self) -> bool:
+        with self._lock:
+            return all(status.ready for status in self._status.values())
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            components = {name: status.to_dict() for name, status in self._status.items()}
+        return {"ready": all(c["ready"] for c in components.values()), "components": components}
+
+
+readiness = ReadinessRegistry()
@@ -0,0 +1,119 @@
+# reranker.py - второй этап поиска: переранжирование кандидатов кросс-энкодером на CPU с кэшем
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Sequence
+
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "true").lower() in ("1", "true", "yes")
+# Многоязычный кросс-энкодер (обучен на mMARCO, русский поддерживается)
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "30"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+# Если первый векторный кандидат ближе второго на столько (по расстоянию Chroma), порядок считается очевидным
+RERANK_SKIP_MARGIN = float(os.getenv("RERANK_SKIP_MARGIN", "0.15"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "1024"))
+# После неудачной загрузки модели запросы идут без переранжирования столько секунд, потом загрузка повторяется
+RERANK_RETRY_SECONDS = float(os.getenv("RERANK_RETRY_SECONDS", "60"))
+
+
+def is_decisive(distances: Sequence[float], margin: float = RERANK_SKIP_MARGIN) -> bool:
+    """
+    Отрыв лучшего векторного кандидата от второго достаточен, чтобы не тратить время на кросс-энкодер.
+    Меньше двух векторных кандидатов - не повод пропускать переранжирование: остальных кандидатов дал BM25
+    """
+    return len(distances) >= 2 and distances[1] - distances[0] >= margin
+
+
+class CrossEncoderReranker:
+    """
+    Кросс-энкодер загружается при первом использовании. Ошибка загрузки (например, сеть при скачивании)
+    отключает этап только на RERANK_RETRY_SECONDS, затем загрузка повторяется
+    """
+
+    def __init__(self, model_name: str = RERANK_MODEL, batch_size: int = RERANK_BATCH_SIZE,
+                 retry_seconds: float = RERANK_RETRY_SECONDS):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.retry_seconds = retry_seconds
+        self._model = None
+        self._failed_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def _backing_off(self) -> bool:
+        return self._failed_at is not None and time.monotonic() - self._failed_at < self.retry_seconds
+
+    @property
+    def available(self) -> bool:
+        return RERANK_ENABLED and (self._model is not None or not self._backing_off())
+
+    def _get_model(self, force: bool = False):
+        if self._model is None and (force or not self._backing_off()):
+            with self._lock:
+                if self._model is None and (force or not self._backing_off()):
+                    try:
+                        from sentence_transformers import CrossEncoder
+                        self._model = CrossEncoder(self.model_name, device="cpu")
+                        self._failed_at, self.last_error = None, None
+                        logging.info(f"Reranker loaded: {self.model_name}")
+                    except Exception as e:
+                        logging.error(f"Failed to load reranker {self.model_name}, retry in {self.retry_seconds}s: {e}")
+                        self._failed_at, self.last_error = time.monotonic(), str(e)
+        return self._model
+
+    def warm_up(self) -> None:
+        """Для readiness: бросает исключение, пока модель не загружена, чтобы прогрев повторялся"""
+        if self._get_model(force=True) is None:
+            raise RuntimeError(f"Reranker {self.model_name} is not loaded: {self.last_error}")
+
+    def status(self) -> Dict[str, Any]:
+        return {"enabled": RERANK_ENABLED, "available": self.available, "loaded": self._model is not None,
+                "error": self.last_error}
+
+    def rerank(self, query: str, texts: List[str]) -> Optional[List[int]]:
+        """Индексы texts по убыванию релевантности; None, если модель недоступна"""
+        model = self._get_model()
+        if model is None or not texts:
+            return None
+        scores = model.predict([(query, text) for text in texts], batch_size=self.batch_size, show_progress_bar=False)
+        return sorted(range(len(texts)), key=lambda i: float(scores[i]), reverse=True)
+
+
+class RerankCache:
+    """LRU: (клиент, хэш запроса, документы, версия корпуса) -> упорядоченные id чанков"""
+
+    def __init__(self, max_entries: int = RERANK_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, List[str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(client_id: Any, query: str, file_ids: Optional[Sequence[int]], corpus_version: int, k: int) -> Hashable:
+        query_hash = hashlib.sha256(query.strip().lower().encode("utf-8")).hexdigest()
+        return client_id, query_hash, tuple(sorted(file_ids)) if file_ids else None, corpus_version, k
+
+    def get(self, key: Hashable) -> Optional[List[str]]:
+        with self._lock:
+            chunk_ids = self._entries.get(key)
+            if chunk_ids is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return chunk_ids
+
+    def set(self, key: Hashable, chunk_ids: List[str]) -> None:
+        with self._lock:
+            self._entries[key] = chunk_ids
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+reranker = CrossEncoderReranker()
+rerank_cache = RerankCache()
@@ -0,0 +1,141 @@
+# retrieval.py - гибридный поиск контекста: BM25 + векторный поиск Chroma, слияние через RRF
+import os
+import time
+import logging
+from typing import Any, Dict, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from bm25_index import bm25_registry
+from chroma_utils import get_vectorstore
+from reranker import RERANK_CANDIDATES, is_decisive, rerank_cache, reranker
+
+# С кросс-энкодером первый этап может быть дешевым и широким
+RETRIEVAL_DENSE_K = int(os.getenv("RETRIEVAL_DENSE_K", str(RERANK_CANDIDATES)))
+RETRIEVAL_SPARSE_K = int(os.getenv("RETRIEVAL_SPARSE_K", str(RERANK_CANDIDATES)))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "4"))
+# Константа RRF: чем больше, тем меньше перевес первых позиций каждого списка
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], rrf_k: int = RRF_K) -> List[str]:
+    """Слияние ранжированных списков id: score = сумма 1 / (rrf_k + позиция)"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, 1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def _resolve_client(client_id: Optional[int]) -> Optional[int]:
+    if client_id is not None:
+        return client_id
+    from db_utils import get_default_client_id
+    return get_default_client_id()
+
+
+def chunk_filter(client_id: Optional[int], file_ids: Optional[List[int]] = None) -> Dict[str, Any]:
+    """Фильтр метаданных Chroma: чанки клиента, при необходимости - только указанных документов"""
+    if not file_ids:
+        return {"client_id": client_id}
+    return {"$and": [{"client_id": client_id}, {"file_id": {"$in": list(file_ids)}}]}
+
+
+def hybrid_search(query: str, client_id: Optional[int] = None, k: int = RETRIEVAL_TOP_K,
+                  dense_k: int = RETRIEVAL_DENSE_K, sparse_k: int = RETRIEVAL_SPARSE_K,
+                  file_ids: Optional[List[int]] = None) -> Dict[str, Any]:
+    """
+    Возвращает {"documents": [...], "timings": {стадия: мс}} для документов клиента.
+    file_ids сужает поиск до выбранных документов
+    """
+    timings: Dict[str, float] = {}
+    started = time.perf_counter()
+
+    client_id = _resolve_client(client_id)
+    index = bm25_registry.get(client_id)
+    timings["index_ms"] = (time.perf_counter() - started) * 1000
+    if not len(index):
+        return {"documents": [], "timings": timings}
+
+    # Тексты всех чанков клиента есть в BM25-индексе, поэтому попадание в кэш обходится без Chroma
+    cache_key = rerank_cache.key(client_id, query, file_ids, index.version, k)
+    cached = rerank_cache.get(cache_key)
+    if cached is not None:
+        documents = [Document(page_content=stored[0], metadata=stored[1])
+                     for stored in map(index.get, cached) if stored is not None]
+        timings["total_ms"] = (time.perf_counter() - started) * 1000
+        timings = {stage_name: round(value, 2) for stage_name, value in timings.items()}
+        logging.info(f"Hybrid retrieval for client {client_id}: cache hit, {timings}")
+        return {"documents": documents, "timings": timings, "cached": True}
+
+    stage = time.perf_counter()
+    sparse = index.search(query, k=sparse_k, file_ids=set(file_ids) if file_ids else None)
+    timings["bm25_ms"] = (time.perf_counter() - stage) * 1000
+
+    stage = time.perf_counter()
+    vectorstore = get_vectorstore(client_id)
+    query_embedding = vectorstore.embeddings.embed_query(query)
+    timings["embed_ms"] = (time.perf_counter() - stage) * 1000
+
+    stage = time.perf_counter()
+    dense = vectorstore._collection.query(
+        query_embeddings=[query_embedding],
+        n_results=dense_k,
+        # Фильтр по метаданным применяется до ранжирования: чужие чанки не сканируются и не попадают в выдачу
+        where=chunk_filter(client_id, file_ids),
+        include=["documents", "metadatas", "distances"]
+    )
+    timings["dense_ms"] = (time.perf_counter() - stage) * 1000
+
+    stage = time.perf_counter()
+    chunks: Dict[str, Document] = {}
+    dense_ids = dense["ids"][0]
+    for chunk_id, text, metadata in zip(dense_ids, dense["documents"][0], dense["metadatas"][0]):
+        chunks[chunk_id] = Document(page_content=text, metadata=metadata or {})
+    for chunk_id, _ in sparse:
+        if chunk_id not in chunks:
+            stored = index.get(chunk_id)
+            if stored is not None:
+                chunks[chunk_id] = Document(page_content=stored[0], metadata=stored[1])
+    fused = reciprocal_rank_fusion([dense_ids, [chunk_id for chunk_id, _ in sparse]])
+    candidates = [chunk_id for chunk_id in fused if chunk_id in chunks][:RERANK_CANDIDATES]
+    timings["fusion_ms"] = (time.perf_counter() - stage) * 1000
+
+    reranked = False
+    if len(candidates) > k and reranker.available and not is_decisive(dense["distances"][0]):
+        stage = time.perf_counter()
+        order = reranker.rerank(query, [chunks[chunk_id].page_content for chunk_id in candidates])
+        if order is not None:
+            candidates = [candidates[i] for i in order]
+            reranked = True
+        timings["rerank_ms"] = (time.perf_counter() - stage) * 1000
+
+    selected = candidates[:k]
+    rerank_cache.set(cache_key, selected)
+    documents = [chunks[chunk_id] for chunk_id in selected]
+    timings["total_ms"] = (time.perf_counter() - started) * 1000
+
+    timings = {stage_name: round(value, 2) for stage_name, value in timings.items()}
+    logging.info(
+        f"Hybrid retrieval for client {client_id}: {len(sparse)} bm25 + {len(dense_ids)} dense -> "
+        f"{len(candidates)} candidates, reranked={reranked}, {timings}"
+    )
+    return {"documents": documents, "timings": timings, "reranked": reranked}
+
+
+class HybridRetriever(BaseRetriever):
+    """Ретривер LangChain для RAG-цепочки; создается на запрос, last_timings - разбивка времени по стадиям"""
+    client_id: Optional[int] = None
+    file_ids: Optional[List[int]] = None
+    k: int = RETRIEVAL_TOP_K
+    dense_k: int = RETRIEVAL_DENSE_K
+    sparse_k: int = RETRIEVAL_SPARSE_K
+    last_timings: Dict[str, float] = {}
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        result = hybrid_search(query, self.client_id, k=self.k, dense_k=self.dense_k, sparse_k=self.sparse_k,
+                               file_ids=self.file_ids)
+        self.last_timings = result["timings"]
+        return result["documents"]
@@ -0,0 +1,174 @@
+# task_bank.py - банк задач в PostgreSQL: импорт XML, подсчет и случайная выборка
+import random
+import logging
+import xml.etree.ElementTree as ET
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from psycopg2.extras import execute_values
+
+from db_utils import get_db_connection
+from task_vocabulary import normalize_difficulty, normalize_question_type
+
+IMPORT_BATCH_SIZE = 1000
+
+
+def _child_text(elem: ET.Element, tag: str) -> str:
+    child = elem.find(tag)
+    return child.text.strip() if child is not None and child.text else ""
+
+
+def iter_xml_tasks(source: BinaryIO) -> Iterator[Tuple[str, str, str, str, str, str]]:
+    """Потоково читает XML банка задач: (subject, topic, difficulty, type, question, answer)"""
+    subject_name = None
+    topic_name = None
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            if elem.tag == "subject":
+                subject_name = elem.get("name")
+            elif elem.tag == "topic":
+                topic_name = elem.get("name")
+            continue
+        if elem.tag == "task":
+            if subject_name and topic_name:
+                yield (
+                    subject_name, topic_name,
+                    _child_text(elem, "difficulty"), _child_text(elem, "type"),
+                    _child_text(elem, "question"), _child_text(elem, "answer")
+                )
+            elem.clear()
+        elif elem.tag in ("topic", "subject"):
+            elem.clear()
+
+
+def import_tasks_from_xml(source: BinaryIO) -> Dict[str, int]:
+    """Загружает задачи из XML пачками; дубли и задачи с нераспознанной сложностью/типом пропускаются"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        imported = skipped = 0
+
+        def flush(batch):
+            rows = execute_values(
+                cursor,
+                '''INSERT INTO task_bank
+                   (subject, topic, difficulty, question_type, question, answer, source_difficulty, source_type)
+                   VALUES %s
+                   ON CONFLICT (subject, topic, md5(question)) DO NOTHING
+                   RETURNING id''',
+                batch,
+                fetch=True
+            )
+            return len(rows)
+
+        try:
+            batch = []
+            for subject, topic, difficulty, task_type, question, answer in iter_xml_tasks(source):
+                level = normalize_difficulty(difficulty)
+                qtype = normalize_question_type(task_type)
+                if not (question and answer and level and qtype):
+                    logging.warning(f"Skipping task {subject}/{topic}: {question[:50]!r} ({difficulty}, {task_type})")
+                    skipped += 1
+                    continue
+                batch.append((subject, topic, level, qtype, question, answer, difficulty, task_type))
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    inserted = flush(batch)
+                    imported += inserted
+                    skipped += len(batch) - inserted
+                    batch = []
+            if batch:
+                inserted = flush(batch)
+                imported += inserted
+                skipped += len(batch) - inserted
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    print(f"📥 Импорт банка задач: добавлено {imported}, пропущено {skipped}")
+    return {"imported": imported, "skipped": skipped}
+
+
+def _filters(subject: Optional[str], topic: Optional[str], difficulty: Optional[str],
+             question_type: Optional[str]) -> Tuple[str, list]:
+    level = normalize_difficulty(difficulty)
+    qtype = normalize_question_type(question_type)
+    if (difficulty and level is None) or (question_type and qtype is None):
+        # Нераспознанное значение не должно превращаться в "любое"
+        return " WHERE FALSE", []
+    clauses, params = [], []
+    for column, value in (("subject", subject), ("topic", topic), ("difficulty", level), ("question_type", qtype)):
+        if value is not None:
+            clauses.append(f"{column} = %s")
+            params.append(value)
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+def get_subjects() -> List[str]:
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT DISTINCT subject FROM task_bank ORDER BY subject')
+        subjects = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+    return subjects
+
+
+def get_topics(subject: str) -> List[str]:
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT DISTINCT topic FROM task_bank WHERE subject = %s ORDER BY topic', (subject,))
+        topics = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+    return topics
+
+
+def count_tasks(subject: Optional[str] = None, topic: Optional[str] = None,
+                difficulty: Optional[str] = None, question_type: Optional[str] = None) -> int:
+    where, params = _filters(subject, topic, difficulty, question_type)
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'SELECT COUNT(*) FROM task_bank{where}', params)
+        count = cursor.fetchone()[0]
+        cursor.close()
+    return count
+
+
+def sample_tasks(count: int, subject: Optional[str] = None, topic: Optional[str] = None,
+                 difficulty: Optional[str] = None, question_type: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Случайная выборка без повторов по заранее вычисленной перестановке (столбец perm):
+    с случайной точки читается окно из count строк в порядке perm, с переходом через конец.
+    Оба запроса идут по индексам *_perm, чтение - O(count) строк, а не все подходящие задачи
+    """
+    if count <= 0:
+        return []
+    where, params = _filters(subject, topic, difficulty, question_type)
+    where = f"{where} AND" if where else " WHERE"
+    start = random.random()
+    select = 'SELECT id, subject, topic, difficulty, question_type, question, answer FROM task_bank'
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f'{select}{where} perm >= %s ORDER BY perm LIMIT %s', params + [start, count])
+            rows = cursor.fetchall()
+            if len(rows) < count:
+                cursor.execute(f'{select}{where} perm < %s ORDER BY perm LIMIT %s',
+                               params + [start, count - len(rows)])
+                rows += cursor.fetchall()
+        finally:
+            cursor.close()
+
+    # Внутри окна порядок perm одинаков от вызова к вызову, поэтому выдача перемешивается
+    random.shuffle(rows)
+    return [
+        {
+            'id': row[0],
+            'subject': row[1],
+            'topic': row[2],
+            'difficulty': row[3],
+            'question_type': row[4],
+            'question': row[5],
+            'answer': row[6],
+        }
+        for row in rows
+    ]
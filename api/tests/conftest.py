@@ -0,0 +1,5 @@
+# Модули API импортируются плоско (как при запуске из api/), поэтому каталог api/ - в начале sys.path
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,131 @@
+import threading
+
+import pytest
+
+import bm25_index
+from bm25_index import BM25Index, BM25Registry, tokenize
+from retrieval import reciprocal_rank_fusion
+
+
+def test_tokenize_lowercases_drops_stopwords_and_short_words():
+    tokens = tokenize("Ёжик И кот в ДОМЕ")
+    assert "и" not in tokens and "в" not in tokens
+    assert all(token == token.lower() for token in tokens)
+    assert tokenize("ёжик") == tokenize("ежик")
+
+
+def test_tokenize_stems_word_forms_to_the_same_term():
+    if bm25_index._stemmer is None:
+        pytest.skip("snowballstemmer is not installed")
+    assert tokenize("фотосинтез")[0] == tokenize("фотосинтеза")[0] == tokenize("фотосинтезом")[0]
+
+
+def build_index():
+    index = BM25Index()
+    index.add(
+        ["a-1", "a-2", "b-1"],
+        ["фотосинтез в листьях растений", "дыхание клеток", "фотосинтез фотосинтез хлорофилл"],
+        [{"file_id": 1}, {"file_id": 1}, {"file_id": 2}],
+    )
+    return index
+
+
+def test_search_ranks_by_term_frequency_and_filters_by_file():
+    index = build_index()
+    assert [chunk_id for chunk_id, _ in index.search("фотосинтез")] == ["b-1", "a-1"]
+    assert [chunk_id for chunk_id, _ in index.search("фотосинтез", file_ids={1})] == ["a-1"]
+    assert index.search("фотосинтез", file_ids={3}) == []
+    assert index.search("и в") == []
+
+
+def test_remove_file_drops_its_chunks_and_bumps_version():
+    index = build_index()
+    version = index.version
+    assert index.remove_file(2) == 1
+    assert index.version > version
+    assert len(index) == 2
+    assert index.file_ids == [1]
+    assert [chunk_id for chunk_id, _ in index.search("фотосинтез")] == ["a-1"]
+    assert index.remove_file(2) == 0
+
+
+def test_rebuilt_index_never_repeats_versions():
+    # Кэш реранкера ключуется версией: пересобранный индекс с тем же числом изменений не должен совпасть со старым
+    old = build_index()
+    rebuilt = build_index()
+    assert rebuilt.version > old.version
+    old.remove_file(2)
+    rebuilt.remove_file(2)
+    assert rebuilt.version != old.version
+
+
+def test_readding_a_chunk_replaces_it():
+    index = build_index()
+    index.add(["a-1"], ["хлорофилл"], [{"file_id": 1}])
+    assert len(index) == 3
+    assert [chunk_id for chunk_id, _ in index.search("листьях")] == []
+    assert {chunk_id for chunk_id, _ in index.search("хлорофилл")} == {"a-1", "b-1"}
+
+
+def test_reciprocal_rank_fusion_prefers_items_ranked_in_both_lists():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "a", "d"]], rrf_k=60)
+    assert fused[0] == "a"
+    assert fused.index("c") < fused.index("b")
+    assert set(fused) == {"a", "b", "c", "d"}
+    assert reciprocal_rank_fusion([]) == []
+
+
+class FlakyRegistry(BM25Registry):
+    def __init__(self, failures: int = 0):
+        super().__init__()
+        self.failures = failures
+        self.builds = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def _build(self, client_id, index):
+        self.builds += 1
+        self.started.set()
+        self.release.wait(5)
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("postgres is down")
+        index.add([f"{client_id}-1"], ["фотосинтез"], [{"file_id": client_id}])
+
+
+def test_failed_build_is_not_cached():
+    registry = FlakyRegistry(failures=1)
+    with pytest.raises(ConnectionError):
+        registry.get(7)
+    index = registry.get(7)
+    assert len(index) == 1
+    assert registry.get(7) is index
+    assert registry.builds == 2
+
+
+def test_cold_build_does_not_block_other_clients():
+    registry = FlakyRegistry()
+    registry.get(1)
+    registry.release.clear()
+    registry.started.clear()
+    builder = threading.Thread(target=registry.get, args=(2,))
+    builder.start()
+    assert registry.started.wait(5)
+    # Индекс клиента 1 отдается, пока клиент 2 еще строится
+    assert len(registry.get(1)) == 1
+    registry.release.set()
+    builder.join(5)
+    assert len(registry.get(2)) == 1
+
+
+def test_changes_during_build_are_applied_to_the_new_index():
+    registry = FlakyRegistry()
+    registry.release.clear()
+    builder = threading.Thread(target=registry.get, args=(3,))
+    builder.start()
+    assert registry.started.wait(5)
+    registry.add_chunks(3, ["3-new"], ["хлорофилл"], [{"file_id": 30}])
+    registry.release.set()
+    builder.join(5)
+    assert {chunk_id for chunk_id, _ in registry.get(3).search("хлорофилл")} == {"3-new"}
@@ -0,0 +1,71 @@
+import time
+
+import pytest
+
+import hugging_face_utils
+from hugging_face_utils import CircuitBreaker, HuggingFaceClient, ModelsUnavailableError
+
+
+def open_breaker(cooldown: float) -> CircuitBreaker:
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=cooldown)
+    breaker.record_failure()
+    return breaker
+
+
+def test_open_breaker_blocks_until_cooldown():
+    breaker = open_breaker(cooldown=60)
+    assert breaker.state == "open"
+    assert not breaker.is_available()
+    assert not breaker.allow()
+
+
+def test_half_open_lets_through_a_single_probe():
+    breaker = open_breaker(cooldown=0)
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()
+    assert not breaker.is_available()
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_availability_check_does_not_take_the_probe_slot():
+    breaker = open_breaker(cooldown=0)
+    for _ in range(3):
+        assert breaker.is_available()
+    assert breaker.allow()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = HuggingFaceClient()
+    monkeypatch.setattr(client, "_generate_once", lambda model, prompt, max_length, temperature: f"answer from {model}")
+    return client
+
+
+def test_candidate_that_is_never_launched_keeps_the_model_usable(client):
+    client.breakers["deepseek-r1"] = open_breaker(cooldown=0)
+    # Модель попадает в список кандидатов, но запрос к ней так и не запускается (ответила другая)
+    assert "deepseek-r1" in client._candidates("smol-lm-3b")
+    assert "deepseek-r1" in client._candidates("smol-lm-3b")
+    assert client._attempt("deepseek-r1", "prompt", 10, 0.1) == "answer from deepseek-r1"
+    assert client.breakers["deepseek-r1"].state == "closed"
+
+
+def test_open_breaker_excludes_candidate_until_cooldown(client):
+    client.breakers["deepseek-r1"] = open_breaker(cooldown=60)
+    assert "deepseek-r1" not in client._candidates("smol-lm-3b")
+    client.breakers["deepseek-r1"].opened_at = time.monotonic() - 61
+    assert "deepseek-r1" in client._candidates("smol-lm-3b")
+
+
+def test_all_models_failing_raises_instead_of_answering(client, monkeypatch):
+    def fail(model, prompt, max_length, temperature):
+        raise ValueError("Empty response")
+
+    monkeypatch.setattr(client, "_generate_once", fail)
+    monkeypatch.setattr(hugging_face_utils, "HF_HEDGE_DELAY", 0.01)
+    with pytest.raises(ModelsUnavailableError):
+        client.generate_text("prompt", model="smol-lm-3b")
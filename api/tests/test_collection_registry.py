@@ -0,0 +1,79 @@
+import json
+import os
+import time
+
+import pytest
+
+import chroma_utils
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    opened = []
+
+    def open_collection(physical_name, embedding, collection_metadata=None):
+        opened.append(physical_name)
+        return {"collection": physical_name, "embedding": embedding}
+
+    monkeypatch.setattr(chroma_utils, "CHROMA_PERSIST_DIR", str(tmp_path))
+    monkeypatch.setattr(chroma_utils, "CHROMA_REGISTRY_FILE", str(tmp_path / "collections.json"))
+    monkeypatch.setattr(chroma_utils, "CHROMA_OWNER_LOCK_FILE", str(tmp_path / ".owner.lock"))
+    monkeypatch.setattr(chroma_utils, "CHROMA_REGISTRY_CHECK_INTERVAL", 0)
+    monkeypatch.setattr(chroma_utils, "open_collection", open_collection)
+    monkeypatch.setattr(chroma_utils, "_vectorstores", {})
+    monkeypatch.setattr(chroma_utils, "_registry", None)
+    monkeypatch.setattr(chroma_utils, "_owner_lock_file", None)
+    yield opened
+    chroma_utils.release_store()
+
+
+def write_registry(path, registry):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(registry, f)
+    # Время изменения должно отличаться даже на файловых системах с грубыми отметками
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_registry_switched_by_another_process_is_picked_up(store):
+    name = chroma_utils.CHROMA_COLLECTION
+    assert chroma_utils.get_vectorstore()["collection"] == name
+    assert chroma_utils.get_vectorstore()["collection"] == name
+    assert store == [name]
+
+    write_registry(chroma_utils.CHROMA_REGISTRY_FILE, {name: {"collection": f"{name}__e5-small__1", "embedding": "e5-small"}})
+    assert chroma_utils.get_vectorstore()["collection"] == f"{name}__e5-small__1"
+    assert chroma_utils.active_collection(name)["embedding"] == "e5-small"
+
+
+def test_swap_keeps_entries_written_by_another_process(store):
+    write_registry(chroma_utils.CHROMA_REGISTRY_FILE, {"client_7": {"collection": "client_7__minilm__1", "embedding": "minilm"}})
+    chroma_utils.swap_collection("langchain", "langchain__minilm__2", "minilm", vectorstore=object())
+    with open(chroma_utils.CHROMA_REGISTRY_FILE, encoding="utf-8") as f:
+        assert set(json.load(f)) == {"client_7", "langchain"}
+
+
+def test_old_collection_is_dropped_after_the_delay():
+    class Client:
+        deleted = []
+
+        def delete_collection(self, name):
+            self.deleted.append(name)
+
+    client = Client()
+    chroma_utils.drop_collection(client, "old", delay=0.05)
+    assert client.deleted == []
+    time.sleep(0.3)
+    assert client.deleted == ["old"]
+
+
+def test_maintenance_cli_cannot_claim_the_store_while_the_api_holds_it(store, tmp_path):
+    handle = open(chroma_utils.CHROMA_OWNER_LOCK_FILE, "a+")
+    try:
+        if not chroma_utils._try_lock(handle, exclusive=False):
+            pytest.skip("file locks are not supported here")
+        with pytest.raises(SystemExit):
+            chroma_utils.require_exclusive_store("reembed")
+    finally:
+        handle.close()
+    chroma_utils.require_exclusive_store("reembed")
@@ -0,0 +1,51 @@
+import pytest
+
+import db_utils
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.rolled_back = False
+
+    def rollback(self):
+        self.rolled_back = True
+
+
+class FakePool:
+    def __init__(self):
+        self.free = [FakeConnection()]
+        self.returned = []
+
+    def getconn(self):
+        return self.free.pop()
+
+    def putconn(self, conn, close=False):
+        self.returned.append(conn)
+        self.free.append(conn)
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = FakePool()
+    monkeypatch.setattr(db_utils, "init_connection_pool", lambda: pool)
+    return pool
+
+
+def test_connection_goes_back_to_the_pool_when_the_query_fails(pool):
+    with pytest.raises(RuntimeError):
+        with db_utils.get_db_connection():
+            raise RuntimeError("syntax error at or near")
+    assert len(pool.returned) == 1
+    assert pool.returned[0].rolled_back
+    # Слот не потерян: следующее соединение снова берется из пула
+    with db_utils.get_db_connection() as conn:
+        assert conn._conn is pool.returned[0]
+    assert len(pool.returned) == 2
+
+
+def test_close_is_idempotent(pool):
+    conn = db_utils.get_db_connection()
+    conn.close()
+    conn.close()
+    assert len(pool.returned) == 1
@@ -0,0 +1,42 @@
+import chroma_utils
+
+
+class FakeCollection:
+    def __init__(self):
+        self.calls = []
+
+    def delete(self, ids=None, where=None):
+        # Коллекцию выбирают под замком записи: иначе переключение может подменить ее до удаления
+        assert chroma_utils.write_lock._is_owned()
+        self.calls.append({"ids": ids, "where": where})
+
+
+class FakeVectorstore:
+    def __init__(self):
+        self._collection = FakeCollection()
+
+
+def test_stale_chunk_ids_are_backed_by_a_file_id_filter(monkeypatch):
+    shared, dedicated = FakeVectorstore(), FakeVectorstore()
+    monkeypatch.setattr(chroma_utils, "CHROMA_DEDICATED_CLIENTS", {5})
+
+    def get_vectorstore(client_id=None):
+        assert chroma_utils.write_lock._is_owned()
+        return dedicated if client_id == 5 else shared
+
+    monkeypatch.setattr(chroma_utils, "get_vectorstore", get_vectorstore)
+    monkeypatch.setattr(chroma_utils, "all_vectorstores", lambda: [shared, dedicated])
+
+    deleted = chroma_utils.delete_chunks([
+        {"file_id": 1, "client_id": 5, "chunk_ids": ["1-a-0", "1-b-0"]},
+        {"file_id": 2, "client_id": 5, "chunk_ids": ["2-a-0"]},
+        {"file_id": 3, "client_id": None, "chunk_ids": None},
+    ])
+
+    assert deleted == 3
+    assert dedicated._collection.calls[:2] == [
+        {"ids": ["1-a-0", "1-b-0", "2-a-0"], "where": None},
+        {"ids": None, "where": {"file_id": {"$in": [1, 2]}}},
+    ]
+    without_ids = {"ids": None, "where": {"file_id": {"$in": [3]}}}
+    assert without_ids in shared._collection.calls and without_ids in dedicated._collection.calls
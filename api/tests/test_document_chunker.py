@@ -0,0 +1,74 @@
+import random
+from types import SimpleNamespace
+
+from document_chunker import CHUNK_MIN_SIZE, CHUNK_SIZE, chunk_docling_document
+
+
+def item(label, text, page=1, level=1):
+    # Минимум полей DocItem, которые читает чанкер
+    return SimpleNamespace(label=label, text=text, level=level, prov=[SimpleNamespace(page_no=page)])
+
+
+class FakeDocument:
+    def __init__(self, items):
+        self.items = items
+
+    def iterate_items(self):
+        return [(entry, 0) for entry in self.items]
+
+
+def words(count, seed=0):
+    rng = random.Random(seed)
+    return " ".join(rng.choice(["фотосинтез", "клетка", "лист", "хлорофилл", "свет"]) for _ in range(count)) + "."
+
+
+def test_chunks_never_exceed_chunk_size():
+    # Короткое начало раздела плюс абзац почти в CHUNK_SIZE раньше давали чанк до CHUNK_SIZE + CHUNK_MIN_SIZE
+    document = FakeDocument([
+        item("title", "Биология"),
+        item("text", words(CHUNK_MIN_SIZE // 12, seed=1)),
+        item("text", "x" * (CHUNK_SIZE - 10)),
+        item("section_header", "Фотосинтез", page=2),
+        item("text", words(40, seed=2), page=2),
+        item("text", words(170, seed=3), page=2),
+        item("text", words(170, seed=4), page=3),
+    ])
+    chunks = chunk_docling_document(document, "bio.pdf")
+    assert chunks
+    assert max(len(chunk.page_content) for chunk in chunks) <= CHUNK_SIZE
+    assert [chunk.metadata["chunk_index"] for chunk in chunks] == list(range(len(chunks)))
+
+
+def test_heading_stays_with_the_start_of_its_text():
+    document = FakeDocument([item("section_header", "Фотосинтез"), item("text", words(CHUNK_SIZE // 8))])
+    chunks = chunk_docling_document(document, "bio.pdf")
+    assert chunks[0].page_content.startswith("## Фотосинтез\n\n")
+    assert len(chunks[0].page_content) > len("## Фотосинтез")
+
+
+def test_chunk_headings_point_to_the_deepest_section():
+    document = FakeDocument([
+        item("title", "Биология", level=0),
+        item("text", "Введение."),
+        item("section_header", "Растения", level=1),
+        item("section_header", "Фотосинтез", level=2, page=2),
+        item("text", "Свет превращается в энергию.", page=2),
+    ])
+    chunks = chunk_docling_document(document, "bio.pdf")
+    assert len(chunks) == 1
+    assert chunks[0].metadata["headings"] == "Биология > Растения > Фотосинтез"
+    assert (chunks[0].metadata["page"], chunks[0].metadata["page_end"]) == (1, 2)
+
+
+def test_sibling_sections_and_page_furniture():
+    document = FakeDocument([
+        item("page_header", "Колонтитул"),
+        item("section_header", "Растения"),
+        item("text", "Про растения."),
+        item("section_header", "Животные"),
+        item("text", "Про животных."),
+        item("page_footer", "стр. 1"),
+    ])
+    chunks = chunk_docling_document(document, "bio.pdf")
+    assert [chunk.metadata["headings"] for chunk in chunks] == ["Растения", "Животные"]
+    assert all("Колонтитул" not in chunk.page_content and "стр. 1" not in chunk.page_content for chunk in chunks)
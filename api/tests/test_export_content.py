@@ -0,0 +1,41 @@
+from quiz_schema import append_questions, render_markdown
+
+
+def bank(question, answer):
+    return {"question": question, "options": [], "answer": answer, "source": "bank"}
+
+
+def test_markdown_answer_keeps_model_text_and_appends_bank_section():
+    model_text = "1. Что такое фотосинтез?\n\nОТВЕТЫ:\n1. Процесс в растениях\n"
+    content = append_questions(model_text, [bank("2 + 2 = ?", "4"), bank("3 * 3 = ?", "9")])
+
+    assert content.startswith(model_text.rstrip())
+    section = content[len(model_text.rstrip()):]
+    assert section.startswith("\n\nЗАДАЧИ ИЗ БАЗЫ:")
+    assert "1. 2 + 2 = ?" in section and "2. 3 * 3 = ?" in section
+    assert section.rstrip().endswith("ОТВЕТЫ:\n1. 4\n2. 9")
+
+
+def test_no_bank_questions_leaves_content_unchanged():
+    assert append_questions("Ответ модели", []) == "Ответ модели"
+
+
+def test_structured_test_renders_bank_after_document_questions():
+    questions = [{"question": "Q", "options": ["a", "b"], "answer": "A"}, bank("B", "b")]
+    lines = render_markdown(questions).splitlines()
+    assert lines[:4] == ["1. Q", "A) a", "B) b", ""]
+    assert lines[4] == "ЗАДАЧИ ИЗ БАЗЫ:"
+
+
+def test_export_layout_is_built_from_the_preview_markdown():
+    from export_utils import ExportCache, parse_markdown
+
+    cache = ExportCache()
+    content = render_markdown([{"question": "Q", "options": ["a", "b"], "answer": "A"}, bank("B", "b")])
+    export_id = cache.register(content)
+    assert cache.register(content) == export_id
+    assert cache.render(export_id, "md") == content.encode("utf-8")
+    blocks = cache._entries[export_id]["blocks"]
+    assert [(block.kind, block.text) for block in blocks] == [
+        (block.kind, block.text) for block in parse_markdown(content)
+    ]
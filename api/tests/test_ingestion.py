@@ -0,0 +1,85 @@
+import threading
+
+import pytest
+from langchain_core.documents import Document
+
+from ingestion import ingest_documents
+
+
+class FakeEmbeddings:
+    def __init__(self, lock=None):
+        self.lock = lock
+
+    def embed_documents(self, texts):
+        # Эмбеддинги считаются без замка записи
+        assert self.lock is None or not self.lock._is_owned()
+        return [[float(len(text))] for text in texts]
+
+
+class FakeCollection:
+    def __init__(self, lock=None, fail=False):
+        self.lock = lock
+        self.fail = fail
+        self.rows = {}
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        assert self.lock is None or self.lock._is_owned()
+        if self.fail:
+            raise RuntimeError("disk full")
+        self.rows.update(dict.fromkeys(ids))
+
+    def delete(self, ids):
+        for chunk_id in ids:
+            self.rows.pop(chunk_id, None)
+
+
+class FakeVectorstore:
+    def __init__(self, embeddings, collection):
+        self.embeddings = embeddings
+        self._collection = collection
+
+
+def chunks(count):
+    return [Document(page_content=f"chunk {i}", metadata={"file_id": 1}) for i in range(count)]
+
+
+def test_lock_is_held_only_for_writes():
+    lock = threading.RLock()
+    store = FakeVectorstore(FakeEmbeddings(lock), FakeCollection(lock))
+    ids = ingest_documents(store, chunks(10), embed_batch=3, write_batch=4, lock=lock,
+                           current_vectorstore=lambda: store)
+    assert set(store._collection.rows) == set(ids) and len(ids) == 10
+
+
+def test_batches_follow_a_collection_switch():
+    lock = threading.RLock()
+    embeddings = FakeEmbeddings(lock)
+    old = FakeVectorstore(embeddings, FakeCollection(lock))
+    new = FakeVectorstore(embeddings, FakeCollection(lock))
+    resolved = []
+
+    def current():
+        # Переключение после первой пачки, как при compact во время загрузки
+        resolved.append(old if not resolved else new)
+        return resolved[-1]
+
+    ids = ingest_documents(old, chunks(6), embed_batch=2, write_batch=2, workers=1, lock=lock,
+                           current_vectorstore=current)
+    assert len(old._collection.rows) == 2
+    assert set(old._collection.rows) | set(new._collection.rows) == set(ids)
+
+
+def test_embedding_model_change_fails_and_rolls_back_everywhere():
+    lock = threading.RLock()
+    old = FakeVectorstore(FakeEmbeddings(lock), FakeCollection(lock))
+    new = FakeVectorstore(FakeEmbeddings(lock), FakeCollection(lock))
+    resolved = []
+
+    def current():
+        resolved.append(old if not resolved else new)
+        return resolved[-1]
+
+    with pytest.raises(RuntimeError, match="Embedding model"):
+        ingest_documents(old, chunks(6), embed_batch=2, write_batch=2, workers=1, lock=lock,
+                         current_vectorstore=current)
+    assert old._collection.rows == {} and new._collection.rows == {}
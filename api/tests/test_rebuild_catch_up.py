@@ -0,0 +1,79 @@
+import chroma_migrations
+
+
+class FakeCollection:
+    def __init__(self, rows=None, metadata=None):
+        self.rows = dict(rows or {})  # id -> (document, metadata, embedding)
+        self.metadata = metadata
+        self.on_get = None
+
+    def count(self):
+        return len(self.rows)
+
+    def get(self, ids=None, include=(), limit=None, offset=0):
+        if self.on_get is not None:
+            hook, self.on_get = self.on_get, None
+            hook()
+        chunk_ids = sorted(self.rows) if ids is None else [chunk_id for chunk_id in ids if chunk_id in self.rows]
+        if limit is not None:
+            chunk_ids = chunk_ids[offset:offset + limit]
+        return {
+            "ids": chunk_ids,
+            "documents": [self.rows[chunk_id][0] for chunk_id in chunk_ids],
+            "metadatas": [self.rows[chunk_id][1] for chunk_id in chunk_ids],
+            "embeddings": [self.rows[chunk_id][2] for chunk_id in chunk_ids],
+        }
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        for chunk_id, embedding, document, metadata in zip(ids, embeddings, documents, metadatas):
+            self.rows[chunk_id] = (document, metadata, embedding)
+
+    def delete(self, ids):
+        for chunk_id in ids:
+            self.rows.pop(chunk_id, None)
+
+
+class FakeStore:
+    def __init__(self, collection):
+        self._collection = collection
+        self._client = None
+
+
+def test_metadata_changed_during_copy_reaches_the_new_collection(monkeypatch):
+    source = FakeCollection({
+        "1-a": ("текст a", {"file_id": 1, "chunk_index": 0}, [0.1]),
+        "1-b": ("текст b", {"file_id": 1, "chunk_index": 1}, [0.2]),
+        "2-a": ("текст c", {"file_id": 2, "chunk_index": 0}, [0.3]),
+    })
+    target = FakeCollection()
+    swapped = []
+
+    def concurrent_writes():
+        # replace-doc переписал метаданные чанка с тем же id, удалил один и добавил новый
+        source.rows["1-a"] = ("текст a", {"file_id": 1, "chunk_index": 5, "headings": "Раздел"}, [0.1])
+        del source.rows["1-b"]
+        source.rows["3-a"] = ("текст d", {"file_id": 3}, [0.4])
+
+    monkeypatch.setattr(chroma_migrations, "get_vectorstore", lambda client_id=None: FakeStore(source))
+    monkeypatch.setattr(chroma_migrations, "active_collection", lambda name: {"collection": name, "embedding": "e"})
+    monkeypatch.setattr(chroma_migrations, "open_collection", lambda *args: FakeStore(target))
+    monkeypatch.setattr(chroma_migrations, "swap_collection", lambda *args: swapped.append(args[1]))
+    monkeypatch.setattr(chroma_migrations, "drop_collection", lambda *args: None)
+    monkeypatch.setattr(chroma_migrations.bm25_registry, "invalidate", lambda *args: None)
+
+    # Копирование идет пачками по 2; изменения приходят после первой пачки
+    original_upsert = target.upsert
+
+    def upsert(**data):
+        original_upsert(**data)
+        if not swapped and "3-a" not in source.rows:
+            source.on_get = concurrent_writes
+
+    target.upsert = upsert
+    stats = chroma_migrations.rebuild_collection(batch_size=2, drop_delay=0)
+
+    assert swapped
+    assert {chunk_id: row[:2] for chunk_id, row in target.rows.items()} == {
+        chunk_id: row[:2] for chunk_id, row in source.rows.items()
+    }
+    assert stats["caught_up"] >= 2 and stats["removed"] == 1
@@ -0,0 +1,53 @@
+import psycopg2
+import psycopg2.errors
+import pytest
+from contextlib import contextmanager
+
+import db_utils
+
+
+class FailingCursor:
+    def __init__(self, error):
+        self.error = error
+
+    def execute(self, sql, params):
+        raise self.error
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, error):
+        self.error = error
+        self.rolled_back = False
+
+    def cursor(self):
+        return FailingCursor(self.error)
+
+    def rollback(self):
+        self.rolled_back = True
+
+
+def use_connection(monkeypatch, error):
+    conn = FakeConnection(error)
+
+    @contextmanager
+    def connection():
+        yield conn
+
+    monkeypatch.setattr(db_utils, "get_db_connection", connection)
+    return conn
+
+
+def test_duplicate_user_is_reported_as_none(monkeypatch):
+    conn = use_connection(monkeypatch, psycopg2.errors.UniqueViolation())
+    assert db_utils.create_client("anna", "anna@example.com", "hash") is None
+    assert conn.rolled_back
+
+
+def test_database_outage_is_not_reported_as_a_duplicate(monkeypatch):
+    conn = use_connection(monkeypatch, psycopg2.OperationalError("server closed the connection unexpectedly"))
+    with pytest.raises(psycopg2.OperationalError):
+        db_utils.create_client("anna", "anna@example.com", "hash")
+    assert conn.rolled_back
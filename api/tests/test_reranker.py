@@ -0,0 +1,41 @@
+import sys
+import types
+
+import pytest
+
+import reranker as reranker_module
+from reranker import CrossEncoderReranker, is_decisive
+
+
+def test_clear_dense_leader_skips_reranking():
+    assert is_decisive([0.1, 0.5], margin=0.15)
+    assert not is_decisive([0.1, 0.2], margin=0.15)
+
+
+def test_too_few_dense_hits_do_not_skip_reranking():
+    # Кандидаты от BM25 все равно нужно упорядочить
+    assert not is_decisive([0.1], margin=0.15)
+    assert not is_decisive([], margin=0.15)
+
+
+def test_failed_load_is_retried_and_warm_up_reports_it(monkeypatch):
+    attempts = []
+
+    def cross_encoder(model_name, device):
+        attempts.append(model_name)
+        if len(attempts) == 1:
+            raise OSError("connection reset while downloading")
+        return object()
+
+    monkeypatch.setitem(sys.modules, "sentence_transformers", types.SimpleNamespace(CrossEncoder=cross_encoder))
+    monkeypatch.setattr(reranker_module, "RERANK_ENABLED", True)
+    reranker = CrossEncoderReranker("model", retry_seconds=60)
+
+    with pytest.raises(RuntimeError, match="connection reset"):
+        reranker.warm_up()
+    # В паузе запросы идут без переранжирования и не пытаются грузить модель
+    assert not reranker.available
+    assert reranker.rerank("q", ["a"]) is None and len(attempts) == 1
+    # Повтор прогрева из readiness загружает модель, не дожидаясь паузы
+    reranker.warm_up()
+    assert reranker.available and reranker.status()["loaded"] and reranker.status()["error"] is None
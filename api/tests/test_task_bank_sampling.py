@@ -0,0 +1,54 @@
+import random
+from contextlib import contextmanager
+
+import task_bank
+
+
+class PermCursor:
+    """Выполняет запросы выборки по таблице в памяти: (id, perm), без фильтров"""
+
+    def __init__(self, table):
+        self.table = sorted(table, key=lambda row: row[1])
+        self.queries = []
+        self._rows = []
+
+    def execute(self, sql, params):
+        self.queries.append(sql)
+        start, limit = params[-2:]
+        assert "ORDER BY perm LIMIT" in sql
+        matches = [row for row in self.table if (row[1] >= start if "perm >= %s" in sql else row[1] < start)]
+        self._rows = [(task_id, "s", "t", "middle", "open_ended", f"q{task_id}", "a") for task_id, _ in matches[:limit]]
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def close(self):
+        pass
+
+
+def use_table(monkeypatch, table):
+    cursor = PermCursor(table)
+
+    @contextmanager
+    def connection():
+        yield type("Conn", (), {"cursor": lambda self: cursor})()
+
+    monkeypatch.setattr(task_bank, "get_db_connection", connection)
+    return cursor
+
+
+def test_window_wraps_around_and_has_no_duplicates(monkeypatch):
+    cursor = use_table(monkeypatch, [(task_id, task_id / 10) for task_id in range(10)])
+    monkeypatch.setattr(task_bank.random, "random", lambda: 0.85)
+    tasks = task_bank.sample_tasks(4)
+    assert sorted(task["id"] for task in tasks) == [0, 1, 2, 9]
+    assert len(cursor.queries) == 2
+
+
+def test_only_count_rows_are_read_and_small_banks_return_everything(monkeypatch):
+    rng = random.Random(1)
+    use_table(monkeypatch, [(task_id, rng.random()) for task_id in range(1000)])
+    assert len({task["id"] for task in task_bank.sample_tasks(5)}) == 5
+    use_table(monkeypatch, [(1, 0.5), (2, 0.1)])
+    assert sorted(task["id"] for task in task_bank.sample_tasks(5)) == [1, 2]
+    assert task_bank.sample_tasks(0) == []
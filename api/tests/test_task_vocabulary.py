@@ -0,0 +1,23 @@
+import os
+
+from pydantic_models import DifficultyLevel, QuestionType
+from task_vocabulary import DIFFICULTY_ALIASES, QUESTION_TYPE_ALIASES, normalize_difficulty, normalize_question_type
+
+
+def test_vocabulary_covers_the_api_enums():
+    assert set(DIFFICULTY_ALIASES) == {level.value for level in DifficultyLevel}
+    assert set(QUESTION_TYPE_ALIASES) == {qtype.value for qtype in QuestionType}
+
+
+def test_ui_and_xml_labels_normalize_to_api_values():
+    assert normalize_difficulty(" Для средних классов ") == normalize_difficulty("middle") == "middle"
+    assert normalize_question_type("Вопрос без выбора ответа") == "open_ended"
+    assert normalize_difficulty("неизвестно") is None and normalize_question_type(None) is None
+
+
+def test_ui_copy_of_the_vocabulary_is_identical():
+    # UI не импортирует код API, поэтому держит свою копию модуля
+    api_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with open(os.path.join(api_dir, "task_vocabulary.py"), encoding="utf-8") as api_copy, \
+            open(os.path.join(api_dir, "..", "app", "task_vocabulary.py"), encoding="utf-8") as ui_copy:
+        assert api_copy.read() == ui_copy.read()
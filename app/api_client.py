@@ -0,0 +1,138 @@
+# api_client.py - общий HTTP-клиент для обращений UI к API
+import os
+import time
+import logging
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000")
+API_TIMEOUT = float(os.getenv("API_TIMEOUT", "10"))
+# Генерация теста на CPU может занимать минуты
+API_LONG_TIMEOUT = float(os.getenv("API_LONG_TIMEOUT", "600"))
+API_MAX_RETRIES = int(os.getenv("API_MAX_RETRIES", "3"))
+API_BACKOFF_FACTOR = float(os.getenv("API_BACKOFF_FACTOR", "0.3"))
+API_POOL_SIZE = int(os.getenv("API_POOL_SIZE", "10"))
+API_GZIP = os.getenv("API_GZIP", "true").lower() in ("1", "true", "yes")
+API_CACHE_TTL = float(os.getenv("API_CACHE_TTL", "60"))
+
+
+class ApiClient:
+    """HTTP-клиент к API с пулом соединений, keep-alive и повторами"""
+
+    def __init__(
+        self,
+        base_url: str = API_BASE_URL,
+        timeout: float = API_TIMEOUT,
+        max_retries: int = API_MAX_RETRIES,
+        backoff_factor: float = API_BACKOFF_FACTOR,
+        pool_size: int = API_POOL_SIZE,
+        gzip: bool = API_GZIP,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.timing_hooks: List[Callable[[str, str, int, float], None]] = []
+
+        # Повторяем только ошибки соединения и временные ответы прокси.
+        # POST не повторяется после отправки тела, чтобы не задвоить загрузку.
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET", "HEAD", "OPTIONS", "DELETE"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "accept": "application/json",
+            "Connection": "keep-alive",
+            "Accept-Encoding": "gzip, deflate" if gzip else "identity",
+        })
+
+    def add_timing_hook(self, hook: Callable[[str, str, int, float], None]) -> None:
+        """Регистрирует функцию hook(method, path, status_code, elapsed_seconds)"""
+        self.timing_hooks.append(hook)
+
+    def request(self, method: str, path: str, timeout: Optional[float] = None, **kwargs) -> requests.Response:
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        started = time.perf_counter()
+        status_code = 0
+        try:
+            response = self.session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+            status_code = response.status_code
+            return response
+        finally:
+            elapsed = time.perf_counter() - started
+            for hook in self.timing_hooks:
+                try:
+                    hook(method, path, status_code, elapsed)
+                except Exception as e:
+                    logging.warning(f"Timing hook failed: {e}")
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+def _log_timing(method: str, path: str, status_code: int, elapsed: float) -> None:
+    logging.info(f"API {method} {path} -> {status_code} за {elapsed * 1000:.1f} мс")
+
+
+@st.cache_resource
+def get_api_client() -> ApiClient:
+    """Возвращает один клиент на процесс Streamlit-сервера"""
+    client = ApiClient()
+    client.add_timing_hook(_log_timing)
+    return client
+
+
+class ResponseCache:
+    """Кэш ответов API с TTL. Ключи начинаются с client_id и пути запроса"""
+
+    def __init__(self, default_ttl: float = API_CACHE_TTL):
+        self.default_ttl = default_ttl
+        self._entries: Dict[Tuple[Hashable, ...], Tuple[float, Any]] = {}
+
+    def get(self, key: Tuple[Hashable, ...]) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            return None
+        return value
+
+    def set(self, key: Tuple[Hashable, ...], value: Any, ttl: Optional[float] = None) -> None:
+        self._entries[key] = (time.monotonic() + (ttl if ttl is not None else self.default_ttl), value)
+
+    def invalidate(self, client_id: Hashable = None, path: Optional[str] = None) -> None:
+        """Сбрасывает записи клиента; если указан path - только этот путь и вложенные в него"""
+        for key in list(self._entries):
+            if client_id is not None and key[0] != client_id:
+                continue
+            if path is not None and key[1] != path and not str(key[1]).startswith(path.rstrip("/") + "/"):
+                continue
+            del self._entries[key]
+
+
+def get_response_cache() -> ResponseCache:
+    """Возвращает кэш ответов текущей сессии Streamlit"""
+    if "_api_response_cache" not in st.session_state:
+        st.session_state._api_response_cache = ResponseCache()
+    return st.session_state._api_response_cache
@@ -1,13 +1,16 @@
-import requests
+import json
 import streamlit as st
-import os
 from io import BytesIO
 # import sys
 # sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from auth_utils import get_current_client_id
+from api_client import get_api_client, get_response_cache, API_LONG_TIMEOUT
 
-API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000")
+# Текст документа и содержимое PDF по id не меняются, их можно держать дольше списков
+DOCUMENT_CACHE_TTL = 600
+# API отвечает 429, когда очередь к модели переполнена
+LLM_BUSY_MESSAGE = "Модель сейчас перегружена запросами. Пожалуйста, повторите через несколько секунд."
 
 def get_api_response(question, session_id, model):
     headers = {
@@ -16,21 +19,40 @@ def get_api_response(question, session_id, model):
     }
     data = {
         "question": question,
-        "model": model
+        "model": model,
+        "client_id": get_current_client_id()
     }
     if session_id:
         data["session_id"] = session_id
 
     try:
-        response = requests.post("http://localhost:8000/chat", headers=headers, json=data)
+        response = get_api_client().post("/chat", headers=headers, json=data, timeout=API_LONG_TIMEOUT)
         if response.status_code == 200:
             return response.json()
+        elif response.status_code == 429:
+            st.warning(LLM_BUSY_MESSAGE)
+            return None
         else:
             st.error(f"API request failed with status code {response.status_code}: {response.text}")
             return None
     except Exception as e:
         st.error(f"An error occurred: {str(e)}")
         return None
+def ask_assistant(message: str, chat_history: list):
+    """Отправляет сообщение чат-ассистенту поддержки; chat_history - список {"role", "content"}"""
+    try:
+        response = get_api_client().post(
+            "/assistant",
+            json={"message": message, "chat_history": chat_history, "client_id": get_current_client_id()},
+            timeout=API_LONG_TIMEOUT
+        )
+        if response.status_code == 200:
+            return response.json()["answer"]
+        if response.status_code == 429:
+            return LLM_BUSY_MESSAGE
+        return f"Извините, произошла ошибка: {response.status_code} - {response.text}"
+    except Exception as e:
+        return f"Извините, произошла ошибка: {str(e)}"
 def upload_document(file):
     print("Uploading file...")
     try:
@@ -43,8 +65,9 @@ def upload_document(file):
         # Добавляем client_id в данные формы
         data = {"client_id": client_id}
         
-        response = requests.post("http://localhost:8000/upload-doc", files=files, data=data)
+        response = get_api_client().post("/upload-doc", files=files, data=data, timeout=API_LONG_TIMEOUT)
         if response.status_code == 200:
+            get_response_cache().invalidate(client_id, "/list-docs")
             return response.json()
         else:
             st.error(f"Failed to upload file. Error: {response.status_code} - {response.text}")
@@ -57,10 +80,18 @@ def get_document_text(file_id: int) -> str:
     if file_id is None:
         return ""
     
+    client_id = get_current_client_id()
+    cache_key = (client_id, f"/get-document-text/{file_id}")
+    cached = get_response_cache().get(cache_key)
+    if cached is not None:
+        return cached
+
     try:
-        response = requests.get(f"{API_BASE_URL}/get-document-text/{file_id}")
+        response = get_api_client().get(f"/get-document-text/{file_id}")
         if response.status_code == 200:
-            return response.json().get("text", "")
+            text = response.json().get("text", "")
+            get_response_cache().set(cache_key, text, ttl=DOCUMENT_CACHE_TTL)
+            return text
         else:
             print(f"Error getting document text: {response.status_code} - {response.text}")
             return ""
@@ -89,8 +120,9 @@ def upload_test_pdf(pdf_buffer: BytesIO, filename: str, document_id: int = None,
         if client_id:
             data["client_id"] = client_id
         
-        response = requests.post("http://localhost:8000/upload-test-pdf", files=files, data=data)
+        response = get_api_client().post("/upload-test-pdf", files=files, data=data)
         if response.status_code == 200:
+            get_response_cache().invalidate(client_id, "/list-test-pdfs")
             return response.json()
         else:
             st.error(f"Failed to upload test PDF. Error: {response.status_code} - {response.text}")
@@ -99,9 +131,16 @@ def upload_test_pdf(pdf_buffer: BytesIO, filename: str, document_id: int = None,
         st.error(f"An error occurred while uploading the test PDF: {str(e)}")
         return None
 def download_test_pdf(file_id: int):
+    client_id = get_current_client_id()
+    cache_key = (client_id, f"/download-test-pdf/{file_id}")
+    cached = get_response_cache().get(cache_key)
+    if cached is not None:
+        return cached
+
     try:
-        response = requests.get(f"http://localhost:8000/download-test-pdf/{file_id}")
+        response = get_api_client().get(f"/download-test-pdf/{file_id}")
         if response.status_code == 200:
+            get_response_cache().set(cache_key, response.content, ttl=DOCUMENT_CACHE_TTL)
             return response.content
         else:
             st.error(f"Failed to download test PDF. Error: {response.status_code} - {response.text}")
@@ -110,13 +149,20 @@ def download_test_pdf(file_id: int):
         st.error(f"An error occurred while downloading the test PDF: {str(e)}")
         return None
 
-def list_documents():
+def list_documents(refresh: bool = False):
     try:
         # Передаем client_id в запрос
         client_id = get_current_client_id()
-        response = requests.get(f"http://localhost:8000/list-docs?client_id={client_id}")
+        cache_key = (client_id, "/list-docs")
+        cached = None if refresh else get_response_cache().get(cache_key)
+        if cached is not None:
+            return cached
+
+        response = get_api_client().get("/list-docs", params={"client_id": client_id})
         if response.status_code == 200:
-            return response.json()
+            documents = response.json()
+            get_response_cache().set(cache_key, documents)
+            return documents
         else:
             st.error(f"Failed to fetch document list. Error: {response.status_code} - {response.text}")
             return []
@@ -124,13 +170,20 @@ def list_documents():
         st.error(f"An error occurred while fetching the document list: {str(e)}")
         return []
 
-def list_test_pdfs():
+def list_test_pdfs(refresh: bool = False):
     try:
         # Передаем client_id в запрос
         client_id = get_current_client_id()
-        response = requests.get(f"http://localhost:8000/list-test-pdfs?client_id={client_id}")
+        cache_key = (client_id, "/list-test-pdfs")
+        cached = None if refresh else get_response_cache().get(cache_key)
+        if cached is not None:
+            return cached
+
+        response = get_api_client().get("/list-test-pdfs", params={"client_id": client_id})
         if response.status_code == 200:
-            return response.json()
+            test_pdfs = response.json()
+            get_response_cache().set(cache_key, test_pdfs)
+            return test_pdfs
         else:
             st.error(f"Failed to fetch test PDF list. Error: {response.status_code} - {response.text}")
             return []
@@ -146,8 +199,13 @@ def delete_document(file_id):
     data = {"file_id": file_id}
 
     try:
-        response = requests.post("http://localhost:8000/delete-doc", headers=headers, json=data)
+        response = get_api_client().post("/delete-doc", headers=headers, json=data)
         if response.status_code == 200:
+            client_id = get_current_client_id()
+            get_response_cache().invalidate(client_id, "/list-docs")
+            get_response_cache().invalidate(client_id, f"/get-document-text/{file_id}")
+            # PDF тестов ссылаются на документ, в списке меняется document_name
+            get_response_cache().invalidate(client_id, "/list-test-pdfs")
             return response.json()
         else:
             st.error(f"Failed to delete document. Error: {response.status_code} - {response.text}")
@@ -164,8 +222,11 @@ def delete_test_pdf(file_id):
     data = {"file_id": file_id}
 
     try:
-        response = requests.post("http://localhost:8000/delete-test-pdf", headers=headers, json=data)
+        response = get_api_client().post("/delete-test-pdf", headers=headers, json=data)
         if response.status_code == 200:
+            client_id = get_current_client_id()
+            get_response_cache().invalidate(client_id, "/list-test-pdfs")
+            get_response_cache().invalidate(client_id, f"/download-test-pdf/{file_id}")
             return response.json()
         else:
             st.error(f"Failed to delete test PDF. Error: {response.status_code} - {response.text}")
@@ -179,7 +240,7 @@ def check_document_uniqueness(file):
         print("hi",client_id)
         files = {"file": (file.name, file, file.type)}
         data = {"client_id": client_id}
-        response = requests.post("http://localhost:8000/check-uniqueness/", files=files,data=data)
+        response = get_api_client().post("/check-uniqueness", files=files, data=data, timeout=API_LONG_TIMEOUT)
         if response.status_code == 200:
             print(response,response.json())
             return response.json()
@@ -191,24 +252,114 @@ def check_document_uniqueness(file):
         return None
 
 
-def generate_test_api(document_id: int, question_count: int, difficulty: str, question_type: str):
+def generate_test_api(document_id: int, question_count: int, difficulty: str, question_type: str,
+                      xml_subject: str = None, xml_topic: str = None, xml_task_count: int = 0):
     """
-    Вызов API для генерации теста с улучшенным промптом
+    Вызов API для генерации теста с улучшенным промптом.
+    Если задан xml_subject, API добавит xml_task_count случайных задач из банка
     """
     try:
         data = {
             "document_id": document_id,
             "question_count": question_count,
             "difficulty": difficulty,
-            "question_type": question_type
+            "question_type": question_type,
+            "include_xml_tasks": bool(xml_subject and xml_task_count),
+            "xml_subject": xml_subject,
+            "xml_topic": xml_topic,
+            "xml_task_count": xml_task_count,
+            "client_id": get_current_client_id()
         }
         
-        response = requests.post("http://localhost:8000/generate-test", json=data)
+        response = get_api_client().post("/generate-test", json=data, timeout=API_LONG_TIMEOUT)
         if response.status_code == 200:
             return response.json()
+        elif response.status_code == 429:
+            st.warning(LLM_BUSY_MESSAGE)
+            return None
         else:
             st.error(f"Failed to generate test. Error: {response.status_code} - {response.text}")
             return None
     except Exception as e:
         st.error(f"An error occurred while generating test: {str(e)}")
-        return None
\ No newline at end of file
+        return None
+
+
+def generate_tests_batch_api(document_ids: list, variants_per_document: int, question_count: int,
+                             difficulty: str, question_type: str):
+    """
+    Пакетная генерация вариантов. Генератор: отдает результаты по мере готовности на сервере
+    (словари с полями index, document_id, variant, test_content или error)
+    """
+    data = {
+        "document_ids": document_ids,
+        "variants_per_document": variants_per_document,
+        "question_count": question_count,
+        "difficulty": difficulty,
+        "question_type": question_type,
+        "client_id": get_current_client_id()
+    }
+    try:
+        response = get_api_client().post("/generate-tests/batch", json=data, stream=True, timeout=API_LONG_TIMEOUT)
+        if response.status_code == 429:
+            st.warning(LLM_BUSY_MESSAGE)
+            return
+        if response.status_code != 200:
+            st.error(f"Failed to generate tests. Error: {response.status_code} - {response.text}")
+            return
+        with response:
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+    except Exception as e:
+        st.error(f"An error occurred while generating tests: {str(e)}")
+
+
+def create_export(content: str = None, test: dict = None):
+    """
+    Регистрирует тест для экспорта в API: готовый Markdown (content) или структуру {"questions": [...]}.
+    С обоими аргументами вопросы из test дописываются к content отдельным разделом.
+    Возвращает {"export_id", "content"}, где content - Markdown для предпросмотра
+    """
+    try:
+        data = {key: value for key, value in (("content", content), ("test", test)) if value is not None}
+        response = get_api_client().post("/exports", json=data)
+        if response.status_code == 200:
+            return response.json()
+        st.error(f"Failed to register export. Error: {response.status_code} - {response.text}")
+        return None
+    except Exception as e:
+        st.error(f"An error occurred while registering export: {str(e)}")
+        return None
+
+def download_export(export_id: str, fmt: str):
+    """Скачивает файл экспорта (pdf/docx/md); API строит его при первом запросе"""
+    try:
+        response = get_api_client().get(f"/exports/{export_id}/{fmt}", timeout=API_LONG_TIMEOUT)
+        if response.status_code == 200:
+            return response.content
+        st.error(f"Failed to download export. Error: {response.status_code} - {response.text}")
+        return None
+    except Exception as e:
+        st.error(f"An error occurred while downloading export: {str(e)}")
+        return None
+
+def save_export(export_id: str, filename: str, document_id: int = None, session_id: str = None):
+    """Сохраняет PDF экспорта в историю тестов текущего клиента"""
+    try:
+        client_id = get_current_client_id()
+        data = {
+            "filename": filename,
+            "document_id": document_id,
+            "session_id": session_id or "default_session",
+            "client_id": client_id
+        }
+        response = get_api_client().post(f"/exports/{export_id}/save", json=data, timeout=API_LONG_TIMEOUT)
+        if response.status_code == 200:
+            get_response_cache().invalidate(client_id, "/list-test-pdfs")
+            return response.json()
+        st.error(f"Failed to save test PDF. Error: {response.status_code} - {response.text}")
+        return None
+    except Exception as e:
+        st.error(f"An error occurred while saving the test PDF: {str(e)}")
+        return None
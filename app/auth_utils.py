@@ -1,22 +1,20 @@
-# auth_utils.py - исправленные импорты
+# auth_utils.py - аутентификация через API (UI не подключается к БД напрямую)
 import streamlit as st
-import hashlib
 import secrets
-import sys
-import os
+from typing import Optional
 
-# Добавляем путь к папке api для импорта
-sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from api_client import get_api_client, get_response_cache
 
-from api.db_utils import get_client_by_username, create_client, get_client_by_id, get_default_client_id
-
-def hash_password(password: str) -> str:
-    """Хеширует пароль"""
-    return hashlib.sha256(password.encode()).hexdigest()
-
-def verify_password(password: str, hashed_password: str) -> bool:
-    """Проверяет пароль"""
-    return hash_password(password) == hashed_password
+def get_default_client_id() -> Optional[int]:
+    """Получает ID клиента по умолчанию через API"""
+    try:
+        response = get_api_client().get("/clients/default")
+        if response.status_code == 200:
+            return response.json()["client_id"]
+        print(f"❌ Ошибка получения client_id: {response.status_code} - {response.text}")
+    except Exception as e:
+        print(f"❌ Ошибка получения client_id: {e}")
+    return None
 
 def init_session_state():
     """Инициализирует состояние сессии"""
@@ -32,8 +30,9 @@ def init_session_state():
 def login_user(username: str, password: str) -> bool:
     """Аутентифицирует пользователя"""
     try:
-        client = get_client_by_username(username)
-        if client and verify_password(password, client['password_hash']):
+        response = get_api_client().post("/auth/login", json={"username": username, "password": password})
+        if response.status_code == 200:
+            client = response.json()
             st.session_state.authenticated = True
             st.session_state.username = username
             st.session_state.client_id = client['id']
@@ -47,14 +46,12 @@ def login_user(username: str, password: str) -> bool:
 def register_user(username: str, email: str, password: str) -> bool:
     """Регистрирует нового пользователя"""
     try:
-        # Проверяем, не существует ли уже пользователь
-        if get_client_by_username(username):
-            return False
-        
-        password_hash = hash_password(password)
-        client_id = create_client(username, email, password_hash)
-        
-        if client_id:
+        response = get_api_client().post(
+            "/auth/register",
+            json={"username": username, "email": email, "password": password}
+        )
+        if response.status_code == 200:
+            client_id = response.json()["id"]
             st.session_state.authenticated = True
             st.session_state.username = username
             st.session_state.client_id = client_id
@@ -67,6 +64,7 @@ def register_user(username: str, email: str, password: str) -> bool:
 
 def logout_user():
     """Выход пользователя"""
+    get_response_cache().invalidate(st.session_state.get('client_id'))
     st.session_state.authenticated = False
     st.session_state.username = None
     st.session_state.client_id = None
@@ -146,5 +144,8 @@ def get_current_client_id():
     if st.session_state.get('authenticated') and st.session_state.get('client_id'):
         return st.session_state.client_id
     else:
-        # Возвращаем ID клиента по умолчанию для неавторизованных пользователей
-        return get_default_client_id()
\ No newline at end of file
+        # Возвращаем ID клиента по умолчанию для неавторизованных пользователей.
+        # Он не меняется, поэтому запрашиваем БД один раз за сессию
+        if st.session_state.get('default_client_id') is None:
+            st.session_state.default_client_id = get_default_client_id()
+        return st.session_state.default_client_id
\ No newline at end of file
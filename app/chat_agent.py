@@ -1,21 +1,13 @@
 # app/chat_agent.py - ИСПРАВЛЕННАЯ ВЕРСИЯ С РАБОЧИМИ КНОПКАМИ
 import streamlit as st
-import sys
-import os
-import uuid
 from datetime import datetime
 
-# Добавляем путь к папке api для импорта
-sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-
-from api.langchain_utils import get_chat_agent, SimpleChatHistory
+from api_utils import ask_assistant
 
 def init_chat_agent():
-    """Инициализирует чат-агента в session_state"""
-    if 'chat_agent' not in st.session_state:
-        st.session_state.chat_agent = get_chat_agent()
+    """Инициализирует состояние чата в session_state (сам агент работает в API, /assistant)"""
     if 'chat_history' not in st.session_state:
-        st.session_state.chat_history = SimpleChatHistory()
+        st.session_state.chat_history = []
     if 'chat_open' not in st.session_state:
         st.session_state.chat_open = False
     if 'chat_messages' not in st.session_state:
@@ -36,8 +28,9 @@ def send_message():
     if not user_input:
         return
     
-    # Добавляем сообщение пользователя в историю
-    st.session_state.chat_history.add_user_message(user_input)
+    # История до текущего сообщения уходит в API вместе с ним
+    chat_history = list(st.session_state.chat_history)
+    st.session_state.chat_history.append({"role": "human", "content": user_input})
     st.session_state.chat_messages.append({
         "role": "user", 
         "content": user_input,
@@ -48,33 +41,19 @@ def send_message():
     st.session_state.user_input = ""
     
     # Получаем ответ от агента
-    try:
-        with st.spinner("🤔 Думаю..."):
-            response = st.session_state.chat_agent.invoke({
-                "input": user_input,
-                "chat_history": st.session_state.chat_history.messages
-            })
-        
-        ai_response = response.content if hasattr(response, 'content') else str(response)
-        st.session_state.chat_history.add_ai_message(ai_response)
-        st.session_state.chat_messages.append({
-            "role": "assistant", 
-            "content": ai_response,
-            "time": datetime.now().strftime("%H:%M")
-        })
-        
-    except Exception as e:
-        error_msg = f"Извините, произошла ошибка: {str(e)}"
-        st.session_state.chat_history.add_ai_message(error_msg)
-        st.session_state.chat_messages.append({
-            "role": "assistant", 
-            "content": error_msg,
-            "time": datetime.now().strftime("%H:%M")
-        })
+    with st.spinner("🤔 Думаю..."):
+        ai_response = ask_assistant(user_input, chat_history)
+
+    st.session_state.chat_history.append({"role": "ai", "content": ai_response})
+    st.session_state.chat_messages.append({
+        "role": "assistant", 
+        "content": ai_response,
+        "time": datetime.now().strftime("%H:%M")
+    })
 
 def clear_chat_history():
     """Очищает историю чата"""
-    st.session_state.chat_history.clear()
+    st.session_state.chat_history = []
     st.session_state.chat_messages = []
 
 def render_chat_interface():
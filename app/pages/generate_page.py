@@ -1,14 +1,8 @@
 import streamlit as st
-from api_utils import upload_document, get_api_response, list_documents, upload_test_pdf,check_document_uniqueness,get_document_text
+from api_utils import upload_document, list_documents, check_document_uniqueness
+from api_utils import generate_test_api, create_export, download_export, save_export
 import uuid
-from xml_utils import load_tasks_from_xml, get_tasks,get_preview_tasks
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from io import BytesIO
-from docx import Document
-from docx.shared import Pt
+from xml_utils import get_subjects, get_topics, get_tasks, get_preview_tasks
 
 
 def load_css(file_name):
@@ -17,64 +11,21 @@ def load_css(file_name):
 
 load_css("style.css")
 
-try:
-    pdfmetrics.registerFont(TTFont('Arial', 'Arial.ttf'))
-except:
-    st.warning("Не удалось загрузить шрифт Arial. Используется резервный шрифт.")
-
-
-def markdown_to_word(markdown_text):
-    doc = Document()
-    
-    style = doc.styles['Normal']
-    style.font.name = 'Arial'
-    style.font.size = Pt(12)
-    
-    lines = markdown_text.split("\n")
-    
-    for line in lines:
-        while len(line) > 100:
-            doc.add_paragraph(line[:100])
-            line = line[100:]
-        doc.add_paragraph(line)
-    
-    buffer = BytesIO()
-    doc.save(buffer)
-    buffer.seek(0)
-    
-    return buffer
-def markdown_to_pdf(markdown_text):
-    buffer = BytesIO()
-    p = canvas.Canvas(buffer, pagesize=letter)
-
-    try:
-        p.setFont("Arial", 12)
-    except:
-        p.setFont("Helvetica", 12)
-
-    lines = markdown_text.split("\n")
-    y = 750
-    line_height = 20
-
-    for line in lines:
-        while len(line) > 100:
-            p.drawString(50, y, line[:100])
-            line = line[100:]
-            y -= line_height
-        p.drawString(50, y, line)
-        y -= line_height
-        
-        if y < 50:
-            p.showPage()
-            y = 750
-            try:
-                p.setFont("Arial", 12)
-            except:
-                p.setFont("Helvetica", 12)
-
-    p.save()
-    buffer.seek(0)
-    return buffer
+def export_download_button(fmt: str, label: str, mime: str):
+    """Файл экспорта запрашивается у API только после нажатия, и один раз за генерацию"""
+    state_key = f"export_{fmt}"
+    if st.session_state.get(state_key) is None:
+        if st.button(f"Подготовить {label}", key=f"prepare_{fmt}"):
+            with st.spinner(f"Подготовка {label}..."):
+                st.session_state[state_key] = download_export(st.session_state.export_id, fmt)
+    if st.session_state.get(state_key) is not None:
+        st.download_button(
+            label=f"Скачать {label}",
+            data=st.session_state[state_key],
+            file_name=f"generated_test.{fmt}",
+            mime=mime,
+            key=f"download_{fmt}"
+        )
 
 def show_generate_page():
     st.sidebar.page_link("streamlit_app.py", label="Главная")
@@ -153,14 +104,13 @@ def show_generate_page():
 
     st.header("3. Добавить задачи из базы")
 
-    tasks_dict = load_tasks_from_xml()
-    subjects = list(tasks_dict.keys()) if tasks_dict else []
+    subjects = get_subjects()
     selected_subject = st.selectbox("Выберите предмет", options=[""] + subjects)
     selected_topic = None
     xml_tasks_count = 0
 
     if selected_subject:
-        topics = list(tasks_dict[selected_subject].keys())
+        topics = get_topics(selected_subject)
         selected_topic = st.selectbox("Выберите тему", options=[""] + topics)
         xml_unlock_tasks_count = get_preview_tasks(
             subject=selected_subject,
@@ -179,76 +129,31 @@ def show_generate_page():
     
     # Инициализация переменных перед использованием
     test_content = ""
-    xml_questions = []
-    answers = []
     
     if st.button("Создать тест"):
-        if 'uploaded_file_id' not in st.session_state and not selected_subject:
+        if not st.session_state.uploaded_file_id and not selected_subject:
             st.error("Выберите документ или предмет для генерации теста!")
             return
 
-        # Используем правильное имя модели из доступных вариантов
-        model_name = "lakomoor/vikhr-llama-3.2-1b-instruct:1b"  # Основная русская модель
-
-        # Adjust question count for AI generation
-        ai_question_count = question_count
+        questions = []
+        bank_questions = []
 
-        # Generate AI-based questions if needed
-        if ai_question_count > 0 and 'uploaded_file_id' in st.session_state:
-            document_text = get_document_text(st.session_state.uploaded_file_id) 
-            
-            if question_format == "Вопрос с выбором ответа":
-                format_instructions = "Создавай вопросы с 4 вариантами ответов (A, B, C, D). Только один правильный. В конце укажи правильные ответы в формате: 1.A, 2.C и т.д."
-            else:
-                format_instructions = "Создавай открытые вопросы, требующие развернутого ответа. В конце дай краткие правильные ответы на каждый вопрос."
-
-            prompt = f"""
-            Сгенерируй качественный тест на основе документа.
-            
-            ТРЕБОВАНИЯ:
-            - Количество вопросов: {ai_question_count}
-            - Уровень сложности: {difficulty}
-            - Формат вопросов: {question_format}
-            - Все вопросы должны быть на русском языке
-            - Все вопросы должны быть строго по теме документа
-            
-            ИНСТРУКЦИИ ПО ФОРМАТУ:
-            {format_instructions}
-            
-            СТРУКТУРА:
-            1. Сначала все вопросы по порядку
-            2. Затем раздел с правильными ответами
-            
-            КАЧЕСТВО ВОПРОСОВ:
-            - Вопросы должны проверять понимание материала
-            - Формулировки четкие и однозначные
-            - Охватывай ключевые темы документа
-            - Соответствуй уровню сложности: {difficulty}
-            
-            ВАЖНО:
-            - Используй ТОЛЬКО информацию из предоставленного документа
-            - Не добавляй вопросы на темы, которых нет в документе
-            - Все ответы должны быть подтверждены текстом документа
-            
-            Текст документа:
-            {document_text}
-            
-            Сгенерируй тест строго по этим требованиям.
-            """
-            
+        # Вопросы по документу приходят структурой: текст, варианты и ответ отдельными полями
+        if question_count > 0 and st.session_state.uploaded_file_id:
             with st.spinner("Генерация качественного теста..."):
-                response = get_api_response(
-                    question=prompt,
-                    session_id=st.session_state.session_id,
-                    model=model_name  # Используем правильное имя модели
+                response = generate_test_api(
+                    document_id=st.session_state.uploaded_file_id,
+                    question_count=question_count,
+                    difficulty=difficulty,
+                    question_type=question_format
                 )
-                
-                if response:
-                    test_content = response['answer']
-                    print(f"AI сгенерированный контент: {test_content[:100]}...")  # Отладочная печать
+                if response and response.get("test"):
+                    questions = response["test"]["questions"]
+                elif response:
+                    # Модель не выдала JSON - показываем ответ как есть
+                    test_content = response["test_content"]
                 else:
                     st.error("Ошибка при генерации теста AI")
-                    test_content = ""
 
         # Add XML tasks
         if selected_subject and xml_tasks_count > 0:
@@ -259,40 +164,41 @@ def show_generate_page():
                 task_type=question_format,
                 limit=xml_tasks_count
             )
-            
-            for i, task in enumerate(xml_tasks, 1):
-                xml_questions.append(f"{i}. {task.question}\n")
-                answers.append(f"[{i}]. {task.answer}\n")
+            bank_questions = [
+                {"question": task.question, "options": [], "answer": task.answer, "source": "bank"}
+                for task in xml_tasks
+            ]
 
-        # Combine questions and answers
-        
-            # Добавление XML вопросов
-        if xml_questions:
-            xml_section = "\n\n".join(xml_questions)
-            if test_content:
-                test_content = test_content + "\n\n" + xml_section
-            else:
-                test_content = xml_section
-        
-        # Добавление ответов
-        if answers:
-            answers_section = "\n".join(answers)
-            test_content = test_content + "\n\nОТВЕТЫ:\n" + answers_section
+        if not questions and not bank_questions and not test_content:
+            st.error("Не удалось сформировать тест")
+            return
+
+        # Markdown и файлы экспорта API строит из структуры, без разбора текста;
+        # ответ модели без JSON уходит как есть, а задачи из базы дописываются к нему отдельным разделом
+        if test_content:
+            export = create_export(content=test_content, test={"questions": bank_questions} if bank_questions else None)
+        else:
+            export = create_export(test={"questions": questions + bank_questions})
+        if export:
+            test_content = export["content"]
 
         # Сохранение в session_state
         st.session_state.generated_test = test_content
         st.session_state.test_generated = True
-        st.session_state.test_pdf = markdown_to_pdf(test_content)
-        st.session_state.test_word = markdown_to_word(test_content)
+        st.session_state.export_id = export["export_id"] if export else None
+        st.session_state.export_pdf = None
+        st.session_state.export_docx = None
         st.success("✅ Тест успешно сгенерирован!")
 
-        # Сохранение PDF
-        pdf_response = upload_test_pdf(
-            pdf_buffer=st.session_state.test_pdf,
-            filename="generated_test.pdf",
-            document_id=st.session_state.uploaded_file_id if 'uploaded_file_id' in st.session_state else None,
-            session_id=st.session_state.session_id
-        )
+        # Сохранение PDF: API рендерит его из зарегистрированного текста
+        pdf_response = None
+        if st.session_state.export_id:
+            pdf_response = save_export(
+                st.session_state.export_id,
+                filename="generated_test.pdf",
+                document_id=st.session_state.uploaded_file_id,
+                session_id=st.session_state.session_id
+            )
         if pdf_response:
             st.success(f"PDF тест сохранён! ID: {pdf_response.get('file_id')}")
         else:
@@ -314,22 +220,14 @@ def show_generate_page():
                 key="download_md"
             )
         
-        with col2:
-            st.download_button(
-                label="Скачать PDF",
-                data=st.session_state.test_pdf,
-                file_name="generated_test.pdf",
-                mime="application/pdf",
-                key="download_pdf"
-            )
-        with col3:
-            st.download_button(
-                label="Скачать WORD",
-                data=st.session_state.test_word,
-                file_name="generated_test.docx",
-                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                key="download_word"
-            )
+        if st.session_state.get('export_id'):
+            with col2:
+                export_download_button("pdf", "PDF", "application/pdf")
+            with col3:
+                export_download_button(
+                    "docx", "WORD",
+                    "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+                )
 
 if __name__ == "__main__":
     show_generate_page()
\ No newline at end of file
@@ -21,7 +21,7 @@ def show_profile_page():
     
     if st.button("Обновить список документов"):
         with st.spinner("Обновление..."):
-            st.session_state.documents = list_documents()
+            st.session_state.documents = list_documents(refresh=True)
     
     if "documents" not in st.session_state:
         st.session_state.documents = list_documents()
@@ -51,7 +51,7 @@ def show_profile_page():
     
     if st.button("Обновить список PDF тестов"):
         with st.spinner("Обновление..."):
-            st.session_state.test_pdfs = list_test_pdfs()
+            st.session_state.test_pdfs = list_test_pdfs(refresh=True)
     
     if "test_pdfs" not in st.session_state:
         st.session_state.test_pdfs = list_test_pdfs()
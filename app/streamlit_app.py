@@ -1,10 +1,5 @@
 # app/streamlit_app.py - ИСПРАВЛЕННАЯ ВЕРСИЯ
 import streamlit as st
-import sys
-import os
-
-# Добавляем путь к папке api для импорта
-sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from auth_utils import require_auth, logout_user, init_session_state, get_current_client_id
 from right_sidebar import display_sidebar
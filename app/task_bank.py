@@ -0,0 +1,333 @@
+# task_bank.py - банк задач из tasks.xml: потоковый разбор, индексы и снапшот для больших файлов
+import os
+import sqlite3
+import threading
+import itertools
+import xml.etree.ElementTree as ET
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from task_vocabulary import normalize_difficulty, normalize_question_type
+
+XML_FILE_PATH = os.path.join(os.path.dirname(__file__), "tasks.xml")
+# Файлы от этого размера не держатся в памяти целиком: они компилируются
+# в SQLite-снапшот рядом с XML и читаются через mmap
+TASK_BANK_SNAPSHOT_MIN_BYTES = int(os.getenv("TASK_BANK_SNAPSHOT_MIN_BYTES", str(1024 * 1024)))
+TASK_BANK_MMAP_BYTES = int(os.getenv("TASK_BANK_MMAP_BYTES", str(256 * 1024 * 1024)))
+SNAPSHOT_BATCH_SIZE = 5000
+# Меняется при изменении схемы снапшота или нормализации значений
+SNAPSHOT_VERSION = 2
+
+# Ключ индекса: нормализованные (subject, topic, difficulty, type), None - любое значение
+IndexKey = Tuple[Optional[str], Optional[str], Optional[str], Optional[str]]
+FileSignature = Tuple[int, int]
+
+
+class Task:
+    __slots__ = ("question", "type", "difficulty", "answer", "subject", "topic")
+
+    def __init__(self, question: str, type: str, difficulty: str, answer: str, subject: str, topic: str):
+        self.question = question
+        self.type = type
+        self.difficulty = difficulty
+        self.answer = answer
+        self.subject = subject
+        self.topic = topic
+
+
+def _norm(value: Optional[str]) -> Optional[str]:
+    return value.strip().lower() if value else None
+
+
+def _norm_difficulty(value: Optional[str]) -> Optional[str]:
+    # Нераспознанное значение остается как есть: по нему все равно можно фильтровать
+    return normalize_difficulty(value) or _norm(value)
+
+
+def _norm_type(value: Optional[str]) -> Optional[str]:
+    return normalize_question_type(value) or _norm(value)
+
+
+def _index_key(subject: Optional[str], topic: Optional[str], difficulty: Optional[str],
+               task_type: Optional[str]) -> "IndexKey":
+    return _norm(subject), _norm(topic), _norm_difficulty(difficulty), _norm_type(task_type)
+
+
+def _child_text(elem: ET.Element, tag: str) -> str:
+    child = elem.find(tag)
+    return child.text if child is not None and child.text else ""
+
+
+def iter_tasks(path: str) -> Iterator[Task]:
+    """Потоково читает XML и отдает задачи по одной, очищая уже разобранные элементы"""
+    subject_name = None
+    topic_name = None
+    for event, elem in ET.iterparse(path, events=("start", "end")):
+        tag = elem.tag
+        if event == "start":
+            if tag == "subject":
+                subject_name = elem.get("name")
+            elif tag == "topic":
+                topic_name = elem.get("name")
+            continue
+
+        if tag == "task":
+            if subject_name and topic_name:
+                question = _child_text(elem, "question")
+                task_type = _child_text(elem, "type")
+                difficulty = _child_text(elem, "difficulty")
+                answer = _child_text(elem, "answer")
+                if all([question, task_type, difficulty, answer]):
+                    yield Task(question, task_type, difficulty, answer, subject_name, topic_name)
+                else:
+                    print(f"Warning: Incomplete task in {subject_name}/{topic_name}: {question}")
+            elem.clear()
+        elif tag == "topic":
+            topic_name = None
+            elem.clear()
+        elif tag == "subject":
+            subject_name = None
+            elem.clear()
+
+
+def parse_tasks(path: str) -> Dict[str, Dict[str, List[Task]]]:
+    """Разбирает XML-файл в словарь {subject: {topic: [Task]}}"""
+    tasks_dict: Dict[str, Dict[str, List[Task]]] = {}
+    for task in iter_tasks(path):
+        tasks_dict.setdefault(task.subject, {}).setdefault(task.topic, []).append(task)
+    return tasks_dict
+
+
+def file_signature(path: str) -> Optional[FileSignature]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class MemoryIndex:
+    """Все задачи в памяти; каждая занесена под все 16 комбинаций "значение или любое" """
+
+    def __init__(self, tree: Dict[str, Dict[str, List[Task]]]):
+        self._tree = tree
+        self._index: Dict[IndexKey, List[Task]] = {}
+        for topics in tree.values():
+            for tasks in topics.values():
+                for task in tasks:
+                    fields = _index_key(task.subject, task.topic, task.difficulty, task.type)
+                    for key in itertools.product(*((value, None) for value in fields)):
+                        self._index.setdefault(key, []).append(task)
+
+    def tree(self) -> Dict[str, Dict[str, List[Task]]]:
+        return self._tree
+
+    def subjects(self) -> List[str]:
+        return list(self._tree)
+
+    def topics(self, subject: str) -> List[str]:
+        return list(self._tree.get(subject, {}))
+
+    def find(self, key: IndexKey, limit: Optional[int] = None) -> List[Task]:
+        tasks = self._index.get(key, [])
+        return tasks[:limit] if limit else list(tasks)
+
+    def count(self, key: IndexKey) -> int:
+        return len(self._index.get(key, []))
+
+
+def compile_snapshot(xml_path: str, snapshot_path: str, signature: FileSignature) -> None:
+    """Компилирует XML в SQLite-снапшот, не держа все задачи в памяти; замена файла атомарна"""
+    tmp_path = f"{snapshot_path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript('''
+            PRAGMA journal_mode = OFF;
+            PRAGMA synchronous = OFF;
+            CREATE TABLE meta (mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL, version INTEGER NOT NULL);
+            CREATE TABLE tasks (
+                id INTEGER PRIMARY KEY,
+                subject TEXT NOT NULL,
+                topic TEXT NOT NULL,
+                difficulty TEXT NOT NULL,
+                type TEXT NOT NULL,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                subject_n TEXT NOT NULL,
+                topic_n TEXT NOT NULL,
+                difficulty_n TEXT NOT NULL,
+                type_n TEXT NOT NULL
+            );
+        ''')
+        insert_sql = 'INSERT INTO tasks VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+        batch = []
+        for task in iter_tasks(xml_path):
+            batch.append((
+                task.subject, task.topic, task.difficulty, task.type, task.question, task.answer,
+                *_index_key(task.subject, task.topic, task.difficulty, task.type)
+            ))
+            if len(batch) >= SNAPSHOT_BATCH_SIZE:
+                conn.executemany(insert_sql, batch)
+                batch.clear()
+        if batch:
+            conn.executemany(insert_sql, batch)
+        # Индексы строятся после вставки - так быстрее, чем поддерживать их построчно
+        conn.executescript('''
+            CREATE INDEX idx_tasks_filter ON tasks(subject_n, topic_n, difficulty_n, type_n);
+            CREATE INDEX idx_tasks_subject_difficulty ON tasks(subject_n, difficulty_n, type_n);
+            CREATE INDEX idx_tasks_subject_type ON tasks(subject_n, type_n);
+        ''')
+        conn.execute('INSERT INTO meta VALUES (?, ?, ?)', (*signature, SNAPSHOT_VERSION))
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, snapshot_path)
+
+
+def read_snapshot_signature(snapshot_path: str) -> Optional[FileSignature]:
+    if not os.path.exists(snapshot_path):
+        return None
+    try:
+        conn = sqlite3.connect(f"file:{snapshot_path}?mode=ro", uri=True)
+        try:
+            row = conn.execute('SELECT mtime_ns, size, version FROM meta').fetchone()
+        finally:
+            conn.close()
+        # Снапшот старой версии считается отсутствующим и пересобирается
+        return (row[0], row[1]) if row and row[2] == SNAPSHOT_VERSION else None
+    except sqlite3.Error:
+        return None
+
+
+class SnapshotIndex:
+    """Задачи в SQLite-снапшоте, открытом только на чтение через mmap; в памяти только ответы на запросы"""
+
+    _COLUMNS = ("subject_n", "topic_n", "difficulty_n", "type_n")
+
+    def __init__(self, snapshot_path: str):
+        self._conn = sqlite3.connect(f"file:{snapshot_path}?mode=ro", uri=True, check_same_thread=False)
+        self._conn.execute(f'PRAGMA mmap_size = {TASK_BANK_MMAP_BYTES}')
+        self._lock = threading.Lock()
+
+    def _where(self, key: IndexKey) -> Tuple[str, list]:
+        clauses, params = [], []
+        for column, value in zip(self._COLUMNS, key):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def _query(self, sql: str, params: list) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def tree(self) -> Dict[str, Dict[str, List[Task]]]:
+        tasks_dict: Dict[str, Dict[str, List[Task]]] = {}
+        for task in self.find((None, None, None, None)):
+            tasks_dict.setdefault(task.subject, {}).setdefault(task.topic, []).append(task)
+        return tasks_dict
+
+    def subjects(self) -> List[str]:
+        return [row[0] for row in self._query('SELECT subject FROM tasks GROUP BY subject ORDER BY MIN(id)', [])]
+
+    def topics(self, subject: str) -> List[str]:
+        rows = self._query('SELECT topic FROM tasks WHERE subject = ? GROUP BY topic ORDER BY MIN(id)', [subject])
+        return [row[0] for row in rows]
+
+    def find(self, key: IndexKey, limit: Optional[int] = None) -> List[Task]:
+        where, params = self._where(key)
+        sql = f'SELECT question, type, difficulty, answer, subject, topic FROM tasks{where} ORDER BY id'
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return [Task(*row) for row in self._query(sql, params)]
+
+    def count(self, key: IndexKey) -> int:
+        where, params = self._where(key)
+        return self._query(f'SELECT COUNT(*) FROM tasks{where}', params)[0][0]
+
+    def close(self) -> None:
+        # Под той же блокировкой, что и запросы: закрытие не обрывает выполняющийся запрос
+        with self._lock:
+            self._conn.close()
+
+
+class TaskBank:
+    """Банк задач: перечитывает файл только при изменении mtime; большие файлы обслуживаются из снапшота"""
+
+    def __init__(self, path: str = XML_FILE_PATH, snapshot_min_bytes: int = TASK_BANK_SNAPSHOT_MIN_BYTES):
+        self.path = path
+        self.snapshot_path = f"{path}.snapshot.sqlite"
+        self.snapshot_min_bytes = snapshot_min_bytes
+        self._lock = threading.Lock()
+        self._signature: Optional[FileSignature] = None
+        self._store = MemoryIndex({})
+
+    def _load(self, signature: Optional[FileSignature]):
+        if signature is None:
+            return MemoryIndex({})
+        if signature[1] >= self.snapshot_min_bytes:
+            try:
+                if read_snapshot_signature(self.snapshot_path) != signature:
+                    compile_snapshot(self.path, self.snapshot_path, signature)
+                return SnapshotIndex(self.snapshot_path)
+            except ET.ParseError:
+                raise
+            except Exception as e:
+                # Снапшот - только ускорение: без него (нет места, каталог только на чтение) банк читается в память
+                print(f"Task bank snapshot unavailable, loading {self.path} into memory: {e}")
+        return MemoryIndex(parse_tasks(self.path))
+
+    def refresh(self):
+        """
+        Перечитывает файл, если он изменился с прошлой загрузки, и возвращает текущее хранилище.
+        Читатели работают с возвращенным объектом: прежний снапшот не закрывается явно,
+        его соединение закроется сборщиком мусора, когда последний запрос к нему завершится
+        """
+        signature = file_signature(self.path)
+        if signature == self._signature:
+            return self._store
+        with self._lock:
+            if signature == self._signature:
+                return self._store
+            try:
+                store = self._load(signature)
+            except ET.ParseError as e:
+                print(f"XML Parse Error: {e}")
+                store = MemoryIndex({})
+            except Exception as e:
+                # Файл мог быть недочитан (например, его переписывают): остаются прежние задачи, повтор при следующем вызове
+                print(f"Unexpected error parsing XML file: {e}")
+                return self._store
+            self._store = store
+            self._signature = signature
+            return store
+
+    def tree(self) -> Dict[str, Dict[str, List[Task]]]:
+        """Полный словарь {subject: {topic: [Task]}}; для больших банков лучше subjects()/topics()"""
+        return self.refresh().tree()
+
+    def subjects(self) -> List[str]:
+        return self.refresh().subjects()
+
+    def topics(self, subject: str) -> List[str]:
+        return self.refresh().topics(subject)
+
+    def find(self, subject: Optional[str] = None, topic: Optional[str] = None,
+             difficulty: Optional[str] = None, task_type: Optional[str] = None,
+             limit: Optional[int] = None) -> List[Task]:
+        """Задачи, подходящие под фильтры, в порядке файла"""
+        return self.refresh().find(_index_key(subject, topic, difficulty, task_type), limit)
+
+    def count(self, subject: Optional[str] = None, topic: Optional[str] = None,
+              difficulty: Optional[str] = None, task_type: Optional[str] = None) -> int:
+        return self.refresh().count(_index_key(subject, topic, difficulty, task_type))
+
+
+_task_bank = TaskBank()
+
+
+def get_task_bank() -> TaskBank:
+    """Один банк задач на процесс: модули не перезагружаются между rerun-ами Streamlit"""
+    return _task_bank
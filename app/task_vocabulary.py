@@ -0,0 +1,33 @@
+# task_vocabulary.py - словарь сложностей и типов вопросов. Одинаковая копия лежит в api/ и app/
+# (UI не импортирует код API); совпадение файлов проверяет api/tests/test_task_vocabulary.py
+from typing import Optional
+
+# UI, XML и API называют одну и ту же сложность по-разному; ключи - значения DifficultyLevel/QuestionType
+DIFFICULTY_ALIASES = {
+    "elementary": ("elementary", "для начальных классов", "легкий", "лёгкий", "простой"),
+    "middle": ("middle", "для средних классов", "средний"),
+    "high": ("high", "для старших классов", "сложный", "высокий"),
+    "university": ("university", "для студентов", "очень сложный", "продвинутый"),
+}
+
+QUESTION_TYPE_ALIASES = {
+    "multiple_choice": ("multiple_choice", "вопрос с выбором ответа", "выбор варианта", "с выбором ответа"),
+    "open_ended": ("open_ended", "вопрос без выбора ответа", "открытый ответ", "открытый вопрос"),
+}
+
+_DIFFICULTY_LOOKUP = {alias: level for level, aliases in DIFFICULTY_ALIASES.items() for alias in aliases}
+_QUESTION_TYPE_LOOKUP = {alias: qtype for qtype, aliases in QUESTION_TYPE_ALIASES.items() for alias in aliases}
+
+
+def normalize_difficulty(value: Optional[str]) -> Optional[str]:
+    """Приводит сложность из любого словаря к значению DifficultyLevel; None, если не распознана"""
+    if not value:
+        return None
+    return _DIFFICULTY_LOOKUP.get(value.strip().lower())
+
+
+def normalize_question_type(value: Optional[str]) -> Optional[str]:
+    """Приводит тип вопроса из любого словаря к значению QuestionType; None, если не распознан"""
+    if not value:
+        return None
+    return _QUESTION_TYPE_LOOKUP.get(value.strip().lower())